@@ -1,4 +1,4 @@
-from typing import Any, Union
+from typing import Any, Optional, Union
 from pydantic import BaseModel
 
 
@@ -25,6 +25,8 @@ class Question(BaseModel):
     previous_intent: str = ""
     entity_user_select: dict = {}
     entity_retrieval: list = []
+    # 跳过 SQL 结果缓存, 总是查询数据库
+    bypass_result_cache: bool = False
 
 
 class Example(BaseModel):
@@ -85,6 +87,10 @@ class SQLSearchResult(BaseModel):
     sql_gen_process: str
     data_analyse: str
     sql_data_chart: list[ChartEntity]
+    # sql_data 只包含结果的前面部分, 行数 / 内存达到 profile 的上限
+    sql_data_truncated: bool = False
+    # 结果被截断且开启了 count_total 时的总行数
+    sql_data_total_count: Optional[int] = None
 
 
 class TaskSQLSearchResult(BaseModel):
@@ -1,3 +1,4 @@
+import asyncio
 import json
 
 from dotenv import load_dotenv
@@ -16,9 +17,11 @@ from nlq.core.state import QueryState
 from nlq.core.state_machine import QueryStateMachine
 from utils.logging import getLogger
 from utils.env_var import opensearch_info
+from utils.query_governor import CancelToken
 from utils.tool import generate_log_id, get_current_time, serialize_timestamp
 from .schemas import Question, Example, Option,  Message, HistoryMessage
 from .exception_handler import BizException
+from .worker_pool import EventChannel, WorkerPool
 from utils.constant import BEDROCK_MODEL_IDS
 from .enum import ErrorEnum, ContentEnum
 from fastapi import WebSocket
@@ -96,7 +99,7 @@ def get_history_by_user_profile(user_id: str, profile_name: str):
     return chat_history
 
 
-def query_ask(question: Question):
+def build_processing_context(question: Question, cancel_token: CancelToken = None) -> ProcessingContext:
     logger.info(question)
     session_id = question.session_id
     user_id = question.user_id
@@ -114,10 +117,7 @@ def query_ask(question: Question):
     answer_with_insights = question.answer_with_insights
     context_window = question.context_window
 
-    log_id = generate_log_id()
-
-    all_profiles = ProfileManagement.get_all_profiles_with_info()
-    database_profile = all_profiles[selected_profile]
+    database_profile = ProfileManagement.get_profile_info_by_name(selected_profile)
 
     if database_profile['db_url'] == '':
         conn_name = database_profile['conn_name']
@@ -157,219 +157,51 @@ def query_ask(question: Question):
         entity_same_name_select={},
         user_query_history=user_query_history,
         opensearch_info=opensearch_info,
-        previous_state=previous_state)
+        previous_state=previous_state,
+        bypass_result_cache=question.bypass_result_cache)
+    if cancel_token is not None:
+        processing_context.cancel_token = cancel_token
+    return processing_context
 
-    state_machine = QueryStateMachine(processing_context)
-    if state_machine.previous_state == QueryState.USER_SELECT_ENTITY:
-        state_machine.transition(QueryState.USER_SELECT_ENTITY)
-    while state_machine.get_state() != QueryState.COMPLETE and state_machine.get_state() != QueryState.ERROR:
-        if state_machine.get_state() == QueryState.INITIAL:
-            state_machine.handle_initial()
-        elif state_machine.get_state() == QueryState.REJECT_INTENT:
-            state_machine.handle_reject_intent()
-        elif state_machine.get_state() == QueryState.KNOWLEDGE_SEARCH:
-            state_machine.handle_knowledge_search()
-        elif state_machine.get_state() == QueryState.ENTITY_RETRIEVAL:
-            state_machine.handle_entity_retrieval()
-        elif state_machine.get_state() == QueryState.QA_RETRIEVAL:
-            state_machine.handle_qa_retrieval()
-        elif state_machine.get_state() == QueryState.SQL_GENERATION:
-            state_machine.handle_sql_generation()
-        elif state_machine.get_state() == QueryState.INTENT_RECOGNITION:
-            state_machine.handle_intent_recognition()
-        elif state_machine.get_state() == QueryState.EXECUTE_QUERY:
-            state_machine.handle_execute_query()
-        elif state_machine.get_state() == QueryState.ANALYZE_DATA:
-            state_machine.handle_analyze_data()
-        elif state_machine.get_state() == QueryState.ASK_ENTITY_SELECT:
-            state_machine.handle_entity_selection()
-        elif state_machine.get_state() == QueryState.AGENT_TASK:
-            state_machine.handle_agent_task()
-        elif state_machine.get_state() == QueryState.AGENT_SEARCH:
-            state_machine.handle_agent_sql_generation()
-        elif state_machine.get_state() == QueryState.AGENT_DATA_SUMMARY:
-            state_machine.handle_agent_analyze_data()
-        elif state_machine.get_state() == QueryState.USER_SELECT_ENTITY:
-            state_machine.handle_user_select_entity()
-        else:
-            state_machine.state = QueryState.ERROR
 
-    if processing_context.gen_suggested_question_flag and state_machine.get_answer().query_intent != "entity_select":
-        if state_machine.search_intent_flag or state_machine.agent_intent_flag:
-            state_machine.handle_suggest_question()
-
-    if state_machine.get_state() == QueryState.COMPLETE:
-        state_machine.handle_data_visualization()
-        state_machine.handle_add_to_log(log_id=log_id)
-
-    return state_machine.get_answer()
+def query_ask(question: Question):
+    processing_context = build_processing_context(question)
+    state_machine = QueryStateMachine(processing_context)
+    return state_machine.run(log_id=generate_log_id())
 
 
 async def ask_websocket(websocket: WebSocket, question: Question):
-    logger.info(question)
-    session_id = question.session_id
-    user_id = question.user_id
-    username = question.username
-
-    intent_ner_recognition_flag = question.intent_ner_recognition_flag
-    agent_cot_flag = question.agent_cot_flag
-
-    model_type = question.bedrock_model_id
-    search_box = question.query
-    selected_profile = question.profile_name
-    use_rag_flag = question.use_rag_flag
-    explain_gen_process_flag = question.explain_gen_process_flag
-    gen_suggested_question_flag = question.gen_suggested_question_flag
-    answer_with_insights = question.answer_with_insights
-    context_window = question.context_window
-
-    log_id = generate_log_id()
-
-    all_profiles = ProfileManagement.get_all_profiles_with_info()
-    database_profile = all_profiles[selected_profile]
-
-    if database_profile['db_url'] == '':
-        conn_name = database_profile['conn_name']
-        db_url = ConnectionManagement.get_db_url_by_name(conn_name)
-        database_profile['db_url'] = db_url
-        database_profile['db_type'] = ConnectionManagement.get_db_type_by_name(conn_name)
-
-    user_query_history = []
-    if context_window > 0:
-        user_query_history = LogManagement.get_history_by_session(profile_name=selected_profile, user_id=user_id,
-                                                                  session_id=session_id, size=context_window,
-                                                                  log_type='chat_history')
-        user_query_history.append("user:" + search_box)
+    """
+    Run the question on the worker pool, state events are pushed through an asyncio.Queue
+    and sent by this coroutine, so the event loop keeps serving the other connections.
+    """
+    channel = EventChannel()
+    cancel_token = CancelToken()
+
+    async def send_state(content, status):
+        try:
+            await response_websocket(websocket, question.session_id, content, ContentEnum.STATE, status,
+                                     question.user_id)
+        except Exception:
+            # 客户端已经断开, 取消正在执行的 SQL
+            cancel_token.cancel('client disconnected')
+            raise
+
+    sender = asyncio.create_task(channel.consume(send_state))
+    try:
+        return await WorkerPool.run(run_ask_websocket, question, channel.emit, cancel_token)
+    except asyncio.CancelledError:
+        cancel_token.cancel('request cancelled')
+        raise
+    finally:
+        channel.close()
+        await sender
 
-    if question.previous_intent == "entity_select":
-        previous_state = QueryState.USER_SELECT_ENTITY.name
-    else:
-        previous_state = QueryState.INITIAL.name
-    processing_context = ProcessingContext(
-        search_box=search_box,
-        query_rewrite=question.query_rewrite,
-        session_id=session_id,
-        user_id=user_id,
-        username=username,
-        selected_profile=selected_profile,
-        database_profile=database_profile,
-        model_type=model_type,
-        use_rag_flag=use_rag_flag,
-        intent_ner_recognition_flag=intent_ner_recognition_flag,
-        agent_cot_flag=agent_cot_flag,
-        explain_gen_process_flag=explain_gen_process_flag,
-        visualize_results_flag=True,
-        data_with_analyse=answer_with_insights,
-        gen_suggested_question_flag=gen_suggested_question_flag,
-        auto_correction_flag=True,
-        context_window=context_window,
-        entity_same_name_select={},
-        user_query_history=user_query_history,
-        opensearch_info=opensearch_info,
-        previous_state=previous_state)
 
+def run_ask_websocket(question: Question, emit_state, cancel_token=None):
+    processing_context = build_processing_context(question, cancel_token)
     state_machine = QueryStateMachine(processing_context)
-    if state_machine.previous_state == QueryState.USER_SELECT_ENTITY:
-        state_machine.transition(QueryState.USER_SELECT_ENTITY)
-    while state_machine.get_state() != QueryState.COMPLETE and state_machine.get_state() != QueryState.ERROR:
-        if state_machine.get_state() == QueryState.INITIAL:
-            await response_websocket(websocket, session_id, "Query Rewrite", ContentEnum.STATE, "start",
-                                     user_id)
-            state_machine.handle_initial()
-            await response_websocket(websocket, session_id, "Query Rewrite", ContentEnum.STATE, "end",
-                                     user_id)
-        elif state_machine.get_state() == QueryState.REJECT_INTENT:
-            await response_websocket(websocket, session_id, "Reject Intent", ContentEnum.STATE, "start",
-                                     user_id)
-            state_machine.handle_reject_intent()
-            await response_websocket(websocket, session_id, "Reject Intent", ContentEnum.STATE, "end",
-                                     user_id)
-        elif state_machine.get_state() == QueryState.KNOWLEDGE_SEARCH:
-            await response_websocket(websocket, session_id, "Knowledge Search Intent", ContentEnum.STATE, "start",
-                                     user_id)
-            state_machine.handle_knowledge_search()
-            await response_websocket(websocket, session_id, "Knowledge Search Intent", ContentEnum.STATE, "end",
-                                     user_id)
-        elif state_machine.get_state() == QueryState.ENTITY_RETRIEVAL:
-            await response_websocket(websocket, session_id, "Entity Info Retrieval", ContentEnum.STATE, "start",
-                                     user_id)
-            state_machine.handle_entity_retrieval()
-            await response_websocket(websocket, session_id, "Entity Info Retrieval", ContentEnum.STATE, "end",
-                                     user_id)
-        elif state_machine.get_state() == QueryState.QA_RETRIEVAL:
-            await response_websocket(websocket, session_id, "QA Info Retrieval", ContentEnum.STATE, "start",
-                                     user_id)
-            state_machine.handle_qa_retrieval()
-            await response_websocket(websocket, session_id, "QA Info Retrieval", ContentEnum.STATE, "end",
-                                     user_id)
-        elif state_machine.get_state() == QueryState.SQL_GENERATION:
-            await response_websocket(websocket, session_id, "Generating SQL", ContentEnum.STATE, "start", user_id)
-            state_machine.handle_sql_generation()
-            await response_websocket(websocket, session_id, "Generating SQL", ContentEnum.STATE, "end", user_id)
-        elif state_machine.get_state() == QueryState.INTENT_RECOGNITION:
-            await response_websocket(websocket, session_id, "Query Intent Analyse", ContentEnum.STATE, "start", user_id)
-            state_machine.handle_intent_recognition()
-            await response_websocket(websocket, session_id, "Query Intent Analyse", ContentEnum.STATE, "end", user_id)
-        elif state_machine.get_state() == QueryState.EXECUTE_QUERY:
-            await response_websocket(websocket, session_id, "Database SQL Execution", ContentEnum.STATE, "start",
-                                     user_id)
-            state_machine.handle_execute_query()
-            await response_websocket(websocket, session_id, "Database SQL Execution", ContentEnum.STATE, "end",
-                                     user_id)
-        elif state_machine.get_state() == QueryState.ANALYZE_DATA:
-            await response_websocket(websocket, session_id, "Generating Data Insights", ContentEnum.STATE,
-                                     "start", user_id)
-            state_machine.handle_analyze_data()
-            await response_websocket(websocket, session_id, "Generating Data Insights", ContentEnum.STATE,
-                                     "end", user_id)
-        elif state_machine.get_state() == QueryState.ASK_ENTITY_SELECT:
-            state_machine.handle_entity_selection()
-        elif state_machine.get_state() == QueryState.AGENT_TASK:
-            await response_websocket(websocket, session_id, "Agent Task Split", ContentEnum.STATE,
-                                     "start", user_id)
-            state_machine.handle_agent_task()
-            await response_websocket(websocket, session_id, "Agent Task Split", ContentEnum.STATE,
-                                     "end", user_id)
-        elif state_machine.get_state() == QueryState.AGENT_SEARCH:
-            # await response_websocket(websocket, session_id, "Agent SQL Generating", ContentEnum.STATE,
-            #                          "start", user_id)
-            await state_machine.handle_agent_sql_generation_websocket(websocket=websocket, session_id=session_id,
-                                                                      user_id=user_id)
-            # state_machine.handle_agent_sql_generation()
-            # await response_websocket(websocket, session_id, "Agent SQL Generating", ContentEnum.STATE,
-            #                          "end", user_id)
-        elif state_machine.get_state() == QueryState.AGENT_DATA_SUMMARY:
-            await response_websocket(websocket, session_id, "Generating Data Insights", ContentEnum.STATE,
-                                     "start", user_id)
-            state_machine.handle_agent_analyze_data()
-            await response_websocket(websocket, session_id, "Generating Data Insights", ContentEnum.STATE,
-                                     "end", user_id)
-        elif state_machine.get_state() == QueryState.USER_SELECT_ENTITY:
-            await response_websocket(websocket, session_id, "User Entity Select", ContentEnum.STATE,
-                                     "start", user_id)
-            state_machine.handle_user_select_entity()
-            await response_websocket(websocket, session_id, "User Entity Select", ContentEnum.STATE,
-                                     "end", user_id)
-        else:
-            state_machine.state = QueryState.ERROR
-
-    if processing_context.gen_suggested_question_flag and state_machine.get_answer().query_intent != "entity_select":
-        if state_machine.search_intent_flag or state_machine.agent_intent_flag:
-            await response_websocket(websocket, session_id, "Generating Suggested Questions", ContentEnum.STATE,
-                                     "start", user_id)
-            state_machine.handle_suggest_question()
-            await response_websocket(websocket, session_id, "Generating Suggested Questions", ContentEnum.STATE,
-                                     "end", user_id)
-
-    if state_machine.get_state() == QueryState.COMPLETE:
-        await response_websocket(websocket, session_id, "Data Visualization", ContentEnum.STATE,
-                                 "start", user_id)
-        state_machine.handle_data_visualization()
-        await response_websocket(websocket, session_id, "Data Visualization", ContentEnum.STATE,
-                                 "end", user_id)
-        state_machine.handle_add_to_log(log_id=log_id)
-
-    return state_machine.get_answer()
+    return state_machine.run(emit_state=emit_state, log_id=generate_log_id())
 
 
 def user_feedback_upvote(data_profiles: str, user_id: str, session_id: str, query: str, query_intent: str,
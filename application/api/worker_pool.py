@@ -0,0 +1,116 @@
+import asyncio
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.logging import getLogger
+
+logger = getLogger()
+
+# 同时处理的 websocket 问题数, 超出的问题在线程池中排队
+WS_WORKER_POOL_SIZE = int(os.getenv('WS_WORKER_POOL_SIZE', '16'))
+
+_CLOSE = object()
+
+
+class EventChannel:
+    """
+    Carries state events from a worker thread to the coroutine that owns the websocket.
+    emit() is thread safe, the events are put on an asyncio.Queue of the event loop that created the channel.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        WorkerPool.register_channel(self)
+
+    def emit(self, *event):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, _CLOSE)
+
+    async def consume(self, handler):
+        """
+        Await handler(*event) for every event until the channel is closed.
+        A failing handler (e.g. the client went away) does not stop the draining.
+        """
+        handler_failed = False
+        while True:
+            event = await self.queue.get()
+            if event is _CLOSE:
+                return
+            if handler_failed:
+                continue
+            try:
+                await handler(*event)
+            except Exception as e:
+                handler_failed = True
+                logger.error(f"Failed to deliver websocket event, dropping the remaining events: {e}")
+
+
+class WorkerPool:
+    """
+    Bounded thread pool running the blocking question pipeline (Bedrock, OpenSearch, SQLAlchemy)
+    off the uvicorn event loop, so one long question does not stall the other connections.
+    """
+    max_workers = max(1, WS_WORKER_POOL_SIZE)
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ws-worker')
+    _lock = threading.Lock()
+    _channels = weakref.WeakSet()
+    submitted = 0
+    active = 0
+    completed = 0
+    failed = 0
+    total_run_seconds = 0.0
+
+    @classmethod
+    def register_channel(cls, channel):
+        with cls._lock:
+            cls._channels.add(channel)
+
+    @classmethod
+    def _run_tracked(cls, func, args, kwargs):
+        with cls._lock:
+            cls.active += 1
+        start_time = time.time()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            with cls._lock:
+                cls.failed += 1
+            raise
+        finally:
+            with cls._lock:
+                cls.active -= 1
+                cls.completed += 1
+                cls.total_run_seconds += time.time() - start_time
+
+    @classmethod
+    async def run(cls, func, *args, **kwargs):
+        """
+        Run func(*args, **kwargs) on the pool and await its result
+        """
+        with cls._lock:
+            cls.submitted += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(cls.executor, cls._run_tracked, func, args, kwargs)
+
+    @classmethod
+    def get_stats(cls):
+        with cls._lock:
+            channels = list(cls._channels)
+            return {
+                'max_workers': cls.max_workers,
+                'active_workers': cls.active,
+                'waiting_tasks': cls.submitted - cls.completed - cls.active,
+                'utilization': round(cls.active / cls.max_workers, 4),
+                'submitted': cls.submitted,
+                'completed': cls.completed,
+                'failed': cls.failed,
+                'avg_run_seconds': round(cls.total_run_seconds / cls.completed, 4) if cls.completed else 0.0,
+                'event_queue_depth': sum(channel.queue.qsize() for channel in channels),
+                'open_event_channels': len(channels),
+            }
@@ -258,6 +258,7 @@ translations = {
         "processing_file": "Processing file {0} of {1}: {2}",
         "batch_insert_progress": "batch insert {0} entity in progress. Please wait.",
         "uploaded_successfully": "{0} uploaded successfully!",
+        "upload_failed_documents": "{0} of {1} documents failed to upload: {2}",
         "total_samples_test": "Total [{0}] samples to be tested !",
         "choose_model": "Choose your model",
         "test_all": "Test All",
@@ -752,6 +753,7 @@ Your sample question 2""",
         "processing_file": "正在处理文件 {0}/{1}: {2}",
         "batch_insert_progress": "批量插入进行中。已上传 {0} 个实体。请稍候。",
         "uploaded_successfully": "{0} 上传成功！",
+        "upload_failed_documents": "{1} 条数据中有 {0} 条上传失败：{2}",
         "sample_added": "样本已添加",
         "update_index": "更新索引",
         "please_input_valid": "请输入有效的问题和答案",
@@ -7,7 +7,17 @@ from api.main import router
 from fastapi.middleware.cors import CORSMiddleware
 from api import service
 from api.schemas import Option
+from api.worker_pool import WorkerPool
+from nlq.business.schema_linking import SchemaLinker
+from nlq.business.semantic_cache import SemanticAnswerCache
+from nlq.data_access.engine_registry import EngineRegistry
+from nlq.data_access.schema_catalog import SchemaCatalog
 from utils.auth import authenticate, skipAuthentication
+from utils.cache import get_cache_stats
+from utils.embedding_cache import EmbeddingCache
+from utils.llm_cache import LLMResponseCache
+from utils.opensearch import get_opensearch_client_stats
+from utils.sql_result_cache import SQLResultCache
 
 MAX_CHAT_WINDOW_SIZE = 10 * 2
 app = FastAPI(title='GenBI')
@@ -75,6 +85,23 @@ def ping():
     return {"status": "ok"}
 
 
+# runtime pool / cache statistics for monitoring
+@app.get("/metrics")
+def metrics():
+    return {
+        "db_engine_pool": EngineRegistry.get_stats(),
+        "opensearch_client_pool": get_opensearch_client_stats(),
+        "cache": get_cache_stats(),
+        "embedding_cache": EmbeddingCache.get_stats(),
+        "llm_cache": LLMResponseCache.get_stats(),
+        "semantic_cache": SemanticAnswerCache.get_stats(),
+        "sql_result_cache": SQLResultCache.get_stats(),
+        "schema_catalog": SchemaCatalog.get_stats(),
+        "schema_linking": SchemaLinker.get_stats(),
+        "websocket_worker_pool": WorkerPool.get_stats(),
+    }
+
+
 @app.get("/option", response_model=Option)
 def option():
     return service.get_option()
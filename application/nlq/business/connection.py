@@ -1,13 +1,19 @@
 
+import json
+
 from nlq.data_access.dynamo_connection import ConnectConfigDao, ConnectConfigEntity
 from nlq.data_access.database import RelationDatabase
+from nlq.data_access.engine_registry import EngineRegistry
+from utils.cache import TTLCache
 from utils.logging import getLogger
+from utils.sql_result_cache import SQLResultCache
 
 logger = getLogger()
 
 
 class ConnectionManagement:
     connection_config_dao = ConnectConfigDao()
+    connection_cache = TTLCache('connection', ttl=300)
 
     @classmethod
     def get_all_connections(cls):
@@ -17,20 +23,46 @@ class ConnectionManagement:
     @classmethod
     def add_connection(cls, conn_name, db_type, db_host, db_port, db_user, db_pwd, db_name, comment):
         cls.connection_config_dao.add_url_db(conn_name, db_type, db_host, db_port, db_user, db_pwd, db_name, comment)
+        cls.connection_cache.invalidate(conn_name)
         logger.info(f"Connection {conn_name} added")
 
     @classmethod
     def get_conn_config_by_name(cls, conn_name):
-        return cls.connection_config_dao.get_by_name(conn_name)
+        return cls.connection_cache.get_or_load(conn_name, lambda: cls.connection_config_dao.get_by_name(conn_name))
+
+    @classmethod
+    def refresh_credentials(cls, conn_name):
+        """
+        Drop the cached config, secret and pooled engine of the connection after the database rejected its
+        credentials, the next lookup reads the rotated secret and builds a new engine
+        """
+        conn_config = cls.get_conn_config_by_name(conn_name)
+        cls.connection_cache.invalidate(conn_name)
+        if conn_config is None:
+            return
+        if conn_config.db_sm:
+            cls.connection_config_dao.invalidate_secret(conn_config.db_sm)
+        try:
+            if conn_config.db_type == 'bigquery':
+                EngineRegistry.dispose(conn_config.db_host, credentials_info=json.loads(conn_config.db_pwd))
+            else:
+                EngineRegistry.dispose(RelationDatabase.get_db_url_by_connection(conn_config))
+        except Exception as e:
+            logger.error(f"Failed to dispose the engine of connection {conn_name}: {e}")
+        logger.info(f"Connection {conn_name} credentials refreshed")
 
     @classmethod
     def update_connection(cls, conn_name, db_type, db_host, db_port, db_user, db_pwd, db_name, comment):
         cls.connection_config_dao.update_db_info(conn_name, db_type, db_host, db_port, db_user, db_pwd, db_name,
                                                  comment)
+        cls.connection_cache.invalidate(conn_name)
+        SQLResultCache.invalidate(conn_name)
         logger.info(f"Connection {conn_name} updated")
 
     @classmethod
     def delete_connection(cls, conn_name):
+        cls.connection_cache.invalidate(conn_name)
+        SQLResultCache.invalidate(conn_name)
         if cls.connection_config_dao.delete(conn_name):
             logger.info(f"Connection {conn_name} deleted")
         else:
@@ -49,8 +81,8 @@ class ConnectionManagement:
         return RelationDatabase.get_all_schema_and_table_names_by_connection(conn_config)
 
     @classmethod
-    def get_table_definition_by_config(cls, conn_config: ConnectConfigEntity, schemas_table_dict):
-        return RelationDatabase.get_table_definition_by_connection(conn_config, schemas_table_dict)
+    def get_table_definition_by_config(cls, conn_config: ConnectConfigEntity, schemas_table_dict, refresh=False):
+        return RelationDatabase.get_table_definition_by_connection(conn_config, schemas_table_dict, refresh=refresh)
 
     @classmethod
     def get_table_column_definition_by_config(cls, conn_config: ConnectConfigEntity, table_names):
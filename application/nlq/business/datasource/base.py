@@ -1,7 +1,8 @@
 import yaml
-import re
 from abc import ABC, abstractmethod
 
+from nlq.business.datasource.rls_policy import CompiledRlsPolicy, RlsPolicyCompiler, RlsTableFilter, \
+    rewrite_with_table_filters
 from nlq.business.login_user import LoginUser
 from utils.logging import getLogger
 
@@ -28,6 +29,10 @@ class DataSourceBase(ABC):
         """Abstract method to get the row-level security mode"""
         pass
 
+    def backslash_escapes(self) -> bool:
+        """Whether a backslash escapes the next character in the string literals of the dialect"""
+        return True
+
     @staticmethod
     def validate_row_level_security_config(rls_config: str) -> bool:
         """method to validate row-level security config"""
@@ -41,17 +46,15 @@ class DataSourceBase(ABC):
     def row_level_security_control(self, sql: str, rls_config: str, login_user: LoginUser) -> str:
         """Method to apply row-level security control"""
         replaced_sql = sql
-        rls_config_obj = {'tables': []}
         try:
-            if rls_config:
-                rls_config_obj = yaml.safe_load(rls_config)
             # YAML format:
             # {'tables': [{'table_name': 'table_a', 'columns': [
             # {'column_name': 'username', 'column_value': '$login_user.username'}]}]}
-            table_statements = self.convert_rls_yaml_to_table_subquery(login_user, rls_config_obj)
+            # 配置只在第一次使用时解析, 之后复用编译后的策略
+            policy = RlsPolicyCompiler.compile(rls_config)
 
             logger.info(f'original SQL: {sql}')
-            replaced_sql = self.replace_table_with_cte(sql, table_statements)
+            replaced_sql = policy.apply(sql, login_user, self.backslash_escapes())
             logger.info(f'RLS applied SQL: {replaced_sql}')
         except Exception as e:
             logger.exception('Failed to apply RLS config')
@@ -64,66 +67,13 @@ class DataSourceBase(ABC):
     @staticmethod
     def convert_rls_yaml_to_table_subquery(login_user, rls_config_obj):
         """method to convert RLS YAML to table subqueries"""
-        table_statements = {}
-        for table in rls_config_obj['tables']:
-            table_name = table['table_name']
-
-            condition = ''
-            columns = table['columns']
-            for column in columns:
-                column_name = column['column_name']
-                column_value = column['column_value']
-
-                if column_value == '$login_user.username' and login_user is not None:
-                    column_value = login_user.get_username()
-
-                if not condition:
-                    condition += condition + f"{column_name} = '{column_value}'"
-                else:
-                    condition += condition + f" AND {column_name} = '{column_value}'"
-
-            statement = f'(SELECT * FROM {table_name} WHERE {condition})'
-            table_statements[table_name] = statement
-        return table_statements
+        return CompiledRlsPolicy(rls_config_obj).table_statements(login_user)
 
     @staticmethod
     def replace_table_with_cte(sql, table_config: dict):
         """method to replace tables with CTEs"""
-        cte_sql = ''
-        sql_splits = ['']
-        origin_sql_has_cte = False
-        if 'with' in sql:
-            sql_splits = sql.split('with')
-            origin_sql_has_cte = True
-        elif 'WITH' in sql:
-            sql_splits = sql.split('WITH')
-            origin_sql_has_cte = True
-        else:
-            # cte_sql = "WITH\n"
-            sql_splits.append(sql)
-
-        for table_name, sub_query in table_config.items():
-            if '.' in table_name:
-                # 如果表名包含schema name(格式: schema.table), 则将.替换成__
-                schema_name, table_name_alone = table_name.split('.')
-                table_name_replaced = table_name.replace('.', '__')
-                if table_name in sql_splits[1]:
-                    # 替换带schema的表名
-                    sql_splits[1] = re.sub(r'\b{}\b'.format(table_name), table_name_replaced, sql_splits[1])
-                elif table_name_alone in sql_splits[1]:
-                    # 替换不带schema的表名
-                    sql_splits[1] = re.sub(r'\b{}\b'.format(table_name_alone), table_name_replaced, sql_splits[1])
-
-                table_name = table_name_replaced
-            cte_sql += f"/* rls applied */ {table_name} AS {sub_query},\n"
-        if origin_sql_has_cte:
-            cte_sql = cte_sql[:-1]
-        else:
-            cte_sql = cte_sql[:-2]
-
-        return f'''WITH
-{cte_sql}
-{sql_splits[1]}'''
+        return rewrite_with_table_filters(sql, [(RlsTableFilter(table_name, []), sub_query)
+                                                for table_name, sub_query in table_config.items()])
 
     def post_sql_generation(self, sql: str, rls_config: str = None, login_user: LoginUser = None) -> str:
         """Method to post-process SQL after generation"""
@@ -0,0 +1,223 @@
+import hashlib
+import re
+
+import yaml
+
+from utils.cache import TTLCache
+from utils.logging import getLogger
+
+logger = getLogger()
+
+LOGIN_USERNAME = '$login_user.username'
+
+# every blank has a single way to match: one whitespace character, or a comment up to its first end,
+# so a failed match after a long run of blanks backtracks in linear time
+_BLANK = r"(?:\s|--[^\n]*(?:\n|\Z)|/\*(?:[^*]|\*(?!/))*(?:\*/|\Z))*"
+_NAME_PART = r'(?:[^\W\d][\w$]*|`(?:[^`]|``)*`|"(?:[^"]|"")*"|\[[^\]]*\])'
+# only the tokens changing the structure are scanned, strings, comments and quoted identifiers are skipped
+_SCAN_PATTERN = re.compile(r"""
+    (?P<skip>--[^\n]*|/\*.*?(?:\*/|$)|'(?:[^'\\]|\\.|'')*'?|`(?:[^`]|``)*`?|"(?:[^"]|"")*"?)
+  | (?P<open>\()
+  | (?P<close>\))
+  | (?P<comma>,)
+  | (?P<word>[^\W\d][\w$]*)
+""", re.S | re.X)
+_LEADING_WITH_PATTERN = re.compile(_BLANK + r"WITH\b", re.S | re.I)
+_QUERY_START_PATTERN = re.compile(_BLANK + r"(?:SELECT|WITH)\b", re.S | re.I)
+_TABLE_PATTERN = re.compile(_BLANK + r"(?:(?:LATERAL|ONLY)\b" + _BLANK + r")?"
+                            r"(?P<name>" + _NAME_PART + r"(?:\." + _NAME_PART + r")*)"
+                            + _BLANK + r"(?P<next>\(|" + _NAME_PART + r")?", re.S | re.I)
+
+# words starting or ending the FROM list of a query
+_FROM_LIST_WORDS = frozenset({
+    'FROM', 'JOIN', 'STRAIGHT_JOIN', 'WHERE', 'GROUP', 'ORDER', 'HAVING', 'LIMIT', 'UNION', 'INTERSECT', 'EXCEPT',
+    'MINUS', 'WINDOW', 'QUALIFY', 'ON', 'USING', 'SELECT', 'SETTINGS', 'PREWHERE',
+})
+# words following a table reference that are not its alias
+_CLAUSE_WORDS = frozenset({
+    'ON', 'USING', 'WHERE', 'GROUP', 'ORDER', 'HAVING', 'LIMIT', 'OFFSET', 'UNION', 'INTERSECT', 'EXCEPT',
+    'MINUS', 'JOIN', 'INNER', 'LEFT', 'RIGHT', 'FULL', 'OUTER', 'CROSS', 'NATURAL', 'LATERAL', 'WINDOW',
+    'QUALIFY', 'FETCH', 'FOR', 'TABLESAMPLE', 'PARTITION', 'SETTINGS', 'FORMAT', 'PREWHERE', 'FINAL', 'SAMPLE',
+    'ARRAY', 'GLOBAL', 'ANY', 'ALL', 'ASOF', 'SEMI', 'ANTI', 'STRAIGHT_JOIN', 'USE', 'FORCE', 'IGNORE',
+    'DISTRIBUTE', 'SORT', 'CLUSTER', 'SELECT', 'FROM',
+})
+
+
+def quote_literal(value, backslash_escapes=True):
+    """
+    Render a user value as a SQL string literal, quotes in the value are doubled.
+    In dialects where a backslash escapes the next character (MySQL, StarRocks, Hive, ClickHouse),
+    backslashes are doubled too, otherwise a backslash in the value could escape the closing quote.
+    """
+    value = str(value)
+    if backslash_escapes:
+        value = value.replace('\\', '\\\\')
+    return "'" + value.replace("'", "''") + "'"
+
+
+def split_table_name(table_name):
+    """
+    `db`.`table`, "schema"."table", [dbo].[table] -> ('db', 'table'), lower case without quotes
+    """
+    return tuple(part.strip().strip('`"[]').lower() for part in table_name.split('.') if part.strip())
+
+
+class ParsedSql:
+    """
+    Table references of one SQL statement: the names following FROM / JOIN in the statement, its CTE bodies
+    and subqueries. Strings, comments and function arguments such as EXTRACT(YEAR FROM col) are skipped.
+    """
+
+    def __init__(self, sql):
+        self.sql = sql
+        # (start, end, name parts, has alias)
+        self.table_references = []
+        leading_with = _LEADING_WITH_PATTERN.match(sql)
+        self.leading_with_end = leading_with.end() if leading_with else None
+        self._parse()
+
+    def _parse(self):
+        sql = self.sql
+        # one frame per open parenthesis: [is a query, in the FROM list]
+        frames = [[True, False]]
+        frame = frames[0]
+        for match in _SCAN_PATTERN.finditer(sql):
+            kind = match.lastgroup
+            if kind == 'word':
+                if frame[0]:
+                    keyword = match.group().upper()
+                    if keyword in _FROM_LIST_WORDS:
+                        frame[1] = keyword == 'FROM' or keyword.endswith('JOIN')
+                        if frame[1]:
+                            self._read_table_reference(match.end())
+            elif kind == 'open':
+                frame = [_QUERY_START_PATTERN.match(sql, match.end()) is not None, False]
+                frames.append(frame)
+            elif kind == 'close':
+                if len(frames) > 1:
+                    frames.pop()
+                    frame = frames[-1]
+            elif kind == 'comma':
+                if frame[0] and frame[1]:
+                    self._read_table_reference(match.end())
+
+    def _read_table_reference(self, position):
+        match = _TABLE_PATTERN.match(self.sql, position)
+        if match is None or match.group('name').upper() in ('SELECT', 'WITH') or match.group('next') == '(':
+            # derived table, or a table function such as UNNEST(...)
+            return
+        following = match.group('next')
+        has_alias = following is not None and following.upper() not in _CLAUSE_WORDS
+        self.table_references.append((match.start('name'), match.end('name'),
+                                      split_table_name(match.group('name')), has_alias))
+
+    def render(self, replacements, start=0):
+        """
+        The SQL text from start, replacements is a list of (start, end, new text) in order
+        """
+        pieces = []
+        position = start
+        for replace_start, replace_end, text in replacements:
+            if replace_start < position:
+                continue
+            pieces.append(self.sql[position:replace_start])
+            pieces.append(text)
+            position = replace_end
+        pieces.append(self.sql[position:])
+        return ''.join(pieces)
+
+
+class RlsTableFilter:
+    """
+    Row filter of one table. The static parts of the subquery are built once, render() only binds the values.
+    """
+
+    def __init__(self, table_name, columns):
+        self.table_name = table_name
+        self.parts = split_table_name(table_name)
+        # 表名包含 schema 时 (schema.table), CTE 名称中的 . 替换成 __
+        self.cte_name = table_name.replace('.', '__')
+        self.renamed = '.' in table_name
+        self.prefix = f'(SELECT * FROM {table_name} WHERE '
+        self.conditions = [(f"{column['column_name']} = ", column['column_value']) for column in columns]
+
+    def bind_values(self, login_user):
+        values = []
+        for _, column_value in self.conditions:
+            if column_value == LOGIN_USERNAME and login_user is not None:
+                column_value = login_user.get_username()
+            values.append(column_value)
+        return values
+
+    def render(self, login_user, backslash_escapes=True):
+        values = self.bind_values(login_user)
+        return self.prefix + ' AND '.join(condition + quote_literal(value, backslash_escapes)
+                                          for (condition, _), value in zip(self.conditions, values)) + ')'
+
+
+class CompiledRlsPolicy:
+    """
+    Row level security config parsed once, the YAML format is:
+    {'tables': [{'table_name': 'table_a', 'columns': [
+    {'column_name': 'username', 'column_value': '$login_user.username'}]}]}
+    """
+
+    def __init__(self, rls_config_obj):
+        self.tables = [RlsTableFilter(table['table_name'], table['columns'])
+                       for table in (rls_config_obj or {}).get('tables') or []]
+
+    def table_statements(self, login_user, backslash_escapes=True):
+        return {table.table_name: table.render(login_user, backslash_escapes) for table in self.tables}
+
+    def apply(self, sql, login_user, backslash_escapes=True):
+        return rewrite_with_table_filters(sql, [(table, table.render(login_user, backslash_escapes))
+                                                for table in self.tables])
+
+
+class RlsPolicyCompiler:
+    """
+    Compiled policies are cached by the hash of the config text, a changed profile config compiles a new policy
+    """
+    policy_cache = TTLCache('rls_policy', ttl=3600, max_size=256)
+
+    @classmethod
+    def compile(cls, rls_config):
+        if not rls_config:
+            return CompiledRlsPolicy({'tables': []})
+        key = hashlib.sha256(rls_config.encode('utf-8')).hexdigest()
+        return cls.policy_cache.get_or_load(key, lambda: CompiledRlsPolicy(yaml.safe_load(rls_config)))
+
+
+def rewrite_with_table_filters(sql, table_filters):
+    """
+    Put the filtered subquery of every table in front of the SQL as a CTE. The CTE of a schema qualified table
+    is named schema__table and the table references of the parsed SQL are renamed to it,
+    names in columns, strings and comments are left alone.
+
+    :param table_filters: list of (RlsTableFilter, rendered subquery)
+    """
+    if not table_filters or not sql.strip():
+        return sql
+    ctes = ',\n'.join(f"/* rls applied */ {table_filter.cte_name} AS {subquery}"
+                      for table_filter, subquery in table_filters)
+    if not any(table_filter.renamed for table_filter, _ in table_filters):
+        # the CTEs keep the table names, the SQL is not parsed, only a leading WITH has to be merged
+        leading_with = _LEADING_WITH_PATTERN.match(sql)
+        if leading_with is not None:
+            return f"WITH\n{ctes},\n{sql[leading_with.end():]}"
+        return f"WITH\n{ctes}\n{sql}"
+
+    parsed_sql = ParsedSql(sql)
+    replacements = []
+    for start, end, parts, has_alias in parsed_sql.table_references:
+        for table_filter, _ in table_filters:
+            if table_filter.renamed and (parts == table_filter.parts or parts == table_filter.parts[-1:]):
+                # without an alias the columns may still be qualified with the table name
+                table_name = sql[start:end].rsplit('.', 1)[-1]
+                replacements.append((start, end, table_filter.cte_name if has_alias
+                                     else f'{table_filter.cte_name} AS {table_name}'))
+                break
+
+    if parsed_sql.leading_with_end is not None:
+        return f"WITH\n{ctes},\n{parsed_sql.render(replacements, parsed_sql.leading_with_end)}"
+    return f"WITH\n{ctes}\n{parsed_sql.render(replacements)}"
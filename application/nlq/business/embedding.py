@@ -7,6 +7,8 @@ from botocore.config import Config
 import requests
 from utils.env_var import embedding_info
 from utils.env_var import bedrock_ak_sk_info
+from nlq.business.semantic_cache import SemanticAnswerCache
+from utils.embedding_cache import EmbeddingCache
 
 logger = getLogger()
 
@@ -434,6 +436,11 @@ class EmbeddingModelManagement:
         """应用默认嵌入模型到环境变量"""
         model = cls.get_default_embedding_model()
         if isinstance(model, EmbeddingModelEntity):
+            if (embedding_info.get("embedding_platform"), embedding_info.get("embedding_name"),
+                    embedding_info.get("embedding_dimension")) != (model.platform, model.model_name, model.dimension):
+                # 切换了嵌入模型，旧模型的向量不能再使用
+                EmbeddingCache.invalidate()
+                SemanticAnswerCache.invalidate()
             # 更新环境变量中的嵌入模型信息
             embedding_info["embedding_platform"] = model.platform
             embedding_info["embedding_name"] = model.model_name
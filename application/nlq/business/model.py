@@ -1,4 +1,6 @@
 from nlq.data_access.dynamo_model import ModelConfigDao, ModelConfigEntity
+from utils.cache import TTLCache
+from utils.llm_cache import LLMResponseCache
 from utils.logging import getLogger
 
 logger = getLogger()
@@ -6,6 +8,7 @@ logger = getLogger()
 
 class ModelManagement:
     model_config_dao = ModelConfigDao()
+    model_cache = TTLCache('model', ttl=300)
 
     @classmethod
     def get_all_models(cls):
@@ -33,6 +36,7 @@ class ModelManagement:
     def add_sagemaker_model(cls, model_id, model_region, prompt_template, input_payload, output_format, input_format=""):
         entity = ModelConfigEntity(model_id, model_region, prompt_template, input_payload, output_format, api_url="", api_header="", input_format=input_format)
         cls.model_config_dao.add(entity)
+        cls.model_cache.invalidate(model_id)
         logger.info(f"Model {model_id} added")
 
     @classmethod
@@ -40,6 +44,7 @@ class ModelManagement:
         entity = ModelConfigEntity(model_id, model_region="", prompt_template="", input_payload=input_payload,
                                    output_format=output_format, api_url=api_url, api_header=api_header, input_format=input_format)
         cls.model_config_dao.add(entity)
+        cls.model_cache.invalidate(model_id)
         logger.info(f"Model {model_id} added")
 
     # @classmethod
@@ -61,19 +66,24 @@ class ModelManagement:
         entity = ModelConfigEntity(model_id, model_region=model_region, prompt_template="", input_payload=input_payload,
                                    output_format=output_format, api_url="", api_header="", input_format=input_format)
         cls.model_config_dao.add(entity)
+        cls.model_cache.invalidate(model_id)
         logger.info(f"Model {model_id} added")
 
     @classmethod
     def get_model_by_id(cls, model_id):
-        return cls.model_config_dao.get_by_id(model_id)
+        return cls.model_cache.get_or_load(model_id, lambda: cls.model_config_dao.get_by_id(model_id))
 
     @classmethod
     def update_model(cls, model_id, model_region, prompt_template, input_payload, output_format, api_url, api_header, input_format=""):
         entity = ModelConfigEntity(model_id, model_region, prompt_template, input_payload, output_format, api_url, api_header, input_format=input_format)
         cls.model_config_dao.update(entity)
+        cls.model_cache.invalidate(model_id)
+        # the payload or the prompt template may have changed, cached responses are no longer valid
+        LLMResponseCache.invalidate()
         logger.info(f"Model {model_id} updated")
 
     @classmethod
     def delete_model(cls, model_id):
         cls.model_config_dao.delete(model_id)
+        cls.model_cache.invalidate(model_id)
         logger.info(f"Model {model_id} deleted")
@@ -1,12 +1,20 @@
+import copy
+
 from nlq.business.model import ModelManagement
+from nlq.business.semantic_cache import SemanticAnswerCache
 from nlq.data_access.dynamo_profile import ProfileConfigDao, ProfileConfigEntity
-from utils.prompts.generate_prompt import prompt_map_dict
+from utils.cache import TTLCache
+from utils.prompts.generate_prompt import prompt_map_dict, PromptCompiler
 from utils.logging import getLogger
 
 logger = getLogger()
 
+ALL_PROFILES_KEY = '__all_profiles__'
+
+
 class ProfileManagement:
     profile_config_dao = ProfileConfigDao()
+    profile_cache = TTLCache('profile')
 
     @classmethod
     def get_all_profiles(cls):
@@ -15,11 +23,31 @@ class ProfileManagement:
 
     @classmethod
     def get_all_profiles_with_info(cls):
+        # callers may modify the returned profiles, keep the cached copy untouched
+        return copy.deepcopy(cls.profile_cache.get_or_load(ALL_PROFILES_KEY, cls._load_all_profiles_with_info))
+
+    @classmethod
+    def get_profile_info_by_name(cls, profile_name):
+        """
+        Get one profile in the get_all_profiles_with_info format, served from the cache.
+        Only the top level dict is copied, nested values are shared with the cache and must not be modified.
+        """
+        profile_map = cls.profile_cache.get_or_load(ALL_PROFILES_KEY, cls._load_all_profiles_with_info)
+        return dict(profile_map[profile_name])
+
+    @classmethod
+    def invalidate_cache(cls):
+        cls.profile_cache.invalidate()
+        PromptCompiler.invalidate()
+
+    @classmethod
+    def _load_all_profiles_with_info(cls):
         logger.info('get all profiles with info...')
         profile_list = cls.profile_config_dao.get_profile_list()
         profile_map = {}
         for profile in profile_list:
             profile_map[profile.profile_name] = {
+                'profile_name': profile.profile_name,
                 'db_url': '',
                 'db_type': profile.db_type,
                 'conn_name': profile.conn_name,
@@ -30,7 +58,8 @@ class ProfileManagement:
                 'comments':  profile.comments,
                 'prompt_map': profile.prompt_map,
                 'row_level_security_config': profile.row_level_security_config if profile.enable_row_level_security else None,
-                'prompt_environment': profile.prompt_environment
+                'prompt_environment': profile.prompt_environment,
+                'samples_version': profile.samples_version
             }
 
         return profile_map
@@ -56,6 +85,7 @@ class ProfileManagement:
                 update_prompt_map[each_process]["user_prompt"][each_sagemaker_id] = prompt_map_dict[each_process]["user_prompt"]["sonnet-20240229v1-0"]
         entity = ProfileConfigEntity(profile_name, conn_name, schemas, tables, comment, db_type=db_type, prompt_map=update_prompt_map)
         cls.profile_config_dao.add(entity)
+        cls.invalidate_cache()
         logger.info(f"Profile {profile_name} added")
 
     @classmethod
@@ -64,12 +94,14 @@ class ProfileManagement:
 
     @classmethod
     def update_profile(cls, profile_name, conn_name, schemas, tables, comment, tables_info, db_type, rls_enable, rls_config):
-        all_profiles = ProfileManagement.get_all_profiles_with_info()
-        prompt_map = all_profiles[profile_name]["prompt_map"]
-        entity = ProfileConfigEntity(profile_name, conn_name, schemas, tables, comment, tables_info, prompt_map,
-                                     db_type=db_type,
-                                     enable_row_level_security=rls_enable, row_level_security_config=rls_config)
+        # read the stored prompt map directly, the cached profile may be stale
+        stored_profile = cls.profile_config_dao.get_by_name(profile_name)
+        entity = ProfileConfigEntity(profile_name, conn_name, schemas, tables, comment, tables_info,
+                                     stored_profile.prompt_map, db_type=db_type,
+                                     enable_row_level_security=rls_enable, row_level_security_config=rls_config,
+                                     samples_version=stored_profile.samples_version)
         cls.profile_config_dao.update(entity)
+        cls.invalidate_cache()
         logger.info(f"Profile {profile_name} updated")
 
     @classmethod
@@ -79,13 +111,16 @@ class ProfileManagement:
                                      tables_info=profile_info.tables_info, prompt_map=prompt_map,
                                      db_type=profile_info.db_type,
                                      enable_row_level_security=profile_info.enable_row_level_security,
-                                     row_level_security_config=profile_info.row_level_security_config)
+                                     row_level_security_config=profile_info.row_level_security_config,
+                                     samples_version=profile_info.samples_version)
         cls.profile_config_dao.update(entity)
+        cls.invalidate_cache()
         logger.info(f"Profile {profile_name} updated")
 
     @classmethod
     def delete_profile(cls, profile_name):
         cls.profile_config_dao.delete(profile_name)
+        cls.invalidate_cache()
         logger.info(f"Profile {profile_name} updated")
 
     @classmethod
@@ -104,14 +139,31 @@ class ProfileManagement:
                 logger.info('tables info merged', tables_info)
 
         cls.profile_config_dao.update_table_def(profile_name, tables_info)
+        cls.invalidate_cache()
         logger.info(f"Table definition updated")
 
     @classmethod
     def update_table_prompt_map(cls, profile_name, prompt_map):
         cls.profile_config_dao.update_table_prompt_map(profile_name, prompt_map)
+        cls.invalidate_cache()
         logger.info(f"System and user prompt updated")
 
+    @classmethod
+    def samples_changed(cls, profile_name):
+        """
+        Called after the SQL or entity samples of the profile changed. The samples version stored in the profile
+        is part of the semantic cache fingerprint, so the API containers drop their cached answers once they
+        reload the profile, not only the process that changed the samples.
+        """
+        SemanticAnswerCache.invalidate(profile_name)
+        try:
+            cls.profile_config_dao.increment_samples_version(profile_name)
+        except Exception as e:
+            logger.error(f"Failed to update the samples version of profile {profile_name}: {e}")
+        cls.invalidate_cache()
+
     @classmethod
     def update_table_prompt_environment(cls, profile_name, prompt_environment):
         cls.profile_config_dao.update_table_prompt_environment(profile_name, prompt_environment)
+        cls.invalidate_cache()
         logger.info(f"Prompt environment updated")
\ No newline at end of file
@@ -0,0 +1,185 @@
+import os
+import uuid
+
+from nlq.business.profile import ProfileManagement
+from nlq.business.vector_store import VectorStore
+from utils.env_var import opensearch_info
+from utils.logging import getLogger
+
+logger = getLogger()
+
+# 每一轮 embedding + 写入处理的样本数
+INGESTION_CHUNK_SIZE = int(os.getenv('INGESTION_CHUNK_SIZE', '256'))
+INGESTION_BULK_CHUNK_SIZE = int(os.getenv('INGESTION_BULK_CHUNK_SIZE', '500'))
+INGESTION_BULK_THREADS = int(os.getenv('INGESTION_BULK_THREADS', '4'))
+# large loads pause the periodic index refresh and refresh once at the end
+INGESTION_PAUSE_REFRESH_THRESHOLD = int(os.getenv('INGESTION_PAUSE_REFRESH_THRESHOLD', '1000'))
+
+SQL_SAMPLE = 'sql'
+ENTITY_SAMPLE = 'entity'
+DIMENSION_SAMPLE = 'dimension'
+AGENT_COT_SAMPLE = 'agent_cot'
+
+
+class SampleIngestionPipeline:
+    """
+    Bulk load uploaded samples into the SQL, entity or agent CoT index.
+
+    The uploaded DataFrame is deduplicated in memory, then processed in chunks: one batched embedding call,
+    one msearch to find the exact duplicates already in the index, and one parallel_bulk write that deletes
+    the duplicates and indexes the new documents.
+    """
+
+    def __init__(self, profile_name, sample_type, progress_callback=None, chunk_size=INGESTION_CHUNK_SIZE):
+        self.profile_name = profile_name
+        self.sample_type = sample_type
+        self.progress_callback = progress_callback
+        self.chunk_size = chunk_size
+        self.opensearch_dao = VectorStore.opensearch_dao
+        if sample_type == SQL_SAMPLE:
+            self.index_name = opensearch_info['sql_index']
+        elif sample_type == AGENT_COT_SAMPLE:
+            self.index_name = opensearch_info['agent_index']
+        else:
+            self.index_name = opensearch_info['ner_index']
+
+    def deduplicate(self, data):
+        """
+        Convert the uploaded rows to samples keyed by their embedded text, the last row wins.
+        Dimension values of the same entity are merged.
+        """
+        samples = {}
+        for item in data.itertuples():
+            if self.sample_type == SQL_SAMPLE:
+                samples[str(item.question)] = {'text': str(item.question), 'sql': str(item.sql)}
+            elif self.sample_type == ENTITY_SAMPLE:
+                samples[str(item.entity)] = {'text': str(item.entity), 'comment': str(item.comment)}
+            elif self.sample_type == AGENT_COT_SAMPLE:
+                samples[str(item.query)] = {'text': str(item.query), 'comment': str(item.comment)}
+            else:
+                entity = str(item.entity)
+                entity_item_table_info = {
+                    "table_name": str(item.table),
+                    "column_name": str(item.column),
+                    "value": str(item.value)
+                }
+                sample = samples.setdefault(entity, {'text': entity, 'entity_table_info': []})
+                if entity_item_table_info not in sample['entity_table_info']:
+                    sample['entity_table_info'].append(entity_item_table_info)
+        return list(samples.values())
+
+    def run(self, data):
+        """
+        :param data: uploaded DataFrame
+        :return: dict with total / success / failed counts and the failed documents
+        """
+        samples = self.deduplicate(data)
+        result = {'total': len(samples), 'success': 0, 'failed': 0, 'failures': []}
+        if len(samples) == 0:
+            return result
+
+        refresh_interval = None
+        pause_refresh = len(samples) >= INGESTION_PAUSE_REFRESH_THRESHOLD
+        if pause_refresh:
+            try:
+                refresh_interval = self.opensearch_dao.get_refresh_interval(self.index_name)
+                self.opensearch_dao.set_refresh_interval(self.index_name, '-1')
+            except Exception as e:
+                logger.warning(f"Failed to pause refresh of index {self.index_name}: {e}")
+                pause_refresh = False
+        try:
+            for start in range(0, len(samples), self.chunk_size):
+                chunk = samples[start:start + self.chunk_size]
+                success, failures = self._ingest_chunk(chunk)
+                result['success'] += success
+                result['failures'].extend(failures)
+                if self.progress_callback is not None:
+                    self.progress_callback(min(start + self.chunk_size, len(samples)), len(samples))
+        finally:
+            try:
+                if pause_refresh:
+                    # None restores the index default
+                    self.opensearch_dao.set_refresh_interval(self.index_name, refresh_interval)
+                self.opensearch_dao.refresh_index(self.index_name)
+            except Exception as e:
+                logger.error(f"Failed to refresh index {self.index_name}: {e}")
+        result['failed'] = len(result['failures'])
+        if self.sample_type != AGENT_COT_SAMPLE:
+            ProfileManagement.samples_changed(self.profile_name)
+        logger.info(f"Ingested {result['success']} of {result['total']} {self.sample_type} samples "
+                    f"into {self.index_name}, {result['failed']} failed")
+        return result
+
+    def _ingest_chunk(self, samples):
+        failures = []
+        try:
+            embeddings = VectorStore.create_vector_embeddings([sample['text'] for sample in samples])
+        except Exception as e:
+            logger.error(f"Failed to embed ingestion chunk: {e}")
+            return 0, [{'text': sample['text'], 'error': str(e)} for sample in samples]
+
+        top_k = 5 if self.sample_type in (ENTITY_SAMPLE, DIMENSION_SAMPLE) else 1
+        try:
+            existing_hits = self.opensearch_dao.search_samples_with_embeddings(
+                self.profile_name, top_k, self.index_name, embeddings.tolist())
+        except Exception as e:
+            logger.error(f"Failed to look up existing samples: {e}")
+            existing_hits = [[] for _ in samples]
+
+        actions = []
+        doc_texts = {}
+        for sample, embedding, hits in zip(samples, embeddings, existing_hits):
+            if not embedding.any():
+                failures.append({'text': sample['text'], 'error': 'embedding failed'})
+                continue
+            actions.extend(self._build_delete_actions(sample, hits))
+            record = self._build_record(sample, embedding.tolist())
+            record['_id'] = uuid.uuid4().hex
+            doc_texts[record['_id']] = sample['text']
+            actions.append(record)
+
+        _, bulk_failures = self.opensearch_dao.parallel_bulk_write(
+            actions, chunk_size=INGESTION_BULK_CHUNK_SIZE, thread_count=INGESTION_BULK_THREADS)
+        index_failed = 0
+        for failure in bulk_failures:
+            op_type, info = next(iter(failure.items()))
+            if op_type == 'delete':
+                # a failed delete leaves a duplicate behind but the new document is still indexed
+                if info.get('status') != 404:
+                    logger.warning(f"Failed to delete duplicate sample {info.get('_id')}: {info.get('error')}")
+                continue
+            index_failed += 1
+            failures.append({'text': doc_texts.get(info.get('_id'), ''), 'error': str(info.get('error'))})
+        return len(doc_texts) - index_failed, failures
+
+    def _build_delete_actions(self, sample, hits):
+        """
+        Same behavior as VectorStore.search_same_query: an exact match (score 1.0) is replaced by the new sample,
+        dimension values of a replaced dimension entity are merged into the new one.
+        """
+        actions = []
+        if self.sample_type != DIMENSION_SAMPLE:
+            hits = hits[:1]
+        for hit in hits:
+            if hit['_score'] != 1.0:
+                continue
+            if self.sample_type == DIMENSION_SAMPLE and hit['_source'].get('entity_type') == 'dimension':
+                for each in hit['_source'].get('entity_table_info', []):
+                    if each not in sample['entity_table_info']:
+                        sample['entity_table_info'].append(each)
+            actions.append({'_op_type': 'delete', '_index': self.index_name, '_id': hit['_id']})
+        return actions
+
+    def _build_record(self, sample, embedding):
+        if self.sample_type == SQL_SAMPLE:
+            return self.opensearch_dao.build_sample_record(self.index_name, self.profile_name, sample['text'],
+                                                           sample['sql'], embedding)
+        elif self.sample_type == AGENT_COT_SAMPLE:
+            return self.opensearch_dao.build_agent_cot_record(self.index_name, self.profile_name, sample['text'],
+                                                              sample['comment'], embedding)
+        elif self.sample_type == ENTITY_SAMPLE:
+            return self.opensearch_dao.build_entity_record(self.index_name, self.profile_name, sample['text'],
+                                                           sample['comment'], embedding, "metrics")
+        else:
+            return self.opensearch_dao.build_entity_record(self.index_name, self.profile_name, sample['text'], "",
+                                                           embedding, "dimension", sample['entity_table_info'])
@@ -0,0 +1,266 @@
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+
+import numpy as np
+
+from nlq.business.datasource.rls_policy import ParsedSql, split_table_name
+from nlq.business.sql_validator import parse_ddl_column
+from utils.cache import TTLCache
+from utils.logging import getLogger
+
+logger = getLogger()
+
+SCHEMA_LINKING_ENABLED = os.getenv('SCHEMA_LINKING_ENABLED', 'true').lower() == 'true'
+# 表数量和 DDL token 数都不超过上限时不裁剪
+SCHEMA_LINKING_MAX_TABLES = int(os.getenv('SCHEMA_LINKING_MAX_TABLES', '12'))
+SCHEMA_LINKING_TOKEN_BUDGET = int(os.getenv('SCHEMA_LINKING_TOKEN_BUDGET', '6000'))
+# 是否使用表和列的 embedding 计算相关性
+SCHEMA_LINKING_EMBEDDING_ENABLED = os.getenv('SCHEMA_LINKING_EMBEDDING_ENABLED', 'true').lower() == 'true'
+
+# weights of the relevance signals of a table
+EMBEDDING_WEIGHT = 0.5
+LEXICAL_WEIGHT = 0.5
+# tables of entity hits and of the SQL of similar QA samples are always linked first
+ENTITY_HIT_SCORE = 2.0
+SQL_REFERENCE_SCORE = 1.0
+
+_WORD_PATTERN = re.compile(r'[a-z0-9]+|[一-鿿]+')
+_CJK_PATTERN = re.compile(r'[　-鿿가-힯＀-￯]')
+
+
+def estimate_tokens(text):
+    """
+    Rough token count of a prompt text: about 4 characters per token, one token per CJK character
+    """
+    if not text:
+        return 0
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    return cjk_count + math.ceil((len(text) - cjk_count) / 4)
+
+
+def tokenize(text):
+    """
+    Lower case terms of a text, identifiers are split on _ and CJK runs into character bigrams
+    """
+    terms = set()
+    for word in _WORD_PATTERN.findall((text or '').lower().replace('_', ' ')):
+        if word[0] >= '一':
+            terms.update(word[i:i + 2] for i in range(max(1, len(word) - 1)))
+        elif len(word) > 1 or word.isdigit():
+            terms.add(word)
+    return terms
+
+
+def render_table_prompt(table_name, table_data):
+    """
+    The sql_schema text of one table, as concatenated by generate_llm_prompt
+    """
+    ddl_string = table_data["col_a"] if 'col_a' in table_data else table_data["ddl"]
+    description = table_data["tbl_a"] if 'tbl_a' in table_data else table_data["description"]
+    return "{}: {}\n{}\n \n".format(table_name, description, ddl_string)
+
+
+class LinkedTable:
+    """
+    One table of the profile: its prompt text and token count, its terms and the text of its columns
+    """
+
+    def __init__(self, table_name, table_data):
+        self.table_name = table_name
+        self.parts = split_table_name(table_name)
+        self.prompt = render_table_prompt(table_name, table_data)
+        self.tokens = estimate_tokens(self.prompt)
+        self.text = self.prompt.strip()
+        self.columns = []
+        for line in self.prompt.splitlines()[2:]:
+            if parse_ddl_column(line) is not None:
+                self.columns.append(line.strip().rstrip(','))
+        self.terms = tokenize(self.text)
+
+    def matches(self, parts):
+        return parts == self.parts or parts[-1:] == self.parts[-1:]
+
+
+class SchemaIndex:
+    """
+    The linkable tables of one tables_info, with the document frequency of their terms.
+    The table and column embeddings are computed once, the first time a query embedding is given.
+    """
+
+    def __init__(self, tables_info):
+        self.tables = [LinkedTable(table_name, table_data) for table_name, table_data in tables_info.items()
+                       if isinstance(table_data, dict)]
+        self.total_tokens = sum(table.tokens for table in self.tables)
+        document_frequency = {}
+        for table in self.tables:
+            for term in table.terms:
+                document_frequency[term] = document_frequency.get(term, 0) + 1
+        self.idf = {term: math.log(1 + len(self.tables) / count) for term, count in document_frequency.items()}
+        self._embeddings = None
+        self._embedding_failed = False
+        self._lock = threading.Lock()
+
+    def get_embeddings(self, embed_texts):
+        """
+        [(normalized table vector, normalized column matrix)] of the tables, None when embedding failed
+        """
+        if self._embeddings is not None or self._embedding_failed:
+            return self._embeddings
+        with self._lock:
+            if self._embeddings is None and not self._embedding_failed:
+                texts = []
+                for table in self.tables:
+                    texts.append(table.text)
+                    texts.extend(f'{table.table_name}.{column}' for column in table.columns)
+                try:
+                    matrix = _normalize(np.asarray(embed_texts(texts), dtype=np.float32))
+                    embeddings = []
+                    position = 0
+                    for table in self.tables:
+                        embeddings.append((matrix[position], matrix[position + 1:position + 1 + len(table.columns)]))
+                        position += 1 + len(table.columns)
+                    self._embeddings = embeddings
+                except Exception as e:
+                    logger.error(f"Failed to embed the schema for linking, only lexical ranking is used: {e}")
+                    self._embedding_failed = True
+        return self._embeddings
+
+    def lexical_scores(self, query):
+        query_terms = tokenize(query)
+        total_weight = sum(self.idf.get(term, 0.0) for term in query_terms)
+        if total_weight == 0:
+            return [0.0] * len(self.tables)
+        return [sum(self.idf[term] for term in query_terms & table.terms) / total_weight for table in self.tables]
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _entity_tables(ner_example):
+    tables = set()
+    for item in ner_example or []:
+        for table_info in item.get('_source', {}).get('entity_table_info') or []:
+            if isinstance(table_info, dict) and table_info.get('table_name'):
+                tables.add(split_table_name(table_info['table_name']))
+    return tables
+
+
+def _sql_tables(sql_examples):
+    tables = set()
+    for item in sql_examples or []:
+        sql = item.get('_source', {}).get('sql')
+        if not sql:
+            continue
+        try:
+            tables.update(parts for _, _, parts, _ in ParsedSql(sql).table_references)
+        except Exception as e:
+            logger.warning(f"Failed to read the tables of a QA sample SQL: {e}")
+    return tables
+
+
+class SchemaLinker:
+    """
+    Schema linking for text2sql: when the DDL of a profile exceeds SCHEMA_LINKING_MAX_TABLES tables or
+    SCHEMA_LINKING_TOKEN_BUDGET tokens, only the tables most relevant to the question are put in the prompt.
+
+    A table is ranked by the entity hits and QA sample SQL referencing it, then by the similarity of the
+    question to the table and its columns, by embedding and by term overlap. The index of a tables_info is
+    cached per fingerprint.
+    """
+    index_cache = TTLCache('schema_linking', ttl=3600, max_size=64)
+    linked_requests = 0
+    tables_before = 0
+    tables_after = 0
+    tokens_saved = 0
+
+    @classmethod
+    def get_index(cls, tables_info):
+        fingerprint = hashlib.sha256(json.dumps(tables_info, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        return cls.index_cache.get_or_load(fingerprint, lambda: SchemaIndex(tables_info))
+
+    @classmethod
+    def _embed_texts(cls, texts):
+        from nlq.business.vector_store import VectorStore
+        return VectorStore.create_vector_embeddings(texts)
+
+    @classmethod
+    def score_tables(cls, index, query, query_embedding=None, ner_example=None, sql_examples=None):
+        scores = [LEXICAL_WEIGHT * score for score in index.lexical_scores(query)]
+        if query_embedding is not None and SCHEMA_LINKING_EMBEDDING_ENABLED:
+            embeddings = index.get_embeddings(cls._embed_texts)
+            if embeddings is not None:
+                query_vector = _normalize(np.asarray(query_embedding, dtype=np.float32))
+                for position, (table_vector, column_matrix) in enumerate(embeddings):
+                    similarity = float(table_vector @ query_vector)
+                    if len(column_matrix) > 0:
+                        similarity = max(similarity, float(np.max(column_matrix @ query_vector)))
+                    scores[position] += EMBEDDING_WEIGHT * max(similarity, 0.0)
+        entity_tables = _entity_tables(ner_example)
+        sql_tables = _sql_tables(sql_examples)
+        for position, table in enumerate(index.tables):
+            if any(table.matches(parts) for parts in entity_tables):
+                scores[position] += ENTITY_HIT_SCORE
+            if any(table.matches(parts) for parts in sql_tables):
+                scores[position] += SQL_REFERENCE_SCORE
+        return scores
+
+    @classmethod
+    def link(cls, tables_info, query, query_embedding=None, ner_example=None, sql_examples=None,
+             max_tables=None, token_budget=None):
+        """
+        The subset of tables_info to put in the text2sql prompt, in the original order.
+        tables_info is returned unchanged when it fits the limits or nothing relates the question to a table.
+
+        :param query_embedding: embedding of the question, None to rank without embeddings
+        :param ner_example: entity retrieval hits, their entity_table_info names the tables
+        :param sql_examples: QA retrieval hits, the tables of their SQL are linked
+        """
+        max_tables = SCHEMA_LINKING_MAX_TABLES if max_tables is None else max_tables
+        token_budget = SCHEMA_LINKING_TOKEN_BUDGET if token_budget is None else token_budget
+        if not SCHEMA_LINKING_ENABLED or not tables_info or not query:
+            return tables_info
+        try:
+            index = cls.get_index(tables_info)
+            if len(index.tables) <= max_tables and index.total_tokens <= token_budget:
+                return tables_info
+            scores = cls.score_tables(index, query, query_embedding, ner_example, sql_examples)
+            if max(scores, default=0.0) <= 0:
+                return tables_info
+            ranking = sorted(range(len(index.tables)), key=lambda position: -scores[position])
+            selected = set()
+            tokens = 0
+            for position in ranking:
+                if len(selected) >= max_tables or scores[position] <= 0:
+                    break
+                table = index.tables[position]
+                if selected and tokens + table.tokens > token_budget:
+                    continue
+                selected.add(table.table_name)
+                tokens += table.tokens
+        except Exception as e:
+            logger.error(f"Schema linking failed, the full schema is used: {e}")
+            return tables_info
+
+        cls.linked_requests += 1
+        cls.tables_before += len(index.tables)
+        cls.tables_after += len(selected)
+        cls.tokens_saved += index.total_tokens - tokens
+        logger.info(f"Schema linking kept {len(selected)} of {len(index.tables)} tables, "
+                    f"{tokens} of {index.total_tokens} estimated tokens")
+        return {table_name: table_data for table_name, table_data in tables_info.items() if table_name in selected}
+
+    @classmethod
+    def get_stats(cls):
+        return {
+            'linked_requests': cls.linked_requests,
+            'tables_before': cls.tables_before,
+            'tables_after': cls.tables_after,
+            'tokens_saved': cls.tokens_saved,
+        }
@@ -0,0 +1,170 @@
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from utils.logging import getLogger
+
+logger = getLogger()
+
+SEMANTIC_CACHE_ENABLED = os.getenv('SEMANTIC_CACHE_ENABLED', 'false').lower() == 'true'
+# query_rewrite 向量的余弦相似度达到阈值才复用
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.95'))
+SEMANTIC_CACHE_TTL = int(os.getenv('SEMANTIC_CACHE_TTL', '86400'))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', '500'))
+# 查询结果的复用时间, 0 表示每次都重新执行 SQL
+SEMANTIC_CACHE_RESULT_TTL = int(os.getenv('SEMANTIC_CACHE_RESULT_TTL', '300'))
+
+
+def build_profile_fingerprint(database_profile):
+    """
+    Hash of everything in the profile that changes the generated SQL
+    """
+    fingerprint_source = {
+        'db_type': database_profile.get('db_type'),
+        'tables_info': database_profile.get('tables_info'),
+        'hints': database_profile.get('hints'),
+        'prompt_map': database_profile.get('prompt_map'),
+        'prompt_environment': database_profile.get('prompt_environment'),
+        'row_level_security_config': database_profile.get('row_level_security_config'),
+        'samples_version': database_profile.get('samples_version'),
+    }
+    return hashlib.sha256(json.dumps(fingerprint_source, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class SemanticAnswerCache:
+    """
+    Recently answered normal_search questions per (profile, RLS user), looked up by the cosine similarity of the
+    query_rewrite embedding. A hit reuses the generated SQL and, while still fresh, the query result.
+
+    A partition is dropped when the profile fingerprint (tables_info, prompt_map, RLS config ...) changes.
+    Sample changes bump the samples_version of the profile (ProfileManagement.samples_changed), which is part
+    of the fingerprint, so every container drops the partition once its profile cache reloads.
+    """
+    _partitions = {}
+    _lock = threading.Lock()
+    hits = 0
+    misses = 0
+
+    @classmethod
+    def is_enabled(cls):
+        return SEMANTIC_CACHE_ENABLED
+
+    @classmethod
+    def build_partition_key(cls, profile_name, database_profile, username):
+        # 开启行级权限时不同用户生成的 SQL 不同, 按用户分区
+        rls_user = username if database_profile.get('row_level_security_config') else ''
+        return profile_name, rls_user
+
+    @classmethod
+    def _get_partition(cls, partition_key, fingerprint):
+        partition = cls._partitions.get(partition_key)
+        if partition is None or partition['fingerprint'] != fingerprint:
+            if partition is not None:
+                logger.info(f"Profile {partition_key[0]} changed, semantic cache partition dropped")
+            partition = {'fingerprint': fingerprint, 'entries': []}
+            cls._partitions[partition_key] = partition
+        return partition
+
+    @classmethod
+    def _normalize(cls, embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if vector.ndim != 1 or norm == 0:
+            return None
+        return vector / norm
+
+    @classmethod
+    def lookup(cls, profile_name, database_profile, username, embedding):
+        """
+        Return a copy of the most similar fresh entry above SEMANTIC_CACHE_THRESHOLD, or None.
+        The entry has query, sql, original_sql, response, sql_gen_process, score, and data / data_analyse
+        (None when the cached result is older than SEMANTIC_CACHE_RESULT_TTL).
+        """
+        vector = cls._normalize(embedding)
+        if vector is None:
+            return None
+        partition_key = cls.build_partition_key(profile_name, database_profile, username)
+        fingerprint = build_profile_fingerprint(database_profile)
+        now = time.time()
+        with cls._lock:
+            partition = cls._get_partition(partition_key, fingerprint)
+            partition['entries'] = [entry for entry in partition['entries']
+                                    if entry['created_at'] + SEMANTIC_CACHE_TTL > now
+                                    and entry['embedding'].shape == vector.shape]
+            entries = partition['entries']
+            if len(entries) == 0:
+                cls.misses += 1
+                return None
+            scores = np.vstack([entry['embedding'] for entry in entries]) @ vector
+            best = int(np.argmax(scores))
+            if scores[best] < SEMANTIC_CACHE_THRESHOLD:
+                cls.misses += 1
+                return None
+            cls.hits += 1
+            entry = entries[best]
+            result = {key: value for key, value in entry.items() if key != 'embedding'}
+        result['score'] = float(scores[best])
+        if result['data'] is not None and result['created_at'] + SEMANTIC_CACHE_RESULT_TTL > now:
+            result['data'] = result['data'].copy()
+        else:
+            result['data'] = None
+            result['data_analyse'] = None
+        logger.info(f"Semantic cache hit for {profile_name}, score {result['score']:.4f}: {result['query']}")
+        return result
+
+    @classmethod
+    def put(cls, profile_name, database_profile, username, query, embedding, sql, original_sql, response,
+            sql_gen_process, data=None, data_analyse=None):
+        vector = cls._normalize(embedding)
+        if vector is None or not sql:
+            return
+        entry = {
+            'query': query,
+            'embedding': vector,
+            'sql': sql,
+            'original_sql': original_sql,
+            'response': response,
+            'sql_gen_process': sql_gen_process,
+            'data': data.copy() if data is not None and SEMANTIC_CACHE_RESULT_TTL > 0 else None,
+            'data_analyse': copy.deepcopy(data_analyse),
+            'created_at': time.time(),
+        }
+        partition_key = cls.build_partition_key(profile_name, database_profile, username)
+        fingerprint = build_profile_fingerprint(database_profile)
+        with cls._lock:
+            partition = cls._get_partition(partition_key, fingerprint)
+            entries = [each for each in partition['entries'] if each['query'] != query]
+            entries.append(entry)
+            partition['entries'] = entries[-SEMANTIC_CACHE_MAX_ENTRIES:]
+
+    @classmethod
+    def invalidate(cls, profile_name=None):
+        """
+        Drop the partitions of one profile, or everything when no profile is given
+        """
+        with cls._lock:
+            if profile_name is None:
+                cls._partitions.clear()
+            else:
+                for partition_key in [key for key in cls._partitions if key[0] == profile_name]:
+                    del cls._partitions[partition_key]
+
+    @classmethod
+    def get_stats(cls):
+        with cls._lock:
+            entries = sum(len(partition['entries']) for partition in cls._partitions.values())
+            partitions = len(cls._partitions)
+        total = cls.hits + cls.misses
+        return {
+            'enabled': SEMANTIC_CACHE_ENABLED,
+            'partitions': partitions,
+            'entries': entries,
+            'hits': cls.hits,
+            'misses': cls.misses,
+            'hit_ratio': round(cls.hits / total, 4) if total else 0.0,
+        }
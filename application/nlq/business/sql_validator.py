@@ -0,0 +1,312 @@
+import hashlib
+import json
+import os
+import re
+
+import sqlparse
+from sqlparse import tokens as T
+from sqlparse.sql import Function, Identifier, IdentifierList, Parenthesis
+
+from nlq.business.datasource.rls_policy import split_table_name
+from utils.cache import TTLCache
+from utils.logging import getLogger
+
+logger = getLogger()
+
+SQL_VALIDATION_ENABLED = os.getenv('SQL_VALIDATION_ENABLED', 'true').lower() == 'true'
+
+# 这些方言中双引号表示标识符, 其他方言中双引号可能表示字符串
+DOUBLE_QUOTE_IDENTIFIER_DIALECTS = {'postgresql', 'redshift', 'athena', 'presto', 'sqlserver'}
+
+_DDL_QUOTED_COLUMN_PATTERN = re.compile(r'^(`[^`]+`|"[^"]+"|\[[^\]]+\])\s+\S')
+_DDL_COMMENT_PATTERN = re.compile(r'\s+COMMENT\b.*$', re.IGNORECASE)
+_DDL_TYPE_ARGUMENTS_PATTERN = re.compile(r'\([^()]*\)')
+
+
+def parse_ddl_column(line):
+    """
+    (lower case column name, exact) of one line of a table DDL, None if the line defines no column.
+    exact is False when the name can not be told apart from the type, e.g. `order date DATE` or
+    `id INT NOT NULL`, the name is then only the first word.
+    """
+    stripped = line.strip()
+    if not stripped or stripped.startswith((')', '--', '(')):
+        return None
+    match = _DDL_QUOTED_COLUMN_PATTERN.match(stripped)
+    if match:
+        return match.group(1)[1:-1].lower(), True
+    definition = _DDL_COMMENT_PATTERN.sub('', stripped).rstrip(',')
+    words = _DDL_TYPE_ARGUMENTS_PATTERN.sub('', definition).split()
+    if len(words) < 2:
+        return None
+    return words[0].lower(), len(words) == 2
+
+
+def _parse_ddl_columns(ddl):
+    """
+    (set of column names, whether every column line was parsed exactly)
+    """
+    columns = set()
+    exact = True
+    if not ddl:
+        return columns, exact
+    for line in ddl.splitlines()[1:]:
+        column = parse_ddl_column(line)
+        if column is not None:
+            columns.add(column[0])
+            exact = exact and column[1]
+    return columns, exact
+
+
+def build_schema_catalog(tables_info):
+    """
+    {table name parts: set of lower case column names} from the DDL of tables_info,
+    an empty set when the columns of the table are unknown or the DDL can not be parsed exactly
+    """
+    catalog = {}
+    for table_name, table_data in (tables_info or {}).items():
+        columns = set()
+        if isinstance(table_data, dict):
+            for key in ('ddl', 'col_a'):
+                ddl_columns, exact = _parse_ddl_columns(table_data.get(key))
+                if not exact:
+                    columns = set()
+                    break
+                columns |= ddl_columns
+        catalog[split_table_name(table_name)] = columns
+    return catalog
+
+
+class _QueryScope:
+    """
+    Table references, CTE names and aliases found in one statement
+    """
+
+    def __init__(self):
+        self.tables = []
+        self.table_tokens = set()
+        self.cte_names = set()
+        self.aliases = set()
+        self.derived_aliases = set()
+        self.has_table_function = False
+
+
+def _meaningful_tokens(token_list):
+    return [token for token in token_list.tokens if not token.is_whitespace and token.ttype not in T.Comment]
+
+
+def _is_subquery(parenthesis):
+    tokens = [token for token in _meaningful_tokens(parenthesis) if token.ttype is not T.Punctuation]
+    return len(tokens) > 0 and (tokens[0].ttype is T.DML or tokens[0].ttype is T.Keyword.CTE)
+
+
+def _is_table_keyword(token):
+    if not token.is_keyword:
+        return False
+    keyword = token.normalized.upper()
+    return keyword == 'FROM' or keyword.endswith('JOIN')
+
+
+class SQLValidator:
+    """
+    Checks generated SQL against the schema of the profile before it is sent to the database:
+    a single SELECT statement, existing tables and, where they can be resolved, existing columns.
+    The schema catalog parsed from tables_info is cached per tables_info fingerprint.
+    """
+    catalog_cache = TTLCache('sql_validator_catalog', ttl=3600, max_size=256)
+
+    @classmethod
+    def get_catalog(cls, tables_info):
+        fingerprint = hashlib.sha256(json.dumps(tables_info, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        return cls.catalog_cache.get_or_load(fingerprint, lambda: build_schema_catalog(tables_info))
+
+    @classmethod
+    def validate(cls, sql, tables_info, db_type=None):
+        """
+        Return the list of problems found in the SQL, empty when it can be executed
+        """
+        if not SQL_VALIDATION_ENABLED or not tables_info:
+            return []
+        try:
+            statements = [statement for statement in sqlparse.parse(sql) if statement.token_first(skip_cm=True)]
+            if len(statements) != 1:
+                return [f"Exactly one SQL statement can be executed, got {len(statements)}."]
+            statement = statements[0]
+            statement_type = statement.get_type()
+            first_token = statement.token_first(skip_cm=True)
+            if statement_type == 'UNKNOWN' and isinstance(first_token, Parenthesis) and _is_subquery(first_token):
+                # (SELECT ...) UNION (SELECT ...)
+                statement_type = 'SELECT'
+            if statement_type != 'SELECT':
+                return [f"Only SELECT statements can be executed, got {statement_type}."]
+            return cls._check_references(statement, cls.get_catalog(tables_info), db_type)
+        except Exception as e:
+            # 校验本身出错时不阻止执行
+            logger.warning(f"Failed to validate SQL, skipping the validation: {e}")
+            return []
+
+    @classmethod
+    def _check_references(cls, statement, catalog, db_type):
+        scope = _QueryScope()
+        cls._scan_query(statement, scope, db_type)
+        errors = []
+        table_columns = {}
+        # LATERAL VIEW / LATERAL joins add columns that are not in the schema
+        all_columns_known = not scope.has_table_function and not any(
+            token.is_keyword and token.normalized.upper().startswith('LATERAL') for token in statement.flatten())
+        for parts, alias in scope.tables:
+            if len(parts) == 1 and parts[0] in scope.cte_names:
+                continue
+            matched = cls._match_table(parts, catalog)
+            if matched is None:
+                available_tables = ', '.join(sorted('.'.join(each) for each in catalog))
+                errors.append(f"Table {'.'.join(parts)} does not exist. Available tables: {available_tables}.")
+                all_columns_known = False
+                continue
+            if not catalog[matched]:
+                all_columns_known = False
+            for name in {alias, parts[-1], '.'.join(parts)}:
+                if name:
+                    table_columns[name] = matched
+
+        for identifier in cls._iter_identifiers(statement):
+            if id(identifier) in scope.table_tokens or not cls._is_qualified(identifier):
+                continue
+            parts = split_table_name(''.join(token.value for token in identifier.tokens
+                                        if not token.is_whitespace and token.ttype not in T.Comment
+                                        and not isinstance(token, Identifier) and not token.is_keyword))
+            if len(parts) != 2 or parts[1] == '*':
+                continue
+            qualifier, column = parts
+            if qualifier in scope.cte_names or qualifier in scope.derived_aliases:
+                continue
+            matched = table_columns.get(qualifier)
+            if matched is not None and catalog[matched] and column not in catalog[matched]:
+                errors.append(f"Column {column} does not exist in table {'.'.join(matched)}.")
+
+        if all_columns_known and not errors:
+            known_names = set().union(*catalog.values()) | scope.aliases | scope.cte_names | set(table_columns)
+            for token in statement.flatten():
+                if token.ttype is not T.Name or cls._in_table_reference(token, scope):
+                    continue
+                parent = token.parent
+                if isinstance(parent, Identifier) and (cls._is_qualified(parent) or
+                                                       isinstance(parent.parent, Function)):
+                    continue
+                name = token.value.strip('`"[]').lower()
+                if name not in known_names:
+                    errors.append(f"Column {name} does not exist in the referenced tables.")
+                    known_names.add(name)
+        return errors
+
+    @staticmethod
+    def _match_table(parts, catalog):
+        if parts in catalog:
+            return parts
+        for table_parts in catalog:
+            # the SQL may leave out the schema, or add the catalog / project in front of it
+            shorter, longer = sorted([parts, table_parts], key=len)
+            if longer[-len(shorter):] == shorter:
+                return table_parts
+        return None
+
+    @staticmethod
+    def _is_qualified(identifier):
+        return any(token.ttype is T.Punctuation and token.value == '.' for token in identifier.tokens)
+
+    @staticmethod
+    def _in_table_reference(token, scope):
+        parent = token.parent
+        while parent is not None:
+            if id(parent) in scope.table_tokens:
+                return True
+            parent = parent.parent
+        return False
+
+    @classmethod
+    def _iter_identifiers(cls, token_list):
+        for token in token_list.tokens:
+            if isinstance(token, Identifier):
+                yield token
+            if token.is_group:
+                yield from cls._iter_identifiers(token)
+
+    @classmethod
+    def _scan_query(cls, token_list, scope, db_type):
+        """
+        Scan a SELECT (the statement or a subquery), collecting the tables following FROM / JOIN
+        """
+        expect_table = False
+        in_cte = False
+        for token in _meaningful_tokens(token_list):
+            if token.ttype is T.Keyword.CTE:
+                in_cte = True
+                continue
+            if in_cte and isinstance(token, (Identifier, IdentifierList)):
+                for each in ([token] if isinstance(token, Identifier) else token.get_identifiers()):
+                    if isinstance(each, Identifier):
+                        scope.cte_names.add(each.get_real_name().strip('`"[]').lower())
+                    cls._scan_group(each, scope, db_type)
+                continue
+            if token.ttype is T.DML:
+                in_cte = False
+            if _is_table_keyword(token):
+                expect_table = True
+                continue
+            if expect_table and token.is_keyword and token.normalized.upper() in ('LATERAL', 'ONLY'):
+                continue
+            if expect_table and isinstance(token, (Identifier, IdentifierList, Parenthesis, Function)):
+                items = token.get_identifiers() if isinstance(token, IdentifierList) else [token]
+                for item in items:
+                    cls._add_table_reference(item, scope, db_type)
+                expect_table = False
+                continue
+            expect_table = False
+            if token.is_group:
+                cls._scan_group(token, scope, db_type)
+
+    @classmethod
+    def _scan_group(cls, token_list, scope, db_type):
+        if isinstance(token_list, Identifier) and token_list.has_alias():
+            scope.aliases.add(token_list.get_alias().strip('`"[]').lower())
+        if isinstance(token_list, Parenthesis) and _is_subquery(token_list):
+            cls._scan_query(token_list, scope, db_type)
+            return
+        for token in token_list.tokens:
+            if token.is_group:
+                cls._scan_group(token, scope, db_type)
+
+    @classmethod
+    def _add_table_reference(cls, token, scope, db_type):
+        alias = token.get_alias() if isinstance(token, Identifier) else None
+        alias = alias.strip('`"[]').lower() if alias else None
+        subqueries = [each for each in getattr(token, 'tokens', []) if isinstance(each, Parenthesis)]
+        if isinstance(token, Parenthesis):
+            subqueries = [token]
+        if subqueries or isinstance(token, Function) or any(isinstance(each, Function)
+                                                                for each in getattr(token, 'tokens', [])):
+            for subquery in subqueries:
+                cls._scan_group(subquery, scope, db_type)
+            if not subqueries:
+                scope.has_table_function = True
+            if alias:
+                scope.derived_aliases.add(alias)
+                scope.aliases.add(alias)
+            return
+        if not isinstance(token, Identifier):
+            return
+        name_tokens = []
+        for each in token.tokens:
+            if each.is_whitespace or each.is_keyword or isinstance(each, Identifier):
+                break
+            name_tokens.append(each)
+        if any(each.ttype is T.Literal.String.Symbol for each in name_tokens) \
+                and db_type not in DOUBLE_QUOTE_IDENTIFIER_DIALECTS:
+            # "name" is a string literal in this dialect, leave it to the database
+            return
+        parts = split_table_name(''.join(each.value for each in name_tokens))
+        if parts:
+            scope.tables.append((parts, alias))
+            scope.table_tokens.add(id(token))
+            if alias:
+                scope.aliases.add(alias)
@@ -1,10 +1,12 @@
 import logging
 from nlq.data_access.dynamo_user_profile import UserProfileConfigDao, UserProfileConfigEntity
+from utils.cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
 class UserProfileManagement:
     user_profile_config_dao = UserProfileConfigDao()
+    user_profile_cache = TTLCache('user_profile')
 
     @classmethod
     def get_all_user_profiles(cls):
@@ -31,24 +33,27 @@ class UserProfileManagement:
         entity = UserProfileConfigEntity(user_id, profile_name)
         print(entity)
         cls.user_profile_config_dao.add(entity)
+        cls.user_profile_cache.invalidate(user_id)
         logger.info(f"User Profile {user_id} added")
 
     @classmethod
     def get_user_profile_by_id(cls, user_id):
-        return cls.user_profile_config_dao.get_by_name(user_id)
+        return cls.user_profile_cache.get_or_load(user_id, lambda: cls.user_profile_config_dao.get_by_name(user_id))
 
     @classmethod
     def update_user_profile(cls, user_id, profile_name_list):
         entity = UserProfileConfigEntity(user_id,profile_name_list)
-        old_user_profile_list = cls.get_user_profile_by_id(user_id)
+        old_user_profile_list = cls.user_profile_config_dao.get_by_name(user_id)
         if old_user_profile_list:
             cls.user_profile_config_dao.update(entity)
         else:
             cls.user_profile_config_dao.add(entity)
+        cls.user_profile_cache.invalidate(user_id)
 
         logger.info(f"User Profile {user_id} updated")
 
     @classmethod
     def delete_user_profile(cls, user_id):
         cls.user_profile_config_dao.delete(user_id)
+        cls.user_profile_cache.invalidate(user_id)
         logger.info(f"User Profile {user_id} updated")
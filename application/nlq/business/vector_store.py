@@ -1,14 +1,27 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import boto3
 import json
+import numpy as np
 import requests
 from nlq.data_access.opensearch import OpenSearchDao
 from utils.env_var import BEDROCK_REGION, AOS_HOST, AOS_PORT, AOS_USER, AOS_PASSWORD, opensearch_info, embedding_info
 from utils.env_var import bedrock_ak_sk_info
+from nlq.business.profile import ProfileManagement
+from utils.embedding_cache import EmbeddingCache
 from utils.llm import invoke_model_sagemaker_endpoint
 from utils.logging import getLogger
 
 logger = getLogger()
 
+# 批量 embedding 的并发上限
+EMBEDDING_BATCH_CONCURRENCY = int(os.getenv('EMBEDDING_BATCH_CONCURRENCY', '4'))
+# max texts per provider call, Titan only accepts a single text
+COHERE_EMBEDDING_BATCH_SIZE = 96
+SAGEMAKER_EMBEDDING_BATCH_SIZE = int(os.getenv('SAGEMAKER_EMBEDDING_BATCH_SIZE', '32'))
+BR_CLIENT_EMBEDDING_BATCH_SIZE = int(os.getenv('BR_CLIENT_EMBEDDING_BATCH_SIZE', '64'))
+
 
 class VectorStore:
     opensearch_dao = OpenSearchDao(AOS_HOST, AOS_PORT, AOS_USER, AOS_PASSWORD)
@@ -77,6 +90,8 @@ class VectorStore:
             logger.info(f'delete sample sample entity: {question} to profile {profile_name}')
         if cls.opensearch_dao.add_sample(opensearch_info['sql_index'], profile_name, question, answer, embedding):
             logger.info('Sample added')
+            # SQL 和实体样本影响生成的 SQL
+            ProfileManagement.samples_changed(profile_name)
 
     @classmethod
     def add_entity_sample(cls, profile_name, entity, comment, entity_type="metrics"):
@@ -88,6 +103,7 @@ class VectorStore:
         if cls.opensearch_dao.add_entity_sample(opensearch_info['ner_index'], profile_name, entity, comment, embedding,
                                                 entity_type):
             logger.info('Sample added')
+            ProfileManagement.samples_changed(profile_name)
 
     @classmethod
     def add_entity_dimension_batch_sample(cls, profile_name, entity, comment, entity_type="dimension", entity_info=[]):
@@ -109,6 +125,7 @@ class VectorStore:
         if cls.opensearch_dao.add_entity_sample(opensearch_info['ner_index'], profile_name, entity, comment, embedding,
                                                 entity_type, entity_info):
             logger.info('Sample added')
+            ProfileManagement.samples_changed(profile_name)
 
     @classmethod
     def add_agent_cot_sample(cls, profile_name, entity, comment):
@@ -123,36 +140,171 @@ class VectorStore:
 
     @classmethod
     def create_vector_embedding(cls, text):
+        platform = embedding_info["embedding_platform"]
+        model_name = embedding_info["embedding_name"]
+        dimension = embedding_info.get("embedding_dimension", 1536)
+        cached_embedding = EmbeddingCache.get(platform, model_name, dimension, text)
+        if cached_embedding is not None:
+            return cached_embedding.tolist()
+        embedding = cls.create_vector_embedding_without_cache(text)
+        EmbeddingCache.put(platform, model_name, dimension, text, embedding)
+        return embedding
+
+    @classmethod
+    def create_vector_embedding_without_cache(cls, text):
         model_name = embedding_info["embedding_name"]
         platform = embedding_info["embedding_platform"]
         logger.info(f"Creating vector embedding using platform: {platform}, model: {model_name}")
         
         # 如果是Bedrock平台，尝试获取用户凭证
         if platform == "bedrock":
-            # 从EmbeddingModelManagement获取模型配置
-            try:
-                from nlq.business.embedding import EmbeddingModelManagement
-                model = EmbeddingModelManagement.get_embedding_model_by_id(f"bedrock.{model_name}")
-                if model and model.input_format:
-                    try:
-                        input_data = json.loads(model.input_format)
-                        if "credentials" in input_data:
-                            user_credentials = input_data["credentials"]
-                            logger.info(f"Found user credentials for model {model_name}")
-                            return cls.create_vector_embedding_with_bedrock(text, model_name, user_credentials)
-                    except Exception as e:
-                        logger.error(f"Error parsing input_format: {str(e)}")
-            except Exception as e:
-                logger.error(f"Error getting model config: {str(e)}")
-                
-            # 如果没有找到用户凭证或出错，使用默认方式
-            return cls.create_vector_embedding_with_bedrock(text, model_name)
+            # 没有用户凭证时使用默认方式
+            return cls.create_vector_embedding_with_bedrock(text, model_name, cls.get_bedrock_user_credentials(model_name))
         elif platform == "brclient-api":
             return cls.create_vector_embedding_with_br_client_api(text, model_name)
         else:
             return cls.create_vector_embedding_with_sagemaker(text, model_name)
 
 
+    @classmethod
+    def get_bedrock_user_credentials(cls, model_name):
+        # 从EmbeddingModelManagement获取模型配置
+        try:
+            from nlq.business.embedding import EmbeddingModelManagement
+            model = EmbeddingModelManagement.get_embedding_model_by_id(f"bedrock.{model_name}")
+            if model and model.input_format:
+                try:
+                    input_data = json.loads(model.input_format)
+                    if "credentials" in input_data:
+                        logger.info(f"Found user credentials for model {model_name}")
+                        return input_data["credentials"]
+                except Exception as e:
+                    logger.error(f"Error parsing input_format: {str(e)}")
+        except Exception as e:
+            logger.error(f"Error getting model config: {str(e)}")
+        return None
+
+    @classmethod
+    def create_vector_embeddings(cls, texts):
+        """
+        Embed a list of texts, return a float32 matrix with one row per text.
+        Cached texts are served from the embedding cache, the misses are deduplicated, split into
+        provider sized batches and embedded concurrently (at most EMBEDDING_BATCH_CONCURRENCY calls).
+        """
+        platform = embedding_info["embedding_platform"]
+        model_name = embedding_info["embedding_name"]
+        dimension = embedding_info.get("embedding_dimension", 1536)
+        if len(texts) == 0:
+            return np.zeros((0, int(dimension)), dtype=np.float32)
+
+        vectors = EmbeddingCache.get_many(platform, model_name, dimension, texts)
+        miss_texts = list(dict.fromkeys(texts[index] for index in range(len(texts)) if index not in vectors))
+        if miss_texts:
+            batch_size = cls.get_embedding_batch_size(platform, model_name)
+            batches = [miss_texts[start:start + batch_size] for start in range(0, len(miss_texts), batch_size)]
+            logger.info(f"Embedding {len(miss_texts)} texts in {len(batches)} batches, "
+                        f"{len(texts) - len(miss_texts)} served from cache")
+            with ThreadPoolExecutor(max_workers=max(1, EMBEDDING_BATCH_CONCURRENCY)) as executor:
+                batch_results = list(executor.map(cls.create_vector_embedding_batch, batches))
+            miss_vectors = {}
+            for batch, batch_vectors in zip(batches, batch_results):
+                miss_vectors.update(zip(batch, batch_vectors))
+            EmbeddingCache.put_many(platform, model_name, dimension, list(miss_vectors.keys()),
+                                    list(miss_vectors.values()))
+            for index, text in enumerate(texts):
+                if index not in vectors:
+                    vectors[index] = miss_vectors[text]
+        return np.vstack([np.asarray(vectors[index], dtype=np.float32) for index in range(len(texts))])
+
+    @classmethod
+    def get_embedding_batch_size(cls, platform, model_name):
+        if platform == "bedrock":
+            return COHERE_EMBEDDING_BATCH_SIZE if "cohere" in model_name.lower() else 1
+        elif platform == "brclient-api":
+            return BR_CLIENT_EMBEDDING_BATCH_SIZE
+        else:
+            return SAGEMAKER_EMBEDDING_BATCH_SIZE
+
+    @classmethod
+    def create_vector_embedding_batch(cls, texts):
+        """
+        Embed one provider sized batch, fall back to one call per text when the batch call fails
+        """
+        model_name = embedding_info["embedding_name"]
+        platform = embedding_info["embedding_platform"]
+        if len(texts) > 1:
+            try:
+                if platform == "bedrock":
+                    embeddings = cls.create_vector_embeddings_with_bedrock_cohere(
+                        texts, model_name, cls.get_bedrock_user_credentials(model_name))
+                elif platform == "brclient-api":
+                    embeddings = cls.create_vector_embeddings_with_br_client_api(texts, model_name)
+                else:
+                    embeddings = cls.create_vector_embeddings_with_sagemaker(texts, model_name)
+                if embeddings is not None and len(embeddings) == len(texts):
+                    return embeddings
+                logger.error(f"Batch embedding returned {len(embeddings) if embeddings else 0} vectors "
+                             f"for {len(texts)} texts, fall back to single text calls")
+            except Exception as e:
+                logger.error(f"Batch embedding error, fall back to single text calls: {str(e)}")
+        return [cls.create_vector_embedding_without_cache(text) for text in texts]
+
+    @classmethod
+    def create_vector_embeddings_with_bedrock_cohere(cls, texts, model_name, user_credentials=None):
+        from utils.llm import get_bedrock_client
+        if user_credentials:
+            bedrock = get_bedrock_client(region=embedding_info.get("embedding_region"), user_credentials=user_credentials)
+        else:
+            bedrock = get_bedrock_client()
+        body = json.dumps({
+            "texts": texts,
+            "input_type": "search_document"
+        })
+        response = bedrock.invoke_model(
+            body=body, modelId=model_name, accept="application/json", contentType="application/json"
+        )
+        response_body = json.loads(response.get("body").read())
+        return response_body.get("embeddings")
+
+    @classmethod
+    def create_vector_embeddings_with_br_client_api(cls, texts, model_name):
+        api_url = embedding_info["br_client_url"]
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": "Bearer " + embedding_info["br_client_key"]
+        }
+        body = {
+            "model": model_name,
+            "input": texts
+        }
+        if "titan" in model_name.lower():
+            body["encoding_format"] = "float"
+        response = requests.post(api_url, headers=headers, data=json.dumps(body))
+        response.raise_for_status()
+        return cls._parse_batch_embedding_response(response.json())
+
+    @classmethod
+    def create_vector_embeddings_with_sagemaker(cls, texts, model_name):
+        body = json.dumps(
+            {
+                "input": texts
+            }
+        )
+        response = invoke_model_sagemaker_endpoint(model_name, body, model_type="embedding")
+        return cls._parse_batch_embedding_response(response)
+
+    @classmethod
+    def _parse_batch_embedding_response(cls, response):
+        # OpenAI compatible format: {"data": [{"embedding": [...], "index": 0}, ...]}
+        if isinstance(response, dict) and isinstance(response.get('data'), list):
+            data = sorted(response['data'], key=lambda item: item.get('index', 0) if isinstance(item, dict) else 0)
+            return [item['embedding'] if isinstance(item, dict) else item for item in data]
+        if isinstance(response, dict) and isinstance(response.get('embeddings'), list):
+            return response['embeddings']
+        if isinstance(response, list) and len(response) > 0 and isinstance(response[0], list):
+            return response
+        return None
+
     @classmethod
     def create_vector_embedding_with_br_client_api(cls, text, model_name):
         try:
@@ -365,12 +517,14 @@ class VectorStore:
     def delete_sample(cls, profile_name, doc_id):
         logger.info(f'delete sample question id: {doc_id} from profile {profile_name}')
         ret = cls.opensearch_dao.delete_sample(opensearch_info['sql_index'], profile_name, doc_id)
+        ProfileManagement.samples_changed(profile_name)
         print(ret)
 
     @classmethod
     def delete_entity_sample(cls, profile_name, doc_id):
         logger.info(f'delete sample question id: {doc_id} from profile {profile_name}')
         ret = cls.opensearch_dao.delete_sample(opensearch_info['ner_index'], profile_name, doc_id)
+        ProfileManagement.samples_changed(profile_name)
         print(ret)
 
     @classmethod
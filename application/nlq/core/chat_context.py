@@ -1,6 +1,75 @@
+import threading
+from concurrent.futures import Future
 from dataclasses import dataclass, field
 from typing import List, Dict, Any
 
+from utils.logging import getLogger
+from utils.query_governor import CancelToken
+
+logger = getLogger()
+
+
+class RequestEmbeddingContext:
+    """
+    Request scoped embedding memo: every distinct text is embedded at most once per request,
+    the query rewrite, the entity slots and the agent sub-task queries all share it.
+    Concurrent callers asking for the same text wait for the first computation.
+    """
+
+    def __init__(self):
+        self._embeddings = {}
+        self._lock = threading.Lock()
+        self.embedding_calls = 0
+
+    def get_embedding(self, text):
+        with self._lock:
+            future = self._embeddings.get(text)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._embeddings[text] = future
+        if not owner:
+            return future.result()
+        try:
+            from nlq.business.vector_store import VectorStore
+            vector = VectorStore.create_vector_embedding(text)
+            with self._lock:
+                self.embedding_calls += 1
+            future.set_result(vector)
+            return vector
+        except Exception as e:
+            # 失败的结果不保留, 下一次调用重新计算
+            with self._lock:
+                self._embeddings.pop(text, None)
+            future.set_exception(e)
+            raise
+
+    def prefetch(self, texts):
+        """
+        Embed the texts that are not in the context yet with one batched call
+        """
+        with self._lock:
+            miss_texts = [text for text in dict.fromkeys(texts) if text not in self._embeddings]
+            futures = {text: Future() for text in miss_texts}
+            self._embeddings.update(futures)
+        if not miss_texts:
+            return
+        try:
+            from nlq.business.vector_store import VectorStore
+            vectors = VectorStore.create_vector_embeddings(miss_texts)
+            with self._lock:
+                self.embedding_calls += 1
+            for text, vector in zip(miss_texts, vectors):
+                futures[text].set_result(vector.tolist())
+        except Exception as e:
+            logger.error(f"Failed to prefetch embeddings, falling back to single calls: {e}")
+            with self._lock:
+                for text in miss_texts:
+                    self._embeddings.pop(text, None)
+            for future in futures.values():
+                future.set_exception(e)
+
+
 @dataclass
 class ProcessingContext:
     search_box: str
@@ -26,3 +95,6 @@ class ProcessingContext:
     previous_state: str = "INITIAL"
     entity_retrieval: List[str] = field(default_factory=list)
     entity_user_select: List[str] = field(default_factory=list)
+    embedding_context: RequestEmbeddingContext = field(default_factory=RequestEmbeddingContext)
+    bypass_result_cache: bool = False
+    cancel_token: CancelToken = field(default_factory=CancelToken)
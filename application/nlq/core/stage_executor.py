@@ -0,0 +1,132 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from dataclasses import dataclass, field
+from typing import Callable, Optional, Tuple
+
+from nlq.core.state import QueryState
+from utils.logging import getLogger
+from utils.query_governor import CancelToken
+
+logger = getLogger()
+
+# 所有请求共用的阶段线程池, 阶段内部不等待其他阶段, 不会相互阻塞
+STAGE_EXECUTOR_POOL_SIZE = int(os.getenv('STAGE_EXECUTOR_POOL_SIZE', '16'))
+
+_stage_pool = ThreadPoolExecutor(max_workers=max(1, STAGE_EXECUTOR_POOL_SIZE), thread_name_prefix='query-stage')
+
+
+@dataclass
+class Stage:
+    """
+    A stage of the question pipeline that does not drive the state transitions.
+
+    :param name: stage name, also the key its consumer uses to read the result
+    :param run: callable returning the stage result, it must not modify the answer
+    :param depends_on: states that must have finished before the stage can start
+    :param condition: evaluated when the dependencies are met, the stage is skipped when it returns False
+    :param event: websocket state text, None to emit nothing
+    """
+    name: str
+    run: Callable[[], object]
+    depends_on: Tuple[QueryState, ...] = ()
+    condition: Callable[[], bool] = field(default=lambda: True)
+    event: Optional[str] = None
+
+
+class StageExecutor:
+    """
+    Runs the stages of the dependency graph of one request next to the main state transitions.
+    The state machine reports every finished state, a stage starts on the shared pool as soon as all
+    the states it depends on have finished, and its consumer waits for the result with result().
+    """
+
+    def __init__(self, stages, emit_state=None):
+        self.stages = stages
+        self.emit_state = emit_state
+        self.finished_states = set()
+        self._futures = {}
+
+    def _emit(self, text, status):
+        if self.emit_state is not None and text:
+            self.emit_state(text, status)
+
+    def _run_stage(self, stage):
+        self._emit(stage.event, "start")
+        try:
+            return stage.run()
+        finally:
+            self._emit(stage.event, "end")
+
+    def state_finished(self, state):
+        self.finished_states.add(state)
+        for stage in self.stages:
+            if stage.name in self._futures or not stage.depends_on:
+                continue
+            if not all(each in self.finished_states for each in stage.depends_on):
+                continue
+            if stage.condition():
+                logger.info(f"Starting stage {stage.name}")
+                self._futures[stage.name] = _stage_pool.submit(self._run_stage, stage)
+            else:
+                self._futures[stage.name] = None
+
+    def started(self, name):
+        return self._futures.get(name) is not None
+
+    def result(self, name):
+        """
+        Wait for the stage and return its result, the exception of a failed stage is raised here
+        """
+        return self._futures[name].result()
+
+
+def run_tasks_with_timeout(task, task_count, max_workers, timeout, cancel_token=None, thread_name_prefix='task'):
+    """
+    Run task(i, task_cancel_token) for every i in range(task_count) on at most max_workers threads.
+
+    Every task gets its own CancelToken, cancelled together with cancel_token of the request. A task still
+    running timeout seconds after a worker picked it up has its token cancelled: its running SQL is cancelled
+    on the server and no further SQL is started, and it is reported with a FutureTimeoutError.
+    Returns [(result, exception)] in task order, exception None for the tasks that succeeded.
+    """
+    if task_count == 0:
+        return []
+    max_workers = max(1, min(max_workers, task_count))
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+    task_tokens = [CancelToken(deadline_seconds=0, parent=cancel_token) for _ in range(task_count)]
+    start_times = {}
+    # a queued task gives up when the workers stay busy longer than all task rounds together
+    queue_deadline = time.time() + timeout * -(-task_count // max_workers)
+
+    def run_task(i):
+        start_times[i] = time.time()
+        return task(i, task_tokens[i])
+
+    try:
+        futures = [executor.submit(run_task, i) for i in range(task_count)]
+        outcomes = []
+        for i, future in enumerate(futures):
+            try:
+                # the timeout of a task starts when a worker picks it up, not while it is queued
+                while not future.done():
+                    if i not in start_times:
+                        if time.time() > queue_deadline:
+                            future.cancel()
+                            raise FutureTimeoutError()
+                        wait([future], timeout=0.1)
+                        continue
+                    remaining = start_times[i] + timeout - time.time()
+                    if remaining <= 0:
+                        raise FutureTimeoutError()
+                    wait([future], timeout=remaining)
+                outcomes.append((future.result(), None))
+            except FutureTimeoutError as e:
+                task_tokens[i].cancel(f'task timed out after {timeout} seconds')
+                outcomes.append((None, e))
+            except Exception as e:
+                outcomes.append((None, e))
+        return outcomes
+    finally:
+        # 超时的任务已经取消, 不阻塞当前请求, 在后台结束
+        executor.shutdown(wait=False)
@@ -1,24 +1,35 @@
 import json
+import os
 import string
 import functools
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
 import pandas as pd
 
 from api.schemas import Answer, KnowledgeSearchResult, SQLSearchResult, AgentSearchResult, AskReplayResult, \
     AskEntitySelect, ChartEntity, TaskSQLSearchResult
 from nlq.business.datasource.factory import DataSourceFactory
 from nlq.business.log_store import LogManagement
+from nlq.business.semantic_cache import SemanticAnswerCache
+from nlq.business.sql_validator import SQLValidator
 from nlq.core.chat_context import ProcessingContext
+from nlq.core.stage_executor import Stage, StageExecutor, run_tasks_with_timeout
 from nlq.core.state import QueryState
 from utils.apis import get_sql_result_tool
 from utils.llm import get_query_intent, get_query_rewrite, knowledge_search, text_to_sql, data_analyse_tool, \
     generate_suggested_question, get_agent_cot_task, data_visualization
 from utils.logging import getLogger
 from utils.opensearch import get_retrieve_opensearch
-from utils.text_search import entity_retrieve_search, qa_retrieve_search, agent_text_search, agent_text_search_websocket
+from utils.text_search import entity_retrieve_search, qa_retrieve_search, entity_qa_retrieve_search, agent_text_search
 from utils.tool import get_generated_sql, get_generated_sql_explain, change_class_to_str, get_current_time
 
 logger = getLogger()
 
+# agent 子任务 SQL 并发执行数和单个任务的超时时间 (秒, 包含纠错重试)
+AGENT_SQL_CONCURRENCY = int(os.getenv('AGENT_SQL_CONCURRENCY', '4'))
+AGENT_SQL_TASK_TIMEOUT = float(os.getenv('AGENT_SQL_TASK_TIMEOUT', '300'))
+
 
 def log_execution(func):
     @functools.wraps(func)
@@ -75,6 +86,7 @@ class QueryStateMachine:
         self.entity_slot = []
         self.normal_search_entity_slot = []
         self.normal_search_qa_retrival = []
+        self.prefetched_qa_retrival = None
         self.agent_cot_retrieve = []
         self.agent_task_split = {}
         self.agent_search_result = []
@@ -83,6 +95,9 @@ class QueryStateMachine:
         self.use_auto_correction_flag = False
         self.first_sql_execute_info = {}
         self.token_info = {}
+        self.stage_executor = None
+        self.token_info_lock = threading.Lock()
+        self.semantic_cache_hit = False
 
     def transition(self, new_state):
         self.state = new_state
@@ -99,46 +114,92 @@ class QueryStateMachine:
         elif state_name == QueryState.USER_SELECT_ENTITY.name:
             return QueryState.USER_SELECT_ENTITY
 
-    def run(self):
+    # state -> (websocket state text, handler), ASK_ENTITY_SELECT and AGENT_SEARCH emit no stage level event
+    STATE_HANDLERS = {
+        QueryState.INITIAL: ("Query Rewrite", "handle_initial"),
+        QueryState.REJECT_INTENT: ("Reject Intent", "handle_reject_intent"),
+        QueryState.KNOWLEDGE_SEARCH: ("Knowledge Search Intent", "handle_knowledge_search"),
+        QueryState.ENTITY_RETRIEVAL: ("Entity Info Retrieval", "handle_entity_retrieval"),
+        QueryState.QA_RETRIEVAL: ("QA Info Retrieval", "handle_qa_retrieval"),
+        QueryState.SQL_GENERATION: ("Generating SQL", "handle_sql_generation"),
+        QueryState.INTENT_RECOGNITION: ("Query Intent Analyse", "handle_intent_recognition"),
+        QueryState.EXECUTE_QUERY: ("Database SQL Execution", "handle_execute_query"),
+        QueryState.ANALYZE_DATA: ("Generating Data Insights", "handle_analyze_data"),
+        QueryState.ASK_ENTITY_SELECT: (None, "handle_entity_selection"),
+        QueryState.AGENT_TASK: ("Agent Task Split", "handle_agent_task"),
+        QueryState.AGENT_SEARCH: (None, "handle_agent_sql_generation"),
+        QueryState.AGENT_DATA_SUMMARY: ("Generating Data Insights", "handle_agent_analyze_data"),
+        QueryState.USER_SELECT_ENTITY: ("User Entity Select", "handle_user_select_entity"),
+    }
+
+    def build_stages(self):
+        """
+        The stages that only depend on the rewritten query or on the intent, they run next to the main transitions:
+        the agent index lookup overlaps the intent recognition, the suggested questions overlap
+        everything after the intent recognition, including the data visualization.
+        """
+        return [
+            Stage(name="AGENT_COT_RETRIEVAL",
+                  run=self._perform_agent_cot_retrieval,
+                  depends_on=(QueryState.INITIAL,),
+                  condition=lambda: (self.context.agent_cot_flag and self.context.intent_ner_recognition_flag
+                                     and self.state == QueryState.INTENT_RECOGNITION)),
+            Stage(name="SUGGEST_QUESTION",
+                  run=self._generate_suggested_question,
+                  depends_on=(QueryState.INTENT_RECOGNITION,),
+                  condition=self._need_suggested_question,
+                  event="Generating Suggested Questions"),
+        ]
+
+    def run(self, emit_state=None, log_id=None):
+        """
+        Run the question to the end and return the answer.
+
+        :param emit_state: optional callable(text, status) receiving the "start" / "end" events of every stage,
+            it may be called from the stage threads
+        :param log_id: the answer is saved to the chat history when given and the question completed
+        """
+        emit = emit_state if emit_state is not None else lambda text, status: None
+        self.stage_executor = StageExecutor(self.build_stages(), emit_state)
         if self.previous_state == QueryState.USER_SELECT_ENTITY:
             self.transition(QueryState.USER_SELECT_ENTITY)
 
         while self.state != QueryState.COMPLETE and self.state != QueryState.ERROR:
-            if self.state == QueryState.INITIAL:
-                self.handle_initial()
-            elif self.get_state() == QueryState.REJECT_INTENT:
-                self.handle_reject_intent()
-            elif self.get_state() == QueryState.KNOWLEDGE_SEARCH:
-                self.handle_knowledge_search()
-            elif self.state == QueryState.ENTITY_RETRIEVAL:
-                self.handle_entity_retrieval()
-            elif self.state == QueryState.QA_RETRIEVAL:
-                self.handle_qa_retrieval()
-            elif self.state == QueryState.SQL_GENERATION:
-                self.handle_sql_generation()
-            elif self.state == QueryState.INTENT_RECOGNITION:
-                self.handle_intent_recognition()
-            elif self.state == QueryState.EXECUTE_QUERY:
-                self.handle_execute_query()
-            elif self.state == QueryState.ANALYZE_DATA:
-                self.handle_analyze_data()
-            elif self.state == QueryState.ASK_ENTITY_SELECT:
-                self.handle_entity_selection()
-            elif self.state == QueryState.AGENT_TASK:
-                self.handle_agent_task()
-            elif self.state == QueryState.AGENT_SEARCH:
-                self.handle_agent_sql_generation()
-            elif self.state == QueryState.AGENT_DATA_SUMMARY:
-                self.handle_agent_analyze_data()
-            elif self.state == QueryState.USER_SELECT_ENTITY:
-                self.handle_user_select_entity()
-            else:
+            current_state = self.state
+            if current_state not in self.STATE_HANDLERS:
                 self.state = QueryState.ERROR
-
-        if self.state == QueryState.COMPLETE:
+                break
+            event, handler_name = self.STATE_HANDLERS[current_state]
+            if event:
+                emit(event, "start")
+            if current_state == QueryState.AGENT_SEARCH:
+                self.handle_agent_sql_generation(progress_callback=emit_state)
+            else:
+                getattr(self, handler_name)()
+            if event:
+                emit(event, "end")
+            self.stage_executor.state_finished(current_state)
+
+        # the suggested questions are still generating in the background while the data is visualized
+        complete = self.state == QueryState.COMPLETE
+        if complete:
+            # 在可视化修改 sql_data 之前保存
+            self._save_to_semantic_cache()
+            emit("Data Visualization", "start")
             self.handle_data_visualization()
-        if self.context.gen_suggested_question_flag:
-            self.handle_suggest_question()
+            emit("Data Visualization", "end")
+
+        if self.answer.query_intent != "entity_select" and self._need_suggested_question():
+            if self.stage_executor.started("SUGGEST_QUESTION"):
+                self._apply_suggested_question(*self.stage_executor.result("SUGGEST_QUESTION"))
+            else:
+                emit("Generating Suggested Questions", "start")
+                self.handle_suggest_question()
+                emit("Generating Suggested Questions", "end")
+
+        if complete and log_id is not None:
+            self.handle_add_to_log(log_id=log_id)
+        return self.answer
 
     @log_execution
     def handle_initial(self):
@@ -232,7 +293,14 @@ class QueryStateMachine:
 
     def _perform_entity_retrieval(self):
         if self.context.use_rag_flag:
-            return entity_retrieve_search(self.entity_slot, self.context.opensearch_info, self.context.selected_profile)
+            if self.answer.query_intent == "normal_search":
+                # QA retrieval only depends on the rewritten query, fetch it in the same msearch
+                entity_retrieve, self.prefetched_qa_retrival = entity_qa_retrieve_search(
+                    self.entity_slot, self.context.query_rewrite, self.context.opensearch_info,
+                    self.context.selected_profile, self.context.embedding_context)
+                return entity_retrieve
+            return entity_retrieve_search(self.entity_slot, self.context.opensearch_info, self.context.selected_profile,
+                                          self.context.embedding_context)
         else:
             return []
 
@@ -247,9 +315,11 @@ class QueryStateMachine:
             self.transition(QueryState.ERROR)
 
     def _perform_qa_retrieval(self):
+        if self.prefetched_qa_retrival is not None:
+            return self.prefetched_qa_retrival
         if self.context.use_rag_flag:
             return qa_retrieve_search(self.context.query_rewrite, self.context.opensearch_info,
-                                      self.context.selected_profile)
+                                      self.context.selected_profile, self.context.embedding_context)
         return []
 
     @log_execution
@@ -284,7 +354,8 @@ class QueryStateMachine:
                                                    sql_examples=self.normal_search_qa_retrival,
                                                    ner_example=self.normal_search_entity_slot,
                                                    dialect=self.context.database_profile['db_type'],
-                                                   environment_dict=self.context.database_profile['prompt_environment'])
+                                                   environment_dict=self.context.database_profile['prompt_environment'],
+                                                   embedding_context=self.context.embedding_context)
             self.token_info[QueryState.SQL_GENERATION.name] = model_response.token_info
             sql = get_generated_sql(response)
             # post-processing the sql
@@ -306,6 +377,7 @@ class QueryStateMachine:
                                                    ner_example=self.normal_search_entity_slot,
                                                    dialect=self.context.database_profile['db_type'],
                                                    model_provider=None,
+                                                   embedding_context=self.context.embedding_context,
                                                    additional_info='''\n NOTE: when I try to write a SQL <sql>{sql_statement}</sql>, I got an error <error>{error}</error>. Please consider and avoid this problem. '''.format(
                                                        sql_statement=self.intent_search_result["original_sql"],
                                                        error=self.intent_search_result["sql_execute_result"][
@@ -321,30 +393,24 @@ class QueryStateMachine:
             return "", "", ""
 
     @log_execution
-    def handle_agent_sql_generation(self):
+    def handle_agent_sql_generation(self, progress_callback=None):
+        """
+        :param progress_callback: optional callable(text, status) receiving the per sub-task start / end events
+        """
         agent_search_result, token_info = agent_text_search(self.context.query_rewrite, self.context.model_type,
                                                             self.context.database_profile,
                                                             self.entity_slot, self.context.opensearch_info,
                                                             self.context.selected_profile, self.context.use_rag_flag,
-                                                            self.agent_task_split)
-        self.token_info[QueryState.SQL_GENERATION.name + "AGENT"] = token_info
-        self.agent_search_result = agent_search_result
-        self.transition(QueryState.AGENT_DATA_SUMMARY)
-
-    async def handle_agent_sql_generation_websocket(self, websocket, session_id, user_id):
-        state_name = self.get_state().name if self.get_state() else "Unknown State"
-        logger.info(f"Executing handle_agent_sql_generation_websocket in state {state_name}")
-        agent_search_result, token_info = await agent_text_search_websocket(websocket, session_id, user_id, self.context.query_rewrite, self.context.model_type,
-                                                            self.context.database_profile,
-                                                            self.entity_slot, self.context.opensearch_info,
-                                                            self.context.selected_profile, self.context.use_rag_flag,
-                                                            self.agent_task_split)
+                                                            self.agent_task_split, self.context.embedding_context,
+                                                            progress_callback)
         self.token_info[QueryState.SQL_GENERATION.name + "AGENT"] = token_info
         self.agent_search_result = agent_search_result
         self.transition(QueryState.AGENT_DATA_SUMMARY)
 
     @log_execution
     def handle_intent_recognition(self):
+        if self._apply_semantic_cache():
+            return
         try:
             if self.context.intent_ner_recognition_flag:
                 intent_response, model_response = get_query_intent(self.context.model_type, self.context.query_rewrite,
@@ -362,6 +428,70 @@ class QueryStateMachine:
                 f"The context is {self.context.search_box}, handle_intent_recognition encountered an error: {e}")
             self.transition(QueryState.ERROR)
 
+    def _apply_semantic_cache(self):
+        """
+        Reuse the SQL (and the fresh result) of a near identical question answered before,
+        skips intent recognition, retrieval and SQL generation
+        """
+        if not SemanticAnswerCache.is_enabled():
+            return False
+        try:
+            embedding = self.context.embedding_context.get_embedding(self.context.query_rewrite)
+            cached = SemanticAnswerCache.lookup(self.context.selected_profile, self.context.database_profile,
+                                                self.context.username, embedding)
+        except Exception as e:
+            logger.error(f"The context is {self.context.search_box}, semantic cache lookup encountered an error: {e}")
+            return False
+        if cached is None:
+            return False
+        self.semantic_cache_hit = True
+        self.search_intent_flag = True
+        self.answer.query_intent = "normal_search"
+        self.intent_search_result["sql"] = cached["sql"]
+        self.intent_search_result["response"] = cached["response"]
+        self.intent_search_result["original_sql"] = cached["original_sql"]
+        self.answer.sql_search_result.sql = cached["sql"].strip()
+        self.answer.sql_search_result.sql_gen_process = cached["sql_gen_process"]
+        if not self.context.visualize_results_flag:
+            self.transition(QueryState.COMPLETE)
+        elif cached["data"] is not None and not self.context.bypass_result_cache:
+            self.intent_search_result["sql_execute_result"] = {"data": cached["data"], "sql": cached["sql"],
+                                                               "status_code": 200, "error_info": ""}
+            self.answer.sql_search_result.sql_data = cached["data"]
+            if self.context.data_with_analyse and cached["data_analyse"]:
+                self.answer.sql_search_result.data_analyse = cached["data_analyse"]
+                self.transition(QueryState.COMPLETE)
+            elif self.context.data_with_analyse:
+                self.transition(QueryState.ANALYZE_DATA)
+            else:
+                self.transition(QueryState.COMPLETE)
+        else:
+            self.transition(QueryState.EXECUTE_QUERY)
+        return True
+
+    def _save_to_semantic_cache(self):
+        if not SemanticAnswerCache.is_enabled() or self.semantic_cache_hit:
+            return
+        # 用户选择实体后的回答依赖用户的选择, 不缓存
+        if self.answer.query_intent != "normal_search" or self.previous_state == QueryState.USER_SELECT_ENTITY:
+            return
+        sql_execute_result = self.intent_search_result.get("sql_execute_result")
+        if sql_execute_result is None or sql_execute_result["status_code"] != 200:
+            return
+        try:
+            SemanticAnswerCache.put(self.context.selected_profile, self.context.database_profile, self.context.username,
+                                    self.context.query_rewrite,
+                                    self.context.embedding_context.get_embedding(self.context.query_rewrite),
+                                    self.intent_search_result["sql"],
+                                    self.intent_search_result.get("original_sql", ""),
+                                    self.intent_search_result.get("response", ""),
+                                    self.answer.sql_search_result.sql_gen_process,
+                                    data=sql_execute_result["data"],
+                                    data_analyse=self.answer.sql_search_result.data_analyse
+                                    if self.context.data_with_analyse else None)
+        except Exception as e:
+            logger.error(f"The context is {self.context.search_box}, semantic cache save encountered an error: {e}")
+
     def _process_intent_response(self, intent_response):
         intent = intent_response.get("intent", "normal_search")
         self.entity_slot = intent_response.get("slot", [])
@@ -448,12 +578,14 @@ class QueryStateMachine:
             sql = self.intent_search_result.get("sql", "")
             sql_execute_result = self._execute_sql(sql)
             self.intent_search_result["sql_execute_result"] = sql_execute_result
-            self.answer.sql_search_result.sql_data = sql_execute_result["data"]
+            self._set_sql_data(sql_execute_result)
             if self.context.data_with_analyse and sql_execute_result["status_code"] == 200:
                 self.transition(QueryState.ANALYZE_DATA)
             elif sql_execute_result["status_code"] == 200:
                 self.transition(QueryState.COMPLETE)
-            elif sql_execute_result["status_code"] == 500 and self.context.auto_correction_flag:
+            elif (sql_execute_result["status_code"] == 500 and self.context.auto_correction_flag
+                  and sql_execute_result.get("error_type") != "cancelled"):
+                # 超时的 SQL 也会纠错, 错误信息中包含超时原因
                 self.use_auto_correction_flag = True
                 self.first_sql_execute_info = sql_execute_result
                 sql, response, original_sql = self._generate_sql_again()
@@ -461,7 +593,7 @@ class QueryStateMachine:
                 self.answer.sql_search_result.sql = sql
                 self.answer.sql_search_result.sql_gen_process = get_generated_sql_explain(response)
                 self.intent_search_result["sql_execute_result"] = sql_execute_result
-                self.answer.sql_search_result.sql_data = sql_execute_result["data"]
+                self._set_sql_data(sql_execute_result)
                 if self.context.data_with_analyse and sql_execute_result["status_code"] == 200:
                     self.transition(QueryState.ANALYZE_DATA)
                 elif sql_execute_result["status_code"] == 200:
@@ -477,10 +609,24 @@ class QueryStateMachine:
             logger.error(f"The context is {self.context.search_box}, handle_execute_query encountered an error: {e}")
             self.transition(QueryState.ERROR)
 
-    def _execute_sql(self, sql):
+    def _set_sql_data(self, sql_execute_result):
+        self.answer.sql_search_result.sql_data = sql_execute_result["data"]
+        self.answer.sql_search_result.sql_data_truncated = sql_execute_result.get("truncated", False)
+        self.answer.sql_search_result.sql_data_total_count = sql_execute_result.get("total_count")
+
+    def _execute_sql(self, sql, cancel_token=None):
         if sql == "":
             return {"data": [], "sql": sql, "status_code": 500, "error_info": "The SQL is empty."}
-        return get_sql_result_tool(self.context.database_profile, sql)
+        # 执行前先按 profile 的表结构校验, 校验失败时直接进入纠错, 不访问数据库
+        validation_errors = SQLValidator.validate(sql, self.context.database_profile.get('tables_info'),
+                                                  self.context.database_profile.get('db_type'))
+        if validation_errors:
+            logger.info(f"SQL validation failed: {validation_errors}")
+            return {"data": [], "sql": sql, "status_code": 500, "error_type": "validation",
+                    "error_info": "SQL validation failed: " + " ".join(validation_errors)}
+        return get_sql_result_tool(self.context.database_profile, sql, username=self.context.username,
+                                   bypass_cache=self.context.bypass_result_cache,
+                                   cancel_token=cancel_token or self.context.cancel_token)
 
     @log_execution
     def handle_analyze_data(self):
@@ -507,8 +653,10 @@ class QueryStateMachine:
     def handle_agent_task(self):
         # Analyze the task
         try:
-            self.agent_cot_retrieve = get_retrieve_opensearch(self.context.opensearch_info, self.context.query_rewrite,
-                                                              "agent", self.context.selected_profile, 2, 0.5)
+            if self.stage_executor is not None and self.stage_executor.started("AGENT_COT_RETRIEVAL"):
+                self.agent_cot_retrieve = self.stage_executor.result("AGENT_COT_RETRIEVAL")
+            else:
+                self.agent_cot_retrieve = self._perform_agent_cot_retrieval()
 
             agent_cot_task_result, model_response = get_agent_cot_task(self.context.model_type,
                                                                        self.context.database_profile["prompt_map"],
@@ -524,39 +672,21 @@ class QueryStateMachine:
             logger.error(f"The context is {self.context.search_box}, handle_agent_task encountered an error: {e}")
             self.transition(QueryState.ERROR)
 
+    def _perform_agent_cot_retrieval(self):
+        return get_retrieve_opensearch(self.context.opensearch_info, self.context.query_rewrite,
+                                       "agent", self.context.selected_profile, 2, 0.5,
+                                       self.context.embedding_context)
+
     @log_execution
     def handle_agent_analyze_data(self):
         # Analyze the data
         try:
             filter_deep_dive_sql_result = []
             agent_sql_search_result = []
+            # 所有子任务的 SQL 并发执行 (失败时在同一个任务内纠错重试), 结果按任务顺序组装
+            agent_task_results = self._execute_agent_tasks()
             for i in range(len(self.agent_search_result)):
-                each_task_res = get_sql_result_tool(
-                    self.context.database_profile,
-                    self.agent_search_result[i]["sql"])
-                # 添加SQL自动纠错逻辑
-                if each_task_res["status_code"] == 500 and self.context.auto_correction_flag:
-                    logger.info(f"Attempting to correct SQL for agent task {i+1}")
-                    # 保存原始SQL和错误信息
-                    original_sql = self.agent_search_result[i]["sql"]
-                    error_info = each_task_res["error_info"]
-                    
-                    # 重新生成SQL
-                    corrected_sql, corrected_response = self._generate_agent_sql_again(
-                        self.agent_search_result[i]["query"], 
-                        original_sql, 
-                        error_info
-                    )
-                    
-                    if corrected_sql and corrected_sql != "":
-                        # 使用修复后的SQL重新执行
-                        logger.info(f"Retrying with corrected SQL: {corrected_sql}")
-                        self.agent_search_result[i]["sql"] = corrected_sql
-                        self.agent_search_result[i]["response"] = corrected_response
-                        each_task_res = get_sql_result_tool(
-                            self.context.database_profile,
-                            corrected_sql
-                        )
+                each_task_res = agent_task_results[i]
                 if each_task_res["status_code"] == 200 and len(each_task_res["data"]) > 0:
                     self.agent_search_result[i]["data_result"] = each_task_res["data"].to_json(
                         orient='records')
@@ -568,7 +698,9 @@ class QueryStateMachine:
                                                           sql=self.agent_search_result[i]["sql"],
                                                           data_show_type="table",
                                                           sql_gen_process=each_task_sql_response,
-                                                          data_analyse="", sql_data_chart=[])
+                                                          data_analyse="", sql_data_chart=[],
+                                                          sql_data_truncated=each_task_res.get("truncated", False),
+                                                          sql_data_total_count=each_task_res.get("total_count"))
                     query_value = self.agent_search_result[i]["query"]
                     if isinstance(query_value, list):
                         try:
@@ -591,10 +723,8 @@ class QueryStateMachine:
                         "sql": self.agent_search_result[i]["sql"]
                     }
                     
-                    # 获取错误信息（如果有）
-                    task_res = get_sql_result_tool(
-                        self.context.database_profile,
-                        self.agent_search_result[i]["sql"])
+                    # 获取错误信息（如果有）, 直接使用上面的执行结果, 不再重复执行
+                    task_res = agent_task_results[i]
                     if task_res["status_code"] == 500:
                         task_info["error"] = task_res["error_info"]
                     else:
@@ -642,19 +772,84 @@ class QueryStateMachine:
                 f"The context is {self.context.search_box}, handle_agent_analyze_data encountered an error: {e}")
             self.transition(QueryState.ERROR)
 
+    def _execute_agent_task(self, i, cancel_token=None):
+        """
+        Execute the SQL of one agent sub-task, a failed SQL is corrected once and executed again.
+        The SQL runs with the cancel_token of the task, cancelled when the task times out.
+        Returns (execute result, (corrected_sql, corrected_response) or None), the caller applies the correction
+        so a timed out task never changes the assembled answer.
+        """
+        correction = None
+        each_task_res = self._execute_sql(self.agent_search_result[i]["sql"], cancel_token)
+        # 添加SQL自动纠错逻辑
+        if (each_task_res["status_code"] == 500 and self.context.auto_correction_flag
+                and each_task_res.get("error_type") != "cancelled"):
+            logger.info(f"Attempting to correct SQL for agent task {i+1}")
+            # 保存原始SQL和错误信息
+            original_sql = self.agent_search_result[i]["sql"]
+            error_info = each_task_res["error_info"]
+            
+            # 重新生成SQL
+            corrected_sql, corrected_response = self._generate_agent_sql_again(
+                self.agent_search_result[i]["query"], 
+                original_sql, 
+                error_info
+            )
+            
+            if corrected_sql and corrected_sql != "":
+                # 使用修复后的SQL重新执行
+                logger.info(f"Retrying with corrected SQL: {corrected_sql}")
+                correction = (corrected_sql, corrected_response)
+                each_task_res = self._execute_sql(corrected_sql, cancel_token)
+        return each_task_res, correction
+
+    def _execute_agent_tasks(self):
+        """
+        Run _execute_agent_task for every sub-task on at most AGENT_SQL_CONCURRENCY threads sharing the pooled engine.
+        A task still running AGENT_SQL_TASK_TIMEOUT seconds after it started is cancelled and reported as failed.
+        Returns the execution results in task order.
+        """
+        outcomes = run_tasks_with_timeout(self._execute_agent_task, len(self.agent_search_result),
+                                          AGENT_SQL_CONCURRENCY, AGENT_SQL_TASK_TIMEOUT,
+                                          cancel_token=self.context.cancel_token, thread_name_prefix='agent-sql')
+        agent_task_results = []
+        for i, (outcome, error) in enumerate(outcomes):
+            if isinstance(error, FutureTimeoutError):
+                logger.error(f"Agent task {i+1} SQL execution timed out after {AGENT_SQL_TASK_TIMEOUT}s")
+                agent_task_results.append({"data": [], "sql": self.agent_search_result[i]["sql"], "status_code": 500,
+                                           "error_info": f"SQL execution timed out after {AGENT_SQL_TASK_TIMEOUT} seconds"})
+            elif error is not None:
+                logger.error(f"Agent task {i+1} SQL execution failed: {error}")
+                agent_task_results.append({"data": [], "sql": self.agent_search_result[i]["sql"], "status_code": 500,
+                                           "error_info": str(error)})
+            else:
+                each_task_res, correction = outcome
+                if correction is not None:
+                    self.agent_search_result[i]["sql"], self.agent_search_result[i]["response"] = correction
+                agent_task_results.append(each_task_res)
+        return agent_task_results
+
     @log_execution
     def handle_suggest_question(self):
         # Handle suggest question
-        if self.context.gen_suggested_question_flag:
-            if self.search_intent_flag or self.agent_intent_flag:
-                generated_sq, model_response = generate_suggested_question(self.context.database_profile['prompt_map'],
-                                                                           self.context.query_rewrite,
-                                                                           model_id=self.context.model_type,
-                                                                           environment_dict=self.context.database_profile['prompt_environment'])
-                self.token_info["SUGGEST_QUESTION"] = model_response.token_info
-                split_strings = generated_sq.split("[generate]")
-                gen_sq_list = [s.strip() for s in split_strings if s.strip()]
-                self.answer.suggested_question = gen_sq_list
+        if self._need_suggested_question():
+            self._apply_suggested_question(*self._generate_suggested_question())
+
+    def _need_suggested_question(self):
+        return self.context.gen_suggested_question_flag and (self.search_intent_flag or self.agent_intent_flag)
+
+    def _generate_suggested_question(self):
+        generated_sq, model_response = generate_suggested_question(self.context.database_profile['prompt_map'],
+                                                                   self.context.query_rewrite,
+                                                                   model_id=self.context.model_type,
+                                                                   environment_dict=self.context.database_profile['prompt_environment'])
+        split_strings = generated_sq.split("[generate]")
+        gen_sq_list = [s.strip() for s in split_strings if s.strip()]
+        return gen_sq_list, model_response.token_info
+
+    def _apply_suggested_question(self, gen_sq_list, token_info):
+        self.token_info["SUGGEST_QUESTION"] = token_info
+        self.answer.suggested_question = gen_sq_list
 
     def delete_error_log_entry(self, key):
         if key in self.answer.error_log:
@@ -783,22 +978,24 @@ class QueryStateMachine:
                 ner_example=self.normal_search_entity_slot if hasattr(self, 'normal_search_entity_slot') else [],
                 dialect=self.context.database_profile['db_type'],
                 model_provider=None,
-                additional_info=additional_info
+                additional_info=additional_info,
+                embedding_context=self.context.embedding_context
             )
             
-            # 记录token使用情况
+            # 记录token使用情况, 多个子任务可能同时纠错
             if model_response.token_info is not None and len(model_response.token_info) > 0:
-                if QueryState.SQL_GENERATION.name + "AGENT_CORRECTION" not in self.token_info:
-                    self.token_info[QueryState.SQL_GENERATION.name + "AGENT_CORRECTION"] = {
-                        "input_tokens": 0,
-                        "output_tokens": 0
-                    }
+                with self.token_info_lock:
+                    if QueryState.SQL_GENERATION.name + "AGENT_CORRECTION" not in self.token_info:
+                        self.token_info[QueryState.SQL_GENERATION.name + "AGENT_CORRECTION"] = {
+                            "input_tokens": 0,
+                            "output_tokens": 0
+                        }
                 
-                if "input_tokens" in model_response.token_info:
-                    self.token_info[QueryState.SQL_GENERATION.name + "AGENT_CORRECTION"]["input_tokens"] += model_response.token_info["input_tokens"]
+                    if "input_tokens" in model_response.token_info:
+                        self.token_info[QueryState.SQL_GENERATION.name + "AGENT_CORRECTION"]["input_tokens"] += model_response.token_info["input_tokens"]
                 
-                if "output_tokens" in model_response.token_info:
-                    self.token_info[QueryState.SQL_GENERATION.name + "AGENT_CORRECTION"]["output_tokens"] += model_response.token_info["output_tokens"]
+                    if "output_tokens" in model_response.token_info:
+                        self.token_info[QueryState.SQL_GENERATION.name + "AGENT_CORRECTION"]["output_tokens"] += model_response.token_info["output_tokens"]
             
             # 提取SQL
             sql = get_generated_sql(response)
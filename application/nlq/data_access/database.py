@@ -1,13 +1,22 @@
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 
 import sqlalchemy as db
 from sqlalchemy import text, Column, inspect, Table
 
 from nlq.data_access.dynamo_connection import ConnectConfigEntity
+from nlq.data_access.engine_registry import EngineRegistry
+from nlq.data_access.schema_catalog import SchemaCatalog, fingerprint_columns
 from utils.logging import getLogger
 
 logger = getLogger()
 
+# 并发反射表结构的线程数, 同时不超过连接池的大小
+SCHEMA_REFLECTION_CONCURRENCY = int(os.getenv('SCHEMA_REFLECTION_CONCURRENCY', '8'))
+# 每个线程一次反射的表数量
+SCHEMA_REFLECTION_BATCH_SIZE = int(os.getenv('SCHEMA_REFLECTION_BATCH_SIZE', '10'))
+
 class RelationDatabase():
     db_mapping = {
         'mysql': 'mysql+pymysql',
@@ -83,6 +92,18 @@ class RelationDatabase():
             )
         return db_url
 
+    @classmethod
+    def get_engine_by_connection(cls, connection: ConnectConfigEntity):
+        """
+        Get the shared pooled engine of the connection
+        """
+        if connection.db_type == "bigquery":
+            password = json.loads(connection.db_pwd)
+            return EngineRegistry.get_engine(connection.db_host, credentials_info=password)
+        db_url = cls.get_db_url(connection.db_type, connection.db_user, connection.db_pwd, connection.db_host,
+                                connection.db_port, connection.db_name)
+        return EngineRegistry.get_engine(db_url)
+
     @classmethod
     def test_connection(cls, db_type, user, password, host, port, db_name) -> bool:
         try:
@@ -100,7 +121,10 @@ class RelationDatabase():
                     engine = db.create_engine(url=host, credentials_info=password)
                 else:
                     engine = db.create_engine(cls.get_db_url(db_type, user, password, host, port, db_name))
-            connection = engine.connect()
+            # 测试连接使用临时 engine，不放入连接池
+            with engine.connect():
+                pass
+            engine.dispose()
             return True
         except Exception as e:
             logger.exception(e)
@@ -110,13 +134,7 @@ class RelationDatabase():
     @classmethod
     def get_all_schema_names_by_connection(cls, connection: ConnectConfigEntity):
         db_type = connection.db_type
-        db_url = cls.get_db_url(db_type, connection.db_user, connection.db_pwd, connection.db_host, connection.db_port,
-                                connection.db_name)
-        if db_type == "bigquery":
-            password = json.loads(connection.db_pwd)
-            engine = db.create_engine(url=connection.db_host, credentials_info=password)
-        else:
-            engine = db.create_engine(db_url)
+        engine = cls.get_engine_by_connection(connection)
         inspector = inspect(engine)
 
         if db_type == 'postgresql':
@@ -130,15 +148,14 @@ class RelationDatabase():
         return schemas
 
     @classmethod
-    def get_all_schema_and_table_names_by_connection(cls, connection: ConnectConfigEntity):
+    def get_all_schema_and_table_names_by_connection(cls, connection: ConnectConfigEntity, refresh=False):
+        return SchemaCatalog.get_schema_tables(connection, lambda: cls._list_schema_and_table_names(connection),
+                                               refresh=refresh)
+
+    @classmethod
+    def _list_schema_and_table_names(cls, connection: ConnectConfigEntity):
         db_type = connection.db_type
-        db_url = cls.get_db_url(db_type, connection.db_user, connection.db_pwd, connection.db_host, connection.db_port,
-                                connection.db_name)
-        if db_type == "bigquery":
-            password = json.loads(connection.db_pwd)
-            engine = db.create_engine(url=connection.db_host, credentials_info=password)
-        else:
-            engine = db.create_engine(db_url)
+        engine = cls.get_engine_by_connection(connection)
         inspector = inspect(engine)
 
         if db_type == 'postgresql':
@@ -149,10 +166,23 @@ class RelationDatabase():
         else:
             raise ValueError("Unsupported database type")
 
-        schema_table_dict = {}
-        for schema in schemas:
-            schema_table_dict[schema] = inspector.get_table_names(schema=schema)
-        return schema_table_dict
+        # the inspector caches what it read and is not shared between threads
+        table_names = cls._map_parallel(engine, lambda schema: inspect(engine).get_table_names(schema=schema),
+                                        schemas)
+        return dict(zip(schemas, table_names))
+
+    @classmethod
+    def _map_parallel(cls, engine, func, items):
+        """
+        Run func over the items on a bounded thread pool, no larger than the connection pool of the shared engine
+        """
+        if len(items) <= 1:
+            return [func(item) for item in items]
+        pool_config = EngineRegistry.get_pool_config(engine.url)
+        max_workers = max(1, min(SCHEMA_REFLECTION_CONCURRENCY, len(items),
+                                 pool_config['pool_size'] + pool_config['max_overflow']))
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='schema-reflection') as executor:
+            return list(executor.map(func, items))
 
     @classmethod
     def get_all_tables_by_connection(cls, connection: ConnectConfigEntity, schemas=None):
@@ -163,122 +193,165 @@ class RelationDatabase():
 
     @classmethod
     def get_metadata_by_connection(cls, connection, schemas):
-        db_url = cls.get_db_url(connection.db_type, connection.db_user, connection.db_pwd, connection.db_host,
-                                connection.db_port, connection.db_name)
-        if connection.db_type == "bigquery":
-            password = json.loads(connection.db_pwd)
-            engine = db.create_engine(url=connection.db_host, credentials_info=password)
-        else:
-            engine = db.create_engine(db_url)
-        # connection = engine.connect()
-        metadata = db.MetaData()
+        engine = cls.get_engine_by_connection(connection)
         if connection.db_type == 'bigquery':
+            metadata = db.MetaData()
             metadata.reflect(bind=engine)
             return metadata
-        elif connection.db_type == 'presto':
-            for s in schemas:
-                metadata.reflect(bind=engine, schema=s)
-            return metadata
-        else:
-            for s in schemas:
-                metadata.reflect(bind=engine, schema=s, views=True)
-            # metadata.reflect(bind=engine)
-            return metadata
+        return cls._reflect_schemas(engine, {s: None for s in schemas}, views=connection.db_type != 'presto')
+
     @classmethod
     def get_metadata_only_table_by_connection(cls, connection, schemas_table_dict):
-        db_url = cls.get_db_url(connection.db_type, connection.db_user, connection.db_pwd, connection.db_host,
-                                connection.db_port, connection.db_name)
-        if connection.db_type == "bigquery":
-            password = json.loads(connection.db_pwd)
-            engine = db.create_engine(url=connection.db_host, credentials_info=password)
-        else:
-            engine = db.create_engine(db_url)
-        # connection = engine.connect()
-        metadata = db.MetaData()
-        schemas = list(schemas_table_dict.keys())
+        engine = cls.get_engine_by_connection(connection)
         if connection.db_type == 'bigquery':
+            metadata = db.MetaData()
             metadata.reflect(bind=engine)
             return metadata
-        elif connection.db_type == 'presto':
-            for s in schemas:
-                tables = schemas_table_dict[s]
-                metadata.reflect(bind=engine, schema=s, only=tables)
-            return metadata
-        else:
-            for s in schemas:
-                tables = schemas_table_dict[s]
-                metadata.reflect(bind=engine, schema=s, views=True, only=tables)
-            # metadata.reflect(bind=engine)
-            return metadata
+        return cls._reflect_schemas(engine, schemas_table_dict, views=connection.db_type != 'presto')
 
     @classmethod
-    def get_metadata_by_table(cls, connection, tables):
-        db_url = cls.get_db_url(connection.db_type, connection.db_user, connection.db_pwd, connection.db_host,
-                                connection.db_port, connection.db_name)
-        if connection.db_type == "bigquery":
-            password = json.loads(connection.db_pwd)
-            engine = db.create_engine(url=connection.db_host, credentials_info=password)
-        else:
-            engine = db.create_engine(db_url)
-            logger.info(db_url)
+    def _reflect_schemas(cls, engine, schemas_table_dict, views):
+        """
+        Reflect the schemas in parallel, each into its own MetaData, and merge them into one
+        """
+        def reflect_schema(schema):
+            schema_metadata = db.MetaData()
+            schema_metadata.reflect(bind=engine, schema=schema, views=views, only=schemas_table_dict[schema])
+            return schema_metadata
+
         metadata = db.MetaData()
+        for schema_metadata in cls._map_parallel(engine, reflect_schema, list(schemas_table_dict)):
+            for table in schema_metadata.tables.values():
+                if table.key not in metadata.tables:
+                    table.to_metadata(metadata)
+        return metadata
+
+    @classmethod
+    def get_metadata_by_table(cls, connection, tables):
         table_info = {}
         try:
+            schemas_table_dict = {}
             for each_table in tables:
-                table_info[each_table] = {}
-                logger.info(each_table)
                 if "." in each_table:
                     schema, table = each_table.split(".")[0], each_table.split(".")[1]
-                    table = Table(table, metadata, autoload_with=engine, schema=schema)
                 else:
-                    table = Table(each_table, metadata, autoload_with=engine)
-                logger.info(table)
-                for column in table.columns:
-                    logger.info(f"  Column Name: {column.name}, Data Type: {column.type}")
-                    table_info[each_table][column.name] = column.type
+                    schema, table = None, each_table
+                schemas_table_dict.setdefault(schema, []).append(table)
+            catalog_tables = cls.get_catalog_tables(connection, schemas_table_dict)
+            for each_table in tables:
+                table_info[each_table] = {}
+                if each_table not in catalog_tables:
+                    logger.error(f"Table {each_table} not found")
+                    continue
+                for column_name, column_type, _ in catalog_tables[each_table]['columns']:
+                    table_info[each_table][column_name] = column_type
         except Exception as e:
             logger.error(f"Error loading table column {tables}: {e}")
         return table_info
 
     @classmethod
-    def get_table_definition_by_connection(cls, connection: ConnectConfigEntity, schemas_table_dict):
-        # metadata = cls.get_metadata_by_connection(connection, schemas)
-        metadata = cls.get_metadata_only_table_by_connection(connection, schemas_table_dict)
-        table_names = []
-        for each_schema, tables in schemas_table_dict.items():
-            for each_table in tables:
-                table_names.append(each_schema + "." + each_table)
-        tables = metadata.tables
-        table_info = {}
+    def get_catalog_tables(cls, connection: ConnectConfigEntity, schemas_table_dict, refresh=False):
+        """
+        Table definitions from the schema catalog of the connection, only new or changed tables are reflected,
+        all of them with refresh
+        """
+        engine = cls.get_engine_by_connection(connection)
+        return SchemaCatalog.get_tables(
+            connection, schemas_table_dict,
+            lambda schema, tables: cls._reflect_tables(connection, engine, schema, tables),
+            lambda schema: cls._fetch_table_fingerprints(connection, engine, schema), refresh=refresh)
+
+    @classmethod
+    def _reflect_tables(cls, connection, engine, schema, tables):
+        batches = [tables[start:start + SCHEMA_REFLECTION_BATCH_SIZE]
+                   for start in range(0, len(tables), SCHEMA_REFLECTION_BATCH_SIZE)]
+        reflected_tables = [table for batch in cls._map_parallel(
+            engine, lambda batch: cls._reflect_table_batch(engine, schema, batch), batches) for table in batch]
         if connection.db_type == 'hive':
-            tables_comment = cls.get_hive_table_comment(connection, table_names)
+            tables_comment = cls.get_hive_table_comment(connection, [SchemaCatalog.table_key(schema, table)
+                                                                     for table in tables])
         else:
             tables_comment = {}
 
+        reflected = {}
+        for table in reflected_tables:
+            column_comment_value = tables_comment.get(SchemaCatalog.table_key(schema, table.name), {})
+            columns = []
+            for column in table.columns:
+                column: Column
+                # get column description
+                column_comment = column.comment
+                if column_comment is None and column.name in column_comment_value:
+                    column_comment = column_comment_value[column.name]
+                columns.append([column.name, column.type.__visit_name__, column_comment])
+            reflected[table.name] = {'comment': table.comment, 'columns': columns}
+        return reflected
+
+    @classmethod
+    def _reflect_table_batch(cls, engine, schema, tables):
+        # MetaData is not thread safe, every batch reflects into its own
+        metadata = db.MetaData()
+        reflected_tables = []
+        for table_name in tables:
+            try:
+                reflected_tables.append(Table(table_name, metadata, autoload_with=engine, schema=schema,
+                                              resolve_fks=False))
+            except Exception as e:
+                logger.error(f"Failed to reflect table {SchemaCatalog.table_key(schema, table_name)}: {e}")
+        return reflected_tables
+
+    @classmethod
+    def _fetch_table_fingerprints(cls, connection, engine, schema):
+        """
+        {table name: fingerprint of its columns} from information_schema.columns, None when the database
+        does not have it, the tables are then refreshed after SCHEMA_CATALOG_TTL.
+        The column and table comments are part of the fingerprint where information_schema has them (MySQL,
+        StarRocks), elsewhere a changed comment is picked up after SCHEMA_CATALOG_TTL or with a forced refresh.
+        """
+        if not schema or connection.db_type not in ('mysql', 'starrocks', 'postgresql', 'redshift', 'presto',
+                                                    'athena', 'sqlserver', 'clickhouse'):
+            return None
+        table_columns = {}
+        with engine.connect() as db_connection:
+            if connection.db_type in ('mysql', 'starrocks'):
+                rows = db_connection.execute(
+                    text("SELECT table_name, column_name, data_type, column_comment FROM information_schema.columns "
+                         "WHERE table_schema = :schema"), {'schema': schema})
+                for table_name, column_name, data_type, column_comment in rows:
+                    table_columns.setdefault(table_name, []).append(
+                        (column_name, str(data_type), column_comment or ''))
+                rows = db_connection.execute(
+                    text("SELECT table_name, table_comment FROM information_schema.tables "
+                         "WHERE table_schema = :schema"), {'schema': schema})
+                for table_name, table_comment in rows:
+                    if table_name in table_columns:
+                        # the table comment as a pseudo column without a name
+                        table_columns[table_name].append(('', 'table_comment', table_comment or ''))
+            else:
+                rows = db_connection.execute(
+                    text("SELECT table_name, column_name, data_type FROM information_schema.columns "
+                         "WHERE table_schema = :schema"), {'schema': schema})
+                for table_name, column_name, data_type in rows:
+                    table_columns.setdefault(table_name, []).append((column_name, str(data_type)))
+        return {table_name: fingerprint_columns(columns) for table_name, columns in table_columns.items()}
+
+    @classmethod
+    def get_table_definition_by_connection(cls, connection: ConnectConfigEntity, schemas_table_dict, refresh=False):
+        tables = cls.get_catalog_tables(connection, schemas_table_dict, refresh=refresh)
+        table_info = {}
+
         for table_name, table in tables.items():
-            # If table name is provided, only generate DDL for those tables. Otherwise, generate DDL for all tables.
-            if len(table_names) > 0 and table_name not in table_names:
-                continue
             # Start the DDL statement
-            table_comment = f'-- {table.comment}' if table.comment else ''
+            table_comment = f'-- {table["comment"]}' if table['comment'] else ''
             ddl = f"CREATE TABLE {table_name} {table_comment} \n (\n"
 
-            if table_name in tables_comment:
-                column_comment_value = tables_comment[table_name]
-            else:
-                column_comment_value = {}
-            for column in table.columns:
-                column: Column
-                # get column description
-                if column.comment is None:
-                    if column.name in column_comment_value:
-                        column.comment = column_comment_value[column.name]
-                column_comment = f'COMMENT {column.comment}' if column.comment else ''
-                ddl += f"  {column.name} {column.type.__visit_name__} {column_comment},\n"
+            for column_name, column_type, comment in table['columns']:
+                column_comment = f'COMMENT {comment}' if comment else ''
+                ddl += f"  {column_name} {column_type} {column_comment},\n"
             ddl = ddl.rstrip(',\n') + "\n)"  # Remove the last comma and close the CREATE TABLE statement
             table_info[table_name] = {}
             table_info[table_name]['ddl'] = ddl
-            table_info[table_name]['description'] = table.comment
+            table_info[table_name]['description'] = table['comment']
             logger.info(f'added table {table_name} to table_info dict')
 
         return table_info
@@ -290,24 +363,68 @@ class RelationDatabase():
 
     @classmethod
     def get_hive_table_comment(cls, connection, table_names):
-        table_name_comment = {}
+        """
+        {table: {column: comment}}, read from the metastore sys database in one query per schema (Hive 3),
+        or with parallel describe statements
+        """
+        table_name_comment = {each_table: {} for each_table in table_names}
         try:
-            db_url = cls.get_db_url(connection.db_type, connection.db_user, connection.db_pwd, connection.db_host,
-                                    connection.db_port, connection.db_name)
-            engine = db.create_engine(db_url)
+            engine = cls.get_engine_by_connection(connection)
+            schema_tables = {}
             for each_table in table_names:
-                table_name_comment[each_table] = {}
-                with engine.connect() as connection:
-                    sql = "describe " + each_table
-                    result = connection.execute(sql)
-                    for row in result:
-                        if len(row) == 3:
-                            table_name_comment[each_table][row[0]] = "'" + row[2] + "'"
+                if "." in each_table:
+                    schema_tables.setdefault(each_table.split(".")[0], []).append(each_table)
+            described_tables = [each_table for each_table in table_names if "." not in each_table]
+            for schema, tables in schema_tables.items():
+                schema_comments = cls._get_hive_metastore_comments(engine, schema)
+                if schema_comments is None:
+                    described_tables.extend(tables)
+                    continue
+                for each_table in tables:
+                    table_name_comment[each_table] = schema_comments.get(each_table.split(".")[1].lower(), {})
+
+            batches = [described_tables[start:start + SCHEMA_REFLECTION_BATCH_SIZE]
+                       for start in range(0, len(described_tables), SCHEMA_REFLECTION_BATCH_SIZE)]
+            for batch_comments in cls._map_parallel(engine, lambda batch: cls._describe_hive_tables(engine, batch),
+                                                    batches):
+                table_name_comment.update(batch_comments)
             return table_name_comment
         except Exception as e:
             logger.error(f"Failed to get table comment: {str(e)}")
             return table_name_comment
 
+    @classmethod
+    def _get_hive_metastore_comments(cls, engine, schema):
+        """
+        {table: {column: comment}} of the schema from the sys database, None when it is not available
+        """
+        sql = ("SELECT t.tbl_name, c.column_name, c.comment FROM sys.tbls t "
+               "JOIN sys.dbs d ON t.db_id = d.db_id JOIN sys.sds s ON t.sd_id = s.sd_id "
+               "JOIN sys.columns_v2 c ON s.cd_id = c.cd_id WHERE d.name = :schema")
+        try:
+            with engine.connect() as db_connection:
+                rows = db_connection.execute(text(sql), {'schema': schema.lower()}).fetchall()
+        except Exception as e:
+            logger.info(f"Hive metastore sys database not available, describing the tables: {e}")
+            return None
+        schema_comments = {}
+        for table_name, column_name, comment in rows:
+            if comment:
+                schema_comments.setdefault(table_name.lower(), {})[column_name] = "'" + comment + "'"
+        return schema_comments
+
+    @classmethod
+    def _describe_hive_tables(cls, engine, tables):
+        table_name_comment = {}
+        with engine.connect() as db_connection:
+            for each_table in tables:
+                table_name_comment[each_table] = {}
+                result = db_connection.execute(text("describe " + each_table))
+                for row in result:
+                    if len(row) == 3 and row[2]:
+                        table_name_comment[each_table][row[0]] = "'" + row[2] + "'"
+        return table_name_comment
+
     @classmethod
     def get_db_url_by_connection(cls, connection: ConnectConfigEntity):
         db_url = cls.get_db_url(connection.db_type, connection.db_user, connection.db_pwd, connection.db_host,
@@ -6,6 +6,7 @@ from botocore.exceptions import ClientError
 from dotenv import load_dotenv
 import json
 
+from utils.cache import TTLCache
 from utils.logging import getLogger
 
 load_dotenv()
@@ -15,6 +16,8 @@ logger = getLogger()
 # DynamoDB 表名
 CONNECT_CONFIG_TABLE_NAME = 'NlqConnectConfig'
 DYNAMODB_AWS_REGION = os.environ.get('DYNAMODB_AWS_REGION')
+# Secrets Manager 中数据库凭证的缓存时间（秒）, 密码轮换后认证失败时会立即重新获取
+SECRET_CACHE_TTL = int(os.environ.get('SECRET_CACHE_TTL', '3600'))
 
 
 class ConnectConfigEntity:
@@ -54,6 +57,8 @@ class ConnectConfigEntity:
 
 
 class ConnectConfigDao:
+    secret_cache = TTLCache('connection_secret', ttl=SECRET_CACHE_TTL)
+
     def __init__(self, table_name_prefix=''):
         self.dynamodb = boto3.resource('dynamodb', region_name=DYNAMODB_AWS_REGION)
         self.secrets_manager = boto3.client('secretsmanager', region_name=DYNAMODB_AWS_REGION)
@@ -137,10 +142,8 @@ class ConnectConfigDao:
             # 先判断 db_sm 是否存在
             if db_sm:
                 # 如果 db_sm 存在,则从 Secrets Manager 中获取 db_host、db_port、db_user、db_pwd
-                secrets_manager_name = db_sm
-                secrets_response = self.secrets_manager.get_secret_value(SecretId=secrets_manager_name)
-                if 'SecretString' in secrets_response:
-                    secrets = json.loads(secrets_response['SecretString'])
+                secrets = self.get_secret(db_sm)
+                if secrets is not None:
                     db_host = secrets['db_host']
                     db_port = secrets['db_port']
                     db_user = secrets['db_user']
@@ -166,6 +169,20 @@ class ConnectConfigDao:
                 comment=item.get('comment', '')
             )
 
+    def get_secret(self, secrets_manager_name):
+        """Get the connection secrets, cached for SECRET_CACHE_TTL seconds"""
+        return self.secret_cache.get_or_load(secrets_manager_name,
+                                             lambda: self._load_secret(secrets_manager_name))
+
+    def _load_secret(self, secrets_manager_name):
+        secrets_response = self.secrets_manager.get_secret_value(SecretId=secrets_manager_name)
+        if 'SecretString' in secrets_response:
+            return json.loads(secrets_response['SecretString'])
+        return None
+
+    def invalidate_secret(self, secrets_manager_name):
+        self.secret_cache.invalidate(secrets_manager_name)
+
     def add(self, entity):
         # 检查 conn_name 是否已存在
         existing_entity = self.get_by_name(entity.conn_name)
@@ -216,6 +233,7 @@ class ConnectConfigDao:
                 logger.error(f"Secrets Manager key not found: {secrets_manager_name}")
                 logger.error(f"Error details: {str(e)}")
                 raise Exception(f"Failed to update Secrets Manager key: {secrets_manager_name}")
+            self.invalidate_secret(secrets_manager_name)
             # 创建一个新的字典,只包含需要保存到 DynamoDB 的字段
             dynamodb_item = {
                 'conn_name': entity.conn_name,
@@ -250,6 +268,7 @@ class ConnectConfigDao:
         if entity.db_sm:
             # 删除 Secrets Manager 中的数据
             self.secrets_manager.delete_secret(SecretId=entity.db_sm)
+            self.invalidate_secret(entity.db_sm)
         # 删除 DynamoDB 中的数据
         self.table.delete_item(Key={'conn_name': conn_name})
         return True
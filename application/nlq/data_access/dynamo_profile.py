@@ -29,6 +29,8 @@ class ProfileConfigEntity:
         self.enable_row_level_security = kwargs.get('enable_row_level_security', False)
         self.row_level_security_config = kwargs.get('row_level_security_config', None)
         self.prompt_environment = kwargs.get('prompt_environment', defaultdict(str))
+        # 样本（SQL、实体）每次变更加一, 用于跨容器失效语义缓存
+        self.samples_version = int(kwargs.get('samples_version', 0))
 
     def to_dict(self):
         """Convert to DynamoDB item format"""
@@ -42,7 +44,8 @@ class ProfileConfigEntity:
             'db_type': self.db_type,
             'enable_row_level_security':  self.enable_row_level_security,
             'row_level_security_config': self.row_level_security_config,
-            'prompt_environment': self.prompt_environment
+            'prompt_environment': self.prompt_environment,
+            'samples_version': self.samples_version
         }
         if self.tables_info:
             base_props['tables_info'] = self.tables_info
@@ -189,4 +192,25 @@ class ProfileConfigDao:
             )
             raise
         else:
-            return response["Attributes"]
\ No newline at end of file
+            return response["Attributes"]
+
+    def increment_samples_version(self, profile_name):
+        try:
+            response = self.table.update_item(
+                Key={"profile_name": profile_name},
+                UpdateExpression="add samples_version :one",
+                ConditionExpression="attribute_exists(profile_name)",
+                ExpressionAttributeValues={":one": 1},
+                ReturnValues="UPDATED_NEW",
+            )
+        except ClientError as err:
+            logger.error(
+                "Couldn't update profile %s in table %s. Here's why: %s: %s",
+                profile_name,
+                self.table.name,
+                err.response["Error"]["Code"],
+                err.response["Error"]["Message"],
+            )
+            raise
+        else:
+            return response["Attributes"]
@@ -0,0 +1,222 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import sqlalchemy as db
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+from utils.logging import getLogger
+
+logger = getLogger()
+
+# 连接池默认参数，可以通过环境变量覆盖
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', '30'))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+# 空闲超过该时间（秒）且没有被借出连接的 engine 会被 dispose
+DB_ENGINE_IDLE_TIMEOUT = int(os.getenv('DB_ENGINE_IDLE_TIMEOUT', '900'))
+DB_ENGINE_EVICT_INTERVAL = 60
+
+# Per-dialect overrides, keyed by SQLAlchemy backend name.
+# Athena / BigQuery / MaxCompute are HTTP based, a pre-ping would issue a real (billed) query.
+DIALECT_POOL_CONFIG = {
+    'mysql': {'pool_recycle': 3600},
+    'starrocks': {'pool_recycle': 3600},
+    'redshift': {'pool_recycle': 900},
+    'hive': {'pool_size': 2, 'max_overflow': 4},
+    'awsathena': {'pool_pre_ping': False},
+    'bigquery': {'pool_pre_ping': False},
+    'odps': {'pool_pre_ping': False},
+}
+# e.g. DB_POOL_DIALECT_CONFIG='{"mysql": {"pool_size": 20}}'
+DIALECT_POOL_CONFIG_OVERRIDE = json.loads(os.getenv('DB_POOL_DIALECT_CONFIG', '{}'))
+
+# error messages of rejected logins, e.g. after the password in Secrets Manager was rotated
+_AUTH_ERROR_PATTERNS = (
+    'access denied for user',
+    'password authentication failed',
+    'authentication failed',
+    'login failed for user',
+    'invalid username/password',
+    'invalid credentials',
+    'invalid_grant',
+)
+
+
+def is_authentication_error(error):
+    """
+    Whether the database rejected the credentials of the connection
+    """
+    message = str(error).lower()
+    return any(pattern in message for pattern in _AUTH_ERROR_PATTERNS)
+
+
+class _EngineEntry:
+
+    def __init__(self, engine, display_name):
+        self.engine = engine
+        self.display_name = display_name
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.checkouts = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def record_checkout(self, wait_time):
+        self.checkouts += 1
+        self.total_wait_time += wait_time
+        self.max_wait_time = max(self.max_wait_time, wait_time)
+
+    def checked_out(self):
+        pool = self.engine.pool
+        return pool.checkedout() if isinstance(pool, QueuePool) else 0
+
+    def stats(self):
+        pool = self.engine.pool
+        is_queue_pool = isinstance(pool, QueuePool)
+        return {
+            'engine': self.display_name,
+            'pool_class': type(pool).__name__,
+            'pool_size': pool.size() if is_queue_pool else None,
+            'checked_out': self.checked_out(),
+            'overflow': pool.overflow() if is_queue_pool else None,
+            'checkouts': self.checkouts,
+            'avg_wait_ms': round(self.total_wait_time * 1000 / self.checkouts, 2) if self.checkouts else 0.0,
+            'max_wait_ms': round(self.max_wait_time * 1000, 2),
+            'idle_seconds': round(time.time() - self.last_used, 1),
+        }
+
+
+class EngineRegistry:
+    """
+    Process wide registry of pooled SQLAlchemy engines, keyed by the db url (or BigQuery credentials),
+    so that connections are reused across requests instead of opening a new engine per query.
+    """
+    _engines = {}
+    _lock = threading.Lock()
+    _last_eviction = time.time()
+
+    @classmethod
+    def _url_to_string(cls, db_url):
+        if hasattr(db_url, 'render_as_string'):
+            return db_url.render_as_string(hide_password=False)
+        return str(db_url)
+
+    @classmethod
+    def _build_key(cls, db_url, engine_kwargs):
+        raw_key = cls._url_to_string(db_url) + json.dumps(engine_kwargs, sort_keys=True, default=str)
+        return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def _get_backend_name(cls, db_url):
+        try:
+            return make_url(db_url).get_backend_name()
+        except Exception:
+            return ''
+
+    @classmethod
+    def _display_name(cls, db_url):
+        # never expose credentials in stats
+        try:
+            url = make_url(db_url)
+            return f"{url.get_backend_name()}://{url.host or ''}/{url.database or ''}"
+        except Exception:
+            return 'unknown'
+
+    @classmethod
+    def get_pool_config(cls, db_url):
+        backend = cls._get_backend_name(db_url)
+        pool_config = {
+            'pool_size': DB_POOL_SIZE,
+            'max_overflow': DB_MAX_OVERFLOW,
+            'pool_timeout': DB_POOL_TIMEOUT,
+            'pool_recycle': DB_POOL_RECYCLE,
+            'pool_pre_ping': DB_POOL_PRE_PING,
+        }
+        pool_config.update(DIALECT_POOL_CONFIG.get(backend, {}))
+        pool_config.update(DIALECT_POOL_CONFIG_OVERRIDE.get(backend, {}))
+        return pool_config
+
+    @classmethod
+    def _create_engine(cls, db_url, engine_kwargs):
+        pool_config = cls.get_pool_config(db_url)
+        try:
+            return db.create_engine(db_url, **pool_config, **engine_kwargs)
+        except TypeError:
+            # dialects with a non queue pool (e.g. SingletonThreadPool) reject the sizing arguments
+            logger.warning(f"Pool arguments not supported for {cls._display_name(db_url)}, use default pool")
+            return db.create_engine(db_url, pool_pre_ping=pool_config['pool_pre_ping'], **engine_kwargs)
+
+    @classmethod
+    def _get_entry(cls, db_url, engine_kwargs):
+        key = cls._build_key(db_url, engine_kwargs)
+        with cls._lock:
+            entry = cls._engines.get(key)
+            if entry is None:
+                engine = cls._create_engine(db_url, engine_kwargs)
+                entry = _EngineEntry(engine, cls._display_name(db_url))
+                cls._engines[key] = entry
+                logger.info(f"Created pooled engine for {entry.display_name}")
+            entry.last_used = time.time()
+        cls.evict_idle()
+        return entry
+
+    @classmethod
+    def get_engine(cls, db_url, **engine_kwargs):
+        """
+        Get or create the pooled engine for the db url.
+        :param db_url: str or sqlalchemy URL
+        :param engine_kwargs: extra create_engine arguments, e.g. BigQuery credentials_info
+        """
+        return cls._get_entry(db_url, engine_kwargs).engine
+
+    @classmethod
+    @contextmanager
+    def connect(cls, db_url, **engine_kwargs):
+        """
+        Borrow a connection from the pooled engine, recording the checkout wait time.
+        """
+        entry = cls._get_entry(db_url, engine_kwargs)
+        start = time.time()
+        connection = entry.engine.connect()
+        entry.record_checkout(time.time() - start)
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    @classmethod
+    def dispose(cls, db_url, **engine_kwargs):
+        key = cls._build_key(db_url, engine_kwargs)
+        with cls._lock:
+            entry = cls._engines.pop(key, None)
+        if entry is not None:
+            entry.engine.dispose()
+            logger.info(f"Disposed pooled engine for {entry.display_name}")
+
+    @classmethod
+    def evict_idle(cls, force=False):
+        now = time.time()
+        if not force and now - cls._last_eviction < DB_ENGINE_EVICT_INTERVAL:
+            return
+        cls._last_eviction = now
+        evicted = []
+        with cls._lock:
+            for key, entry in list(cls._engines.items()):
+                if now - entry.last_used > DB_ENGINE_IDLE_TIMEOUT and entry.checked_out() == 0:
+                    evicted.append(cls._engines.pop(key))
+        for entry in evicted:
+            entry.engine.dispose()
+            logger.info(f"Evicted idle engine for {entry.display_name}")
+
+    @classmethod
+    def get_stats(cls):
+        with cls._lock:
+            entries = list(cls._engines.values())
+        return [entry.stats() for entry in entries]
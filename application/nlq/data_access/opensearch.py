@@ -1,8 +1,8 @@
 
-from opensearchpy import OpenSearch
-from opensearchpy.helpers import bulk
+from opensearchpy.helpers import bulk, parallel_bulk
 from utils.llm import create_vector_embedding
 from utils.logging import getLogger
+from utils.opensearch import get_opensearch_client
 
 logger = getLogger()
 
@@ -14,18 +14,8 @@ def put_bulk_in_opensearch(list, client):
 class OpenSearchDao:
 
     def __init__(self, host, port, opensearch_user, opensearch_password):
-        auth = (opensearch_user, opensearch_password)
-
-        # Create the client with SSL/TLS enabled, but hostname verification disabled.
-        self.opensearch_client = OpenSearch(
-            hosts=[{'host': host, 'port': port}],
-            http_compress=True,  # enables gzip compression for request bodies
-            http_auth=auth,
-            use_ssl=True,
-            verify_certs=False,
-            ssl_assert_hostname=False,
-            ssl_show_warn=False
-        )
+        # share the process wide keep-alive client instead of opening a new connection pool
+        self.opensearch_client = get_opensearch_client(host, port, opensearch_user, opensearch_password)
 
     def retrieve_samples(self, index_name, profile_name):
         # search all docs in the index filtered by profile_name
@@ -149,8 +139,8 @@ class OpenSearchDao:
 
         return response['hits']['hits']
 
-    def add_sample(self, index_name, profile_name, question, answer, embedding):
-        record = {
+    def build_sample_record(self, index_name, profile_name, question, answer, embedding):
+        return {
             '_index': index_name,
             'text': question,
             'sql': answer,
@@ -158,10 +148,13 @@ class OpenSearchDao:
             'vector_field': embedding
         }
 
+    def add_sample(self, index_name, profile_name, question, answer, embedding):
+        record = self.build_sample_record(index_name, profile_name, question, answer, embedding)
         success, failed = put_bulk_in_opensearch([record], self.opensearch_client)
         return success == 1
 
-    def add_entity_sample(self, index_name, profile_name, entity, comment, embedding, entity_type="", entity_table_info=[]):
+    def build_entity_record(self, index_name, profile_name, entity, comment, embedding, entity_type="",
+                            entity_table_info=[]):
         entity_count = len(entity_table_info)
         comment_value = []
         item_comment_format = "{entity} is located in table {table_name}, column {column_name},  the dimension value is {value}."
@@ -186,12 +179,16 @@ class OpenSearchDao:
             'entity_count': entity_count,
             'entity_table_info': entity_table_info
         }
+        return record
 
+    def add_entity_sample(self, index_name, profile_name, entity, comment, embedding, entity_type="", entity_table_info=[]):
+        record = self.build_entity_record(index_name, profile_name, entity, comment, embedding, entity_type,
+                                          entity_table_info)
         success, failed = put_bulk_in_opensearch([record], self.opensearch_client)
         return success == 1
 
-    def add_agent_cot_sample(self, index_name, profile_name, query, comment, embedding):
-        record = {
+    def build_agent_cot_record(self, index_name, profile_name, query, comment, embedding):
+        return {
             '_index': index_name,
             'query': query,
             'comment': comment,
@@ -199,9 +196,38 @@ class OpenSearchDao:
             'vector_field': embedding
         }
 
+    def add_agent_cot_sample(self, index_name, profile_name, query, comment, embedding):
+        record = self.build_agent_cot_record(index_name, profile_name, query, comment, embedding)
         success, failed = put_bulk_in_opensearch([record], self.opensearch_client)
         return success == 1
 
+    def parallel_bulk_write(self, actions, chunk_size=500, thread_count=4):
+        """
+        Write index / delete actions with parallel_bulk, without failing the whole load on a bad document
+        :return: success count, list of (action, error) for the failed documents
+        """
+        success = 0
+        failures = []
+        results = parallel_bulk(self.opensearch_client, actions, chunk_size=chunk_size, thread_count=thread_count,
+                                raise_on_error=False, raise_on_exception=False)
+        for ok, item in results:
+            if ok:
+                success += 1
+            else:
+                failures.append(item)
+        return success, failures
+
+    def get_refresh_interval(self, index_name):
+        settings = self.opensearch_client.indices.get_settings(index=index_name, name='index.refresh_interval')
+        return settings.get(index_name, {}).get('settings', {}).get('index', {}).get('refresh_interval')
+
+    def set_refresh_interval(self, index_name, refresh_interval):
+        self.opensearch_client.indices.put_settings(index=index_name,
+                                                    body={'index': {'refresh_interval': refresh_interval}})
+
+    def refresh_index(self, index_name):
+        self.opensearch_client.indices.refresh(index=index_name)
+
     def delete_sample(self, index_name, profile_name, doc_id):
         return self.opensearch_client.delete(index=index_name, id=doc_id)
 
@@ -243,3 +269,37 @@ class OpenSearchDao:
         )
 
         return response['hits']['hits']
+
+    def search_samples_with_embeddings(self, profile_name, top_k, index_name, query_embeddings):
+        """
+        Run one kNN query per embedding in a single msearch round trip, results keep the input order
+        """
+        if len(query_embeddings) == 0:
+            return []
+        body = []
+        for query_embedding in query_embeddings:
+            body.append({'index': index_name})
+            body.append({
+                "size": top_k,
+                "query": {
+                    "bool": {
+                        "filter": {
+                            "match_phrase": {
+                                "profile": profile_name
+                            }
+                        },
+                        "must": [
+                            {
+                                "knn": {
+                                    "vector_field": {
+                                        "vector": query_embedding,
+                                        "k": top_k
+                                    }
+                                }
+                            }
+                        ]
+                    }
+                }
+            })
+        response = self.opensearch_client.msearch(body=body)
+        return [item.get('hits', {}).get('hits', []) for item in response['responses']]
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from utils.cache import SqliteCacheStore
+from utils.logging import getLogger
+
+logger = getLogger()
+
+# 为空时只使用内存缓存
+SCHEMA_CATALOG_PATH = os.getenv('SCHEMA_CATALOG_PATH', '/tmp/genbi/schema_catalog.sqlite3')
+# 表结构最长缓存时间（秒）, 无法通过 information_schema 检测变化的数据库（hive, bigquery 等）依赖这个时间刷新
+SCHEMA_CATALOG_TTL = int(os.getenv('SCHEMA_CATALOG_TTL', '86400'))
+# schema 和表名列表的缓存时间（秒）
+SCHEMA_CATALOG_LISTING_TTL = int(os.getenv('SCHEMA_CATALOG_LISTING_TTL', '300'))
+
+
+def fingerprint_columns(columns):
+    """
+    Hash of the (column name, data type[, column comment]) tuples of one table, as read from
+    information_schema.columns
+    """
+    raw = '\x1f'.join('\x1e'.join(str(value) for value in column) for column in sorted(columns))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:16]
+
+
+class SchemaCatalog:
+    """
+    Persistent per connection catalog of the reflected tables: comment and (name, type, comment) of the columns,
+    stored as compact JSON in a local SQLite store.
+
+    A table is reflected again only when it is not in the catalog, when the fingerprint of its columns
+    in information_schema changed, or when its entry is older than SCHEMA_CATALOG_TTL.
+    The reflection and the fingerprint queries are given by the caller, see RelationDatabase.
+    """
+    _catalogs = {}
+    _lock = threading.Lock()
+    _disk_store = None
+    reflected_tables = 0
+    reused_tables = 0
+
+    @classmethod
+    def _get_disk_store(cls):
+        if not SCHEMA_CATALOG_PATH:
+            return None
+        if cls._disk_store is None:
+            with cls._lock:
+                if cls._disk_store is None:
+                    cls._disk_store = SqliteCacheStore(SCHEMA_CATALOG_PATH, table='schema_catalog')
+        return cls._disk_store
+
+    @classmethod
+    def build_key(cls, connection):
+        # the password is left out, a changed password still points to the same database
+        raw_key = '\x1f'.join(str(getattr(connection, attribute, '') or '') for attribute in
+                              ('db_type', 'db_host', 'db_port', 'db_name', 'db_user'))
+        return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def _load(cls, key):
+        with cls._lock:
+            catalog = cls._catalogs.get(key)
+        if catalog is not None:
+            return catalog
+        catalog = {'schemas': {}, 'tables': {}}
+        disk_store = cls._get_disk_store()
+        value = disk_store.get(key) if disk_store is not None else None
+        if value is not None:
+            try:
+                catalog = json.loads(value)
+            except Exception as e:
+                logger.error(f"Failed to read the schema catalog: {e}")
+        with cls._lock:
+            return cls._catalogs.setdefault(key, catalog)
+
+    @classmethod
+    def _save(cls, key, catalog):
+        disk_store = cls._get_disk_store()
+        if disk_store is not None:
+            # other threads add tables to the same catalog, write a consistent snapshot and
+            # never let an older snapshot overwrite a newer one
+            with cls._lock:
+                disk_store.put(key, json.dumps(catalog, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+
+    @classmethod
+    def get_schema_tables(cls, connection, list_schema_tables, refresh=False):
+        """
+        {schema: [table names]} of the connection, list_schema_tables() is only called when the cached listing
+        is older than SCHEMA_CATALOG_LISTING_TTL
+        """
+        key = cls.build_key(connection)
+        catalog = cls._load(key)
+        listing = catalog.get('listing')
+        if not refresh and listing and time.time() - listing['listed_at'] < SCHEMA_CATALOG_LISTING_TTL:
+            return {schema: list(tables) for schema, tables in listing['schemas'].items()}
+        schema_tables = list_schema_tables()
+        with cls._lock:
+            catalog['listing'] = {'listed_at': time.time(), 'schemas': schema_tables}
+        cls._save(key, catalog)
+        return schema_tables
+
+    @classmethod
+    def get_tables(cls, connection, schemas_table_dict, reflect_tables, fetch_fingerprints=None, refresh=False):
+        """
+        Return {"schema.table": {'comment': ..., 'columns': [[name, type, comment], ...]}} for the requested tables.
+
+        :param schemas_table_dict: {schema: [table names]}, schema None for the default schema
+        :param reflect_tables: reflect_tables(schema, table names) -> {table name: entry}
+        :param fetch_fingerprints: fetch_fingerprints(schema) -> {table name: fingerprint}, None when the
+            database can not tell which tables changed
+        :param refresh: reflect all the requested tables again, for changes the fingerprint can not see
+        """
+        key = cls.build_key(connection)
+        catalog = cls._load(key)
+        tables = catalog['tables']
+        now = time.time()
+        changed = False
+        result = {}
+        for schema, table_names in schemas_table_dict.items():
+            fingerprints = None
+            if fetch_fingerprints is not None:
+                try:
+                    fingerprints = fetch_fingerprints(schema)
+                except Exception as e:
+                    logger.warning(f"Failed to read the table fingerprints of schema {schema}: {e}")
+            stale_tables = []
+            for table_name in table_names:
+                entry = tables.get(cls.table_key(schema, table_name))
+                if refresh or entry is None or now - entry.get('reflected_at', 0) > SCHEMA_CATALOG_TTL or \
+                        (fingerprints is not None and fingerprints.get(table_name) != entry.get('fingerprint')):
+                    stale_tables.append(table_name)
+            if stale_tables:
+                logger.info(f"Reflecting {len(stale_tables)} of {len(table_names)} tables of schema {schema}")
+                reflected = reflect_tables(schema, stale_tables)
+                with cls._lock:
+                    for table_name, entry in reflected.items():
+                        entry['reflected_at'] = now
+                        entry['fingerprint'] = fingerprints.get(table_name) if fingerprints is not None else None
+                        tables[cls.table_key(schema, table_name)] = entry
+                changed = changed or len(reflected) > 0
+            cls.reflected_tables += len(stale_tables)
+            cls.reused_tables += len(table_names) - len(stale_tables)
+            for table_name in table_names:
+                table_key = cls.table_key(schema, table_name)
+                if table_key in tables:
+                    result[table_key] = tables[table_key]
+        if changed:
+            cls._save(key, catalog)
+        return result
+
+    @staticmethod
+    def table_key(schema, table_name):
+        return f'{schema}.{table_name}' if schema else table_name
+
+    @classmethod
+    def invalidate(cls):
+        with cls._lock:
+            cls._catalogs.clear()
+        disk_store = cls._get_disk_store()
+        if disk_store is not None:
+            disk_store.clear()
+
+    @classmethod
+    def get_stats(cls):
+        with cls._lock:
+            table_count = sum(len(catalog['tables']) for catalog in cls._catalogs.values())
+            return {
+                'connections': len(cls._catalogs),
+                'tables': table_count,
+                'reflected_tables': cls.reflected_tables,
+                'reused_tables': cls.reused_tables,
+            }
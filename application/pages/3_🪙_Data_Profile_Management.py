@@ -224,7 +224,9 @@ def main():
                     selected_tables_info[each_schema] = []
                 selected_tables_info[each_schema].append(each_table)
             with st.spinner(get_text('fetching', lang)):
-                table_definitions = ConnectionManagement.get_table_definition_by_config(conn_config, selected_tables_info)
+                # 手动获取表定义时重新读取所有表, 不使用 schema catalog 中的缓存
+                table_definitions = ConnectionManagement.get_table_definition_by_config(conn_config, selected_tables_info,
+                                                                                        refresh=True)
                 st.write(table_definitions)
                 ProfileManagement.update_table_def(profile_name, table_definitions, merge_before_update=True)
                 st.session_state.profile_page_mode = 'default'
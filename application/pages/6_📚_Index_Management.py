@@ -7,6 +7,7 @@ import streamlit as st
 from dotenv import load_dotenv
 from nlq.business.profile import ProfileManagement
 from nlq.business.vector_store import VectorStore
+from nlq.business.sample_ingestion import SampleIngestionPipeline, SQL_SAMPLE
 from utils.logging import getLogger
 from utils.navigation import make_sidebar
 from utils.env_var import opensearch_info
@@ -408,16 +409,18 @@ def main():
                         status_text.text(get_text("processing_file", language).format(i + 1, len(uploaded_files), uploaded_file.name))
                         each_upload_data = read_file(uploaded_file)
                         if each_upload_data is not None:
-                            total_rows = len(each_upload_data)
                             progress_bar = st.progress(0)
                             progress_text = get_text("batch_insert_progress", language).format(uploaded_file.name)
-                            for j, item in enumerate(each_upload_data.itertuples(), 1):
-                                question = str(item.question)
-                                sql = str(item.sql)
-                                VectorStore.add_sample(current_profile, question, sql)
-                                progress = (j * 1.0) / total_rows
-                                progress_bar.progress(progress, text=progress_text)
+                            ingestion_pipeline = SampleIngestionPipeline(
+                                current_profile, SQL_SAMPLE,
+                                progress_callback=lambda done, total: progress_bar.progress(done / total,
+                                                                                            text=progress_text))
+                            ingestion_result = ingestion_pipeline.run(each_upload_data)
                             progress_bar.empty()
+                            if ingestion_result['failed'] > 0:
+                                st.warning(get_text("upload_failed_documents", language).format(
+                                    ingestion_result['failed'], ingestion_result['total'],
+                                    ingestion_result['failures'][:10]))
                         st.success(get_text("uploaded_successfully", language).format(uploaded_file.name))
                         with st.spinner(get_text("updating_index", language)):
                             time.sleep(2)
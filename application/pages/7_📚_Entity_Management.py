@@ -8,6 +8,7 @@ from dotenv import load_dotenv
 from nlq.business.profile import ProfileManagement
 from nlq.business.connection import ConnectionManagement
 from nlq.business.vector_store import VectorStore
+from nlq.business.sample_ingestion import SampleIngestionPipeline, ENTITY_SAMPLE, DIMENSION_SAMPLE
 from utils.logging import getLogger
 from utils.navigation import make_sidebar
 from utils.env_var import opensearch_info
@@ -95,20 +96,22 @@ def edit_value(profile, entity_item, entity_id):
 def batch_insert_dimension_entity(profile, table, column, entity_data):
     lang = st.session_state.get('language', 'en')
     if len(entity_data) > 0:
-        entity_value = entity_data[column].tolist()
+        entity_value = [str(each_entity) for each_entity in entity_data[column].tolist()]
+        entity_value = [each_entity for each_entity in entity_value if len(each_entity) > 0]
         progress_text = get_text("batch_insert_progress", lang).format("0")
         batch_bar = st.progress(0, text=progress_text)
 
-        total_num = len(entity_value)
-        for i, each_entity in enumerate(entity_value):
-            if len(each_entity) > 0 and len(table) > 0 and len(column) > 0 and len(each_entity) > 0:
-                entity_item_table_info = {}
-                entity_item_table_info["table_name"] = table
-                entity_item_table_info["column_name"] = column
-                entity_item_table_info["value"] = each_entity
-                VectorStore.add_entity_dimension_batch_sample(profile, each_entity, "", DIMENSION_VALUE,
-                                                              [entity_item_table_info])
-            batch_bar.progress((i + 1) / total_num, text=get_text("batch_insert_progress", lang).format(str(i + 1)))
+        if len(entity_value) > 0 and len(table) > 0 and len(column) > 0:
+            dimension_data = pd.DataFrame({'entity': entity_value, 'table': table, 'column': column,
+                                           'value': entity_value})
+            ingestion_pipeline = SampleIngestionPipeline(
+                profile, DIMENSION_SAMPLE,
+                progress_callback=lambda done, total: batch_bar.progress(
+                    done / total, text=get_text("batch_insert_progress", lang).format(str(done))))
+            ingestion_result = ingestion_pipeline.run(dimension_data)
+            if ingestion_result['failed'] > 0:
+                st.warning(get_text("upload_failed_documents", lang).format(
+                    ingestion_result['failed'], ingestion_result['total'], ingestion_result['failures'][:10]))
         batch_bar.empty()
     with st.spinner(get_text("update_index", lang) + ' ...'):
         time.sleep(2)
@@ -307,23 +310,17 @@ def main():
                         status_text.text(get_text("processing_file", lang).format(i + 1, len(uploaded_files), uploaded_file.name))
                         each_upload_data = read_file(uploaded_file)
                         if each_upload_data is not None:
-                            total_rows = len(each_upload_data)
-                            unique_batch_data = {}
-                            for j, item in enumerate(each_upload_data.itertuples(), 1):
-                                entity = str(item.entity)
-                                comment = str(item.comment)
-                                if entity not in unique_batch_data:
-                                    unique_batch_data[entity] = ""
-                                unique_batch_data[entity] = comment
-
                             progress_bar = st.progress(0)
-                            unique_total_row = len(unique_batch_data)
-                            for k, (key, value) in enumerate(unique_batch_data.items(), 1):
-                                VectorStore.add_entity_sample(current_profile, key, value)
-                                progress = (k * 1.0) / unique_total_row
-                                upload_text = get_text("batch_insert_progress", lang).format(str(k))
-                                progress_bar.progress(progress, text=upload_text)
+                            ingestion_pipeline = SampleIngestionPipeline(
+                                current_profile, ENTITY_SAMPLE,
+                                progress_callback=lambda done, total: progress_bar.progress(
+                                    done / total, text=get_text("batch_insert_progress", lang).format(str(done))))
+                            ingestion_result = ingestion_pipeline.run(each_upload_data)
                             progress_bar.empty()
+                            if ingestion_result['failed'] > 0:
+                                st.warning(get_text("upload_failed_documents", lang).format(
+                                    ingestion_result['failed'], ingestion_result['total'],
+                                    ingestion_result['failures'][:10]))
                         st.session_state.ner_refresh_view = True
                         st.success(get_text("uploaded_successfully", lang).format(uploaded_file.name))
                     with st.spinner(get_text("update_index", lang) + ' ...'):
@@ -362,7 +359,8 @@ def main():
                         if column_select is not None:
                             download_sql = """select DISTINCT({column}) from {table}""".format(column=column_select, table=table_select)
 
-                            download_data = get_sql_result_tool(profile_detail, download_sql)
+                            # 导出全部维度值, 不受 SQL_RESULT_MAX_ROWS 限制
+                            download_data = get_sql_result_tool(profile_detail, download_sql, capped=False)
                             download_data = download_data["data"]
                             if isinstance(download_data, list):
                                 download_data = pd.DataFrame()
@@ -395,40 +393,17 @@ def main():
                             status_text.text(get_text("processing_file", lang).format(i + 1, len(uploaded_files), uploaded_file.name))
                             each_upload_data = read_file(uploaded_file)
                             if each_upload_data is not None:
-                                total_rows = len(each_upload_data)
-                                unique_batch_data = {}
-                                for j, item in enumerate(each_upload_data.itertuples(), 1):
-                                    entity = str(item.entity)
-                                    table = str(item.table)
-                                    column = str(item.column)
-                                    value = str(item.value)
-                                    entity_item_table_info = {}
-                                    entity_item_table_info["table_name"] = table
-                                    entity_item_table_info["column_name"] = column
-                                    entity_item_table_info["value"] = value
-                                    value_id = table + "#" + column + "#" + value
-                                    if entity in unique_batch_data:
-                                        if value_id not in unique_batch_data[entity]["value_id"]:
-                                            unique_batch_data[entity]["value_id"].append(value_id)
-                                            unique_batch_data[entity]["value_list"].append(entity_item_table_info)
-                                    else:
-                                        unique_batch_data[entity] = {}
-                                        unique_batch_data[entity]["value_id"] = []
-                                        unique_batch_data[entity]["value_id"].append(value_id)
-                                        unique_batch_data[entity]["value_list"] = []
-                                        unique_batch_data[entity]["value_list"].append(entity_item_table_info)
-
                                 progress_bar = st.progress(0)
-                                unique_total_row = len(unique_batch_data)
-                                for k, (key, value) in enumerate(unique_batch_data.items(), 1):
-                                    VectorStore.add_entity_dimension_batch_sample(current_profile, key, "",
-                                                                                  DIMENSION_VALUE,
-                                                                                  value["value_list"])
-                                    progress = (k * 1.0) / unique_total_row
-                                    upload_text = get_text("batch_insert_progress", lang).format(str(k))
-                                    progress_bar.progress(progress, text=upload_text)
-
+                                ingestion_pipeline = SampleIngestionPipeline(
+                                    current_profile, DIMENSION_SAMPLE,
+                                    progress_callback=lambda done, total: progress_bar.progress(
+                                        done / total, text=get_text("batch_insert_progress", lang).format(str(done))))
+                                ingestion_result = ingestion_pipeline.run(each_upload_data)
                                 progress_bar.empty()
+                                if ingestion_result['failed'] > 0:
+                                    st.warning(get_text("upload_failed_documents", lang).format(
+                                        ingestion_result['failed'], ingestion_result['total'],
+                                        ingestion_result['failures'][:10]))
                             st.session_state.ner_refresh_view = True
                             st.success(get_text("uploaded_successfully", lang).format(uploaded_file.name))
                         with st.spinner(get_text("update_index", lang) + ' ...'):
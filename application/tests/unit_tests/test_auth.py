@@ -0,0 +1,105 @@
+import json
+import os
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+from utils import auth
+
+
+def build_signing_key(kid):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+    jwk['kid'] = kid
+    return private_key, jwk
+
+
+def jwks_response(*jwks):
+    response = MagicMock()
+    response.json.return_value = {'keys': list(jwks)}
+    return response
+
+
+class TestJwksCache(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.private_key, cls.jwk = build_signing_key('key-1')
+
+    def setUp(self):
+        auth._jwks_public_keys = {}
+        auth._jwks_fetched_at = 0.0
+        auth._jwks_failed_at = 0.0
+        auth._verified_tokens.clear()
+        self.patchers = [patch.object(auth, 'AUDIENCE', None), patch.object(auth, 'OPTIONS', None)]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        auth._verified_tokens.clear()
+
+    def build_token(self, exp_in=300):
+        return jwt.encode({'sub': 'alice', 'exp': int(time.time()) + exp_in}, self.private_key, algorithm='RS256',
+                          headers={'kid': 'key-1'})
+
+    def test_keys_are_fetched_once(self):
+        with patch.object(auth.requests, 'get', return_value=jwks_response(self.jwk)) as get:
+            auth.get_public_key('key-1')
+            auth.get_public_key('key-1')
+            # an unknown kid refreshes at most every JWKS_MIN_REFRESH_INTERVAL
+            with self.assertRaises(jwt.InvalidKeyError):
+                auth.get_public_key('key-2')
+        self.assertEqual(get.call_count, 1)
+
+    def test_failed_fetch_is_retried_after_backoff(self):
+        with patch.object(auth.requests, 'get', side_effect=ConnectionError('idp down')) as get:
+            with self.assertRaises(jwt.InvalidKeyError):
+                auth.get_public_key('key-1')
+            with self.assertRaises(jwt.InvalidKeyError):
+                auth.get_public_key('key-1')
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(auth._jwks_fetched_at, 0.0)
+
+        with patch.object(auth, 'JWKS_RETRY_INTERVAL', -1), \
+                patch.object(auth.requests, 'get', return_value=jwks_response(self.jwk)):
+            self.assertTrue(auth.get_public_key('key-1'))
+
+    def test_failed_refresh_keeps_known_keys(self):
+        with patch.object(auth.requests, 'get', return_value=jwks_response(self.jwk)):
+            public_key = auth.get_public_key('key-1')
+        auth._jwks_fetched_at -= auth.JWKS_CACHE_TTL + 1
+        with patch.object(auth.requests, 'get', side_effect=ConnectionError('idp down')) as get:
+            self.assertEqual(auth.get_public_key('key-1'), public_key)
+            self.assertEqual(auth.get_public_key('key-1'), public_key)
+        self.assertEqual(get.call_count, 1)
+
+    def test_verified_token_is_cached_until_exp(self):
+        token = self.build_token()
+        with patch.object(auth.requests, 'get', return_value=jwks_response(self.jwk)):
+            self.assertEqual(auth.jwt_decode(token)['sub'], 'alice')
+        with patch.object(auth, 'get_public_key', side_effect=AssertionError('not cached')):
+            self.assertEqual(auth.jwt_decode(token)['sub'], 'alice')
+
+        expired_token = self.build_token(exp_in=-10)
+        auth._put_verified_token(expired_token, {'sub': 'alice', 'exp': time.time() - 10})
+        self.assertIsNone(auth._get_verified_token(expired_token))
+        with patch.object(auth.requests, 'get', return_value=jwks_response(self.jwk)):
+            self.assertEqual(auth.authenticate(f'Bearer {expired_token}')['X-Status-Code'], 401)
+            self.assertEqual(auth.authenticate(f'Bearer {token}')['X-Status-Code'], 200)
+
+    def test_token_cache_size(self):
+        with patch.object(auth, 'VERIFIED_TOKEN_CACHE_SIZE', 2):
+            for i in range(3):
+                auth._put_verified_token(f'token-{i}', {'exp': time.time() + 60})
+        self.assertIsNone(auth._get_verified_token('token-0'))
+        self.assertIsNotNone(auth._get_verified_token('token-2'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from utils import cache
+from utils.cache import SqliteCacheStore, TTLCache, get_cache_stats
+
+
+class TestTTLCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = TTLCache('unit_test', ttl=60, max_size=2)
+
+    def test_get_or_load_reads_through_once(self):
+        calls = []
+        loader = lambda: calls.append(1) or 'value'
+        self.assertEqual(self.cache.get_or_load('key', loader), 'value')
+        self.assertEqual(self.cache.get_or_load('key', loader), 'value')
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_none_value_is_cached(self):
+        calls = []
+        self.cache.get_or_load('key', lambda: calls.append(1))
+        self.cache.get_or_load('key', lambda: calls.append(1))
+        self.assertEqual(len(calls), 1)
+
+    def test_per_key_ttl(self):
+        self.cache.put('short', 1, ttl=0.01)
+        self.cache.put('long', 2)
+        time.sleep(0.02)
+        self.assertIsNone(self.cache.get('short'))
+        self.assertEqual(self.cache.get('long'), 2)
+
+    def test_lru_eviction(self):
+        self.cache.put('a', 1)
+        self.cache.put('b', 2)
+        self.cache.get('a')
+        self.cache.put('c', 3)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIsNone(self.cache.get('b'))
+
+    def test_invalidate_during_load_discards_stale_value(self):
+        def loader():
+            self.cache.invalidate('key')
+            return 'stale'
+
+        self.assertEqual(self.cache.get_or_load('key', loader), 'stale')
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_invalidate_all(self):
+        self.cache.put('a', 1)
+        self.cache.put('b', 2)
+        self.cache.invalidate()
+        self.assertIsNone(self.cache.get('a'))
+        self.assertIsNone(self.cache.get('b'))
+
+    def test_stats_registry(self):
+        self.assertIn('unit_test', get_cache_stats())
+
+
+class TestSqliteCacheStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'store.sqlite3')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def count_rows(self, store):
+        return store._conn.execute(f'SELECT COUNT(*) FROM {store.table}').fetchone()[0]
+
+    def test_expired_rows_are_deleted(self):
+        store = SqliteCacheStore(self.path)
+        store.put('old', b'1', ttl=0.01)
+        store.put('kept', b'2')
+        time.sleep(0.02)
+        self.assertIsNone(store.get('old'))
+        with patch.object(cache, 'SQLITE_CACHE_PURGE_INTERVAL', 0):
+            store.put('new', b'3', ttl=60)
+        self.assertEqual(self.count_rows(store), 2)
+        self.assertEqual(store.get('kept'), b'2')
+
+    def test_max_rows_evicts_least_recently_used(self):
+        store = SqliteCacheStore(self.path, max_rows=2)
+        with patch.object(cache, 'SQLITE_CACHE_PURGE_INTERVAL', 0):
+            store.put('a', b'1')
+            time.sleep(0.01)
+            store.put('b', b'2')
+            time.sleep(0.01)
+            self.assertEqual(store.get('a'), b'1')
+            time.sleep(0.01)
+            store.put('c', b'3')
+        self.assertEqual(self.count_rows(store), 2)
+        self.assertIsNone(store.get('b'))
+        self.assertEqual(store.get('a'), b'1')
+
+    def test_store_without_accessed_at_is_migrated(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute('CREATE TABLE cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, expire_at REAL)')
+        connection.executemany('INSERT INTO cache VALUES (?, ?, NULL)', [('a', b'1'), ('b', b'2'), ('c', b'3')])
+        connection.commit()
+        connection.close()
+        store = SqliteCacheStore(self.path, max_rows=2)
+        self.assertEqual(self.count_rows(store), 2)
+        store.put('d', b'4')
+        self.assertEqual(store.get('d'), b'4')
+
+
+if __name__ == '__main__':
+    unittest.main()
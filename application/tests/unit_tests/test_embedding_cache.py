@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from utils import embedding_cache
+from utils.embedding_cache import EmbeddingCache
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path_patcher = patch.object(embedding_cache, 'EMBEDDING_CACHE_PATH',
+                                         os.path.join(self.temp_dir.name, 'embedding.sqlite3'))
+        self.path_patcher.start()
+        EmbeddingCache._disk_store = None
+        EmbeddingCache.invalidate()
+        self.vector = [0.1, 0.2, 0.3, 0.4]
+
+    def tearDown(self):
+        self.path_patcher.stop()
+        EmbeddingCache._disk_store = None
+        EmbeddingCache.invalidate()
+        self.temp_dir.cleanup()
+
+    def test_memory_hit_with_normalized_text(self):
+        EmbeddingCache.put('bedrock', 'titan', 4, 'total  sales\n', self.vector)
+        cached = EmbeddingCache.get('bedrock', 'titan', 4, ' total sales')
+        np.testing.assert_allclose(cached, self.vector, rtol=1e-6)
+        self.assertEqual(cached.dtype, np.float32)
+
+    def test_disk_hit_after_memory_invalidated(self):
+        EmbeddingCache.put('bedrock', 'titan', 4, 'total sales', self.vector)
+        EmbeddingCache.invalidate()
+        disk_hits = EmbeddingCache.disk_hits
+        cached = EmbeddingCache.get('bedrock', 'titan', 4, 'total sales')
+        np.testing.assert_allclose(cached, self.vector, rtol=1e-6)
+        self.assertEqual(EmbeddingCache.disk_hits, disk_hits + 1)
+
+    def test_model_is_part_of_key(self):
+        EmbeddingCache.put('bedrock', 'titan', 4, 'total sales', self.vector)
+        self.assertIsNone(EmbeddingCache.get('bedrock', 'cohere', 4, 'total sales'))
+
+    def test_error_vectors_are_not_cached(self):
+        EmbeddingCache.put('bedrock', 'titan', 4, 'zero', [0.0] * 4)
+        EmbeddingCache.put('bedrock', 'titan', 4, 'short', [0.1, 0.2])
+        self.assertIsNone(EmbeddingCache.get('bedrock', 'titan', 4, 'zero'))
+        self.assertIsNone(EmbeddingCache.get('bedrock', 'titan', 4, 'short'))
+
+    def test_get_many_returns_cached_indexes(self):
+        EmbeddingCache.put('bedrock', 'titan', 4, 'b', self.vector)
+        found = EmbeddingCache.get_many('bedrock', 'titan', 4, ['a', 'b', 'c', 'b'])
+        self.assertEqual(sorted(found.keys()), [1, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
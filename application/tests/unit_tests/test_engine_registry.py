@@ -0,0 +1,49 @@
+import unittest
+
+from sqlalchemy import text
+
+from nlq.data_access.engine_registry import EngineRegistry, is_authentication_error
+
+
+class TestEngineRegistry(unittest.TestCase):
+    def setUp(self):
+        self.db_url = 'sqlite://'
+
+    def tearDown(self):
+        EngineRegistry.dispose(self.db_url)
+
+    def test_engine_is_reused(self):
+        engine_a = EngineRegistry.get_engine(self.db_url)
+        engine_b = EngineRegistry.get_engine(self.db_url)
+        self.assertIs(engine_a, engine_b)
+
+    def test_engine_kwargs_are_part_of_key(self):
+        engine_a = EngineRegistry.get_engine(self.db_url)
+        engine_b = EngineRegistry.get_engine(self.db_url, echo=False)
+        self.assertIsNot(engine_a, engine_b)
+        EngineRegistry.dispose(self.db_url, echo=False)
+
+    def test_connect_records_stats(self):
+        with EngineRegistry.connect(self.db_url) as connection:
+            self.assertEqual(connection.execute(text('SELECT 1')).scalar(), 1)
+        stats = [s for s in EngineRegistry.get_stats() if s['engine'].startswith('sqlite')]
+        self.assertEqual(len(stats), 1)
+        self.assertEqual(stats[0]['checkouts'], 1)
+        self.assertEqual(stats[0]['checked_out'], 0)
+
+    def test_dispose_removes_engine(self):
+        engine_a = EngineRegistry.get_engine(self.db_url)
+        EngineRegistry.dispose(self.db_url)
+        engine_b = EngineRegistry.get_engine(self.db_url)
+        self.assertIsNot(engine_a, engine_b)
+
+    def test_is_authentication_error(self):
+        self.assertTrue(is_authentication_error(Exception(
+            "(1045, \"Access denied for user 'genbi'@'10.0.0.1' (using password: YES)\")")))
+        self.assertTrue(is_authentication_error(Exception(
+            'FATAL:  password authentication failed for user "genbi"')))
+        self.assertFalse(is_authentication_error(Exception("Table 'sales.orders' doesn't exist")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from utils import llm_cache
+from utils.domain import ModelResponse
+from utils.llm_cache import LLMResponseCache
+
+
+class TestLLMResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.patchers = [
+            patch.object(llm_cache, 'LLM_CACHE_PATH', os.path.join(self.temp_dir.name, 'llm.sqlite3')),
+            patch.object(llm_cache, 'LLM_CACHE_ENABLED', True),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+        LLMResponseCache._disk_store = None
+        LLMResponseCache.invalidate()
+        self.key = LLMResponseCache.build_key('model', 'system', 'user', {'max_tokens': 2048})
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        LLMResponseCache._disk_store = None
+        LLMResponseCache.invalidate()
+        self.temp_dir.cleanup()
+
+    def test_prompt_type_opt_in(self):
+        self.assertTrue(LLMResponseCache.is_enabled('intent'))
+        self.assertFalse(LLMResponseCache.is_enabled('text_to_sql'))
+        self.assertFalse(LLMResponseCache.is_enabled(None))
+
+    def test_key_depends_on_inference_params(self):
+        self.assertNotEqual(self.key, LLMResponseCache.build_key('model', 'system', 'user', {'max_tokens': 4096}))
+
+    def test_hit_is_zero_cost(self):
+        LLMResponseCache.put(self.key, ModelResponse(text='answer', token_info={'input_tokens': 10, 'output_tokens': 5}))
+        cached = LLMResponseCache.get('intent', self.key)
+        self.assertEqual(cached.text, 'answer')
+        self.assertEqual(cached.token_info['input_tokens'], 0)
+        self.assertEqual(cached.token_info['output_tokens'], 0)
+        self.assertTrue(cached.token_info['cache_hit'])
+        self.assertEqual(cached.token_info['cached_input_tokens'], 10)
+        stats = LLMResponseCache.get_stats()['stages']['INTENT_RECOGNITION']
+        self.assertGreaterEqual(stats['saved_input_tokens'], 10)
+
+    def test_caller_token_info_is_copied(self):
+        token_info = {'input_tokens': 10, 'output_tokens': 5}
+        LLMResponseCache.put(self.key, ModelResponse(text='answer', token_info=token_info))
+        # the caller keeps adding to its token usage after the response is cached
+        token_info['input_tokens'] += 100
+        self.assertEqual(LLMResponseCache.get('intent', self.key).token_info['cached_input_tokens'], 10)
+
+    def test_disk_hit_after_memory_cleared(self):
+        LLMResponseCache.put(self.key, ModelResponse(text='answer', token_info={}))
+        LLMResponseCache.memory_cache.invalidate()
+        self.assertEqual(LLMResponseCache.get('intent', self.key).text, 'answer')
+
+    def test_empty_response_not_cached(self):
+        LLMResponseCache.put(self.key, ModelResponse(text='', token_info={}))
+        self.assertIsNone(LLMResponseCache.get('intent', self.key))
+
+    def test_failed_response_not_cached(self):
+        LLMResponseCache.put(self.key, ModelResponse(text='None', token_info={}, error='Unexpected response'))
+        LLMResponseCache.put(self.key, ModelResponse(text=None, token_info={}))
+        self.assertIsNone(LLMResponseCache.get('intent', self.key))
+
+
+if __name__ == '__main__':
+    unittest.main()
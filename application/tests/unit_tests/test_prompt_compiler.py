@@ -0,0 +1,84 @@
+import copy
+import unittest
+from collections import defaultdict
+from unittest.mock import patch
+
+from utils.prompts.generate_prompt import PromptCompiler, CompiledTemplate, generate_llm_prompt, \
+    generate_data_summary_prompt, normalize_model_name, prompt_map_dict, render_schema_block
+
+
+class TestPromptCompiler(unittest.TestCase):
+    def setUp(self):
+        PromptCompiler.invalidate()
+        self.prompt_map = copy.deepcopy(prompt_map_dict)
+        self.model_id = 'anthropic.claude-3-sonnet-20240229-v1:0'
+        self.tables_info = {'orders': {'ddl': 'CREATE TABLE orders (id int, amount int)', 'description': 'orders'}}
+        self.environment = {'{company}': 'ACME'}
+
+    def tearDown(self):
+        PromptCompiler.invalidate()
+
+    def test_normalize_model_name(self):
+        self.assertEqual(normalize_model_name('bedrock-api.my-model'), 'my-model')
+        self.assertEqual(normalize_model_name('bedrock-api-model.my-model'), 'my-model')
+        self.assertEqual(normalize_model_name('unknown-model'), 'unknown-model')
+
+    def test_compiled_once_per_profile_objects(self):
+        compiled = PromptCompiler.get_prompt('text2sql', self.prompt_map, self.model_id, self.environment, 'mysql')
+        self.assertIs(compiled, PromptCompiler.get_prompt('text2sql', self.prompt_map, self.model_id,
+                                                          self.environment, 'mysql'))
+        # an updated profile is loaded as new objects
+        self.assertIsNot(compiled, PromptCompiler.get_prompt('text2sql', copy.deepcopy(self.prompt_map),
+                                                             self.model_id, self.environment, 'mysql'))
+        PromptCompiler.invalidate()
+        self.assertIsNot(compiled, PromptCompiler.get_prompt('text2sql', self.prompt_map, self.model_id,
+                                                             self.environment, 'mysql'))
+
+    def test_template_matches_format_map(self):
+        template = "{company} asks {question} in {dialect}, {{literal}} {missing}"
+        static_values = defaultdict(str, {'company': 'ACME {x}', 'dialect': 'mysql', 'question': 'ignored'})
+        compiled = CompiledTemplate(template, static_values, frozenset({'question'}))
+        environment = defaultdict(str, static_values)
+        environment['question'] = 'how many {orders}'
+        self.assertEqual(template.format_map(environment), compiled.render({'question': 'how many {orders}'}))
+
+    def test_template_with_format_spec_falls_back(self):
+        compiled = CompiledTemplate("{question:>8}|{company}", defaultdict(str, {'company': 'ACME'}),
+                                    frozenset({'question'}))
+        self.assertIsNone(compiled.pieces)
+        self.assertEqual("      hi|ACME", compiled.render({'question': 'hi'}))
+
+    def test_text2sql_prompt(self):
+        user_prompt, system_prompt = generate_llm_prompt(self.tables_info, '', self.prompt_map, 'total amount',
+                                                         model_id=self.model_id, dialect='redshift',
+                                                         environment_dict=self.environment)
+        self.assertIn('CREATE TABLE orders', user_prompt + system_prompt)
+        self.assertIn('total amount', user_prompt + system_prompt)
+        self.assertEqual(PromptCompiler.get_schema_block(self.tables_info),
+                         render_schema_block(self.tables_info))
+
+    def test_table_schema_rendered_once_for_linked_subsets(self):
+        tables_info = {f'table_{i}': {'ddl': f'CREATE TABLE table_{i} (id int)', 'description': f'table {i}'}
+                       for i in range(20)}
+        PromptCompiler.get_schema_block(tables_info)
+        with patch('utils.prompts.generate_prompt.render_table_schema', side_effect=AssertionError('rendered')):
+            # schema linking returns a new dict of the same table entries for every question
+            for selected in [['table_3', 'table_7'], ['table_7', 'table_11']]:
+                linked = {table_name: tables_info[table_name] for table_name in selected}
+                self.assertEqual(PromptCompiler.get_schema_block(linked, "\n"),
+                                 "".join(f"{name}: {tables_info[name]['description']}\n{tables_info[name]['ddl']}\n"
+                                         for name in selected))
+        # an updated table entry is rendered again
+        tables_info['table_3'] = {'ddl': 'CREATE TABLE table_3 (id bigint)', 'description': 'table 3'}
+        self.assertIn('bigint', PromptCompiler.get_schema_block({'table_3': tables_info['table_3']}))
+
+    def test_request_values_are_not_cached(self):
+        first, _ = generate_data_summary_prompt(self.prompt_map, 'first question', self.model_id, 'data 1')
+        second, _ = generate_data_summary_prompt(self.prompt_map, 'second question', self.model_id, 'data 2')
+        self.assertIn('first question', first)
+        self.assertIn('second question', second)
+        self.assertNotIn('first question', second)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import time
+import unittest
+from unittest.mock import patch
+
+from sqlalchemy import create_engine, text
+
+from utils.query_governor import CancelToken, QueryCancelledError, QueryGovernor, QueryTimeoutError, \
+    _get_dbapi_connection
+
+SLOW_SQL = ("WITH RECURSIVE counter(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM counter WHERE x < 100000000) "
+            "SELECT COUNT(*) FROM counter")
+
+
+class TestQueryGovernor(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        self.connection = self.engine.connect()
+
+    def tearDown(self):
+        self.connection.close()
+        self.engine.dispose()
+
+    def test_cancelled_request_does_not_execute(self):
+        cancel_token = CancelToken()
+        cancel_token.cancel('client disconnected')
+        governor = QueryGovernor('mysql', 10, cancel_token)
+        with self.assertRaises(QueryCancelledError):
+            with governor.govern(self.connection, "SELECT 1"):
+                self.fail("the SQL must not run")
+
+    def test_expired_deadline_cancels_token(self):
+        cancel_token = CancelToken(deadline_seconds=0.01)
+        time.sleep(0.02)
+        self.assertTrue(cancel_token.is_cancelled())
+        self.assertEqual(cancel_token.reason, 'request deadline expired')
+
+    def test_task_token_follows_request_token(self):
+        request_token = CancelToken(deadline_seconds=60)
+        task_token = CancelToken(deadline_seconds=0, parent=request_token)
+        self.assertLessEqual(task_token.remaining(), 60)
+        task_token.cancel('task timed out')
+        self.assertFalse(request_token.is_cancelled())
+        other_task_token = CancelToken(deadline_seconds=0, parent=request_token)
+        request_token.cancel('client disconnected')
+        self.assertTrue(other_task_token.is_cancelled())
+        self.assertEqual(other_task_token.reason, 'client disconnected')
+
+    def test_server_timeout_error_is_structured(self):
+        governor = QueryGovernor('mysql', 30)
+        with self.assertRaises(QueryTimeoutError) as context:
+            with governor.govern(self.connection, "SELECT 1"):
+                raise RuntimeError("(3024, 'Query execution was interrupted, maximum statement execution time "
+                                   "exceeded')")
+        self.assertIn('30 second limit', str(context.exception))
+
+    def test_clickhouse_timeout_is_appended(self):
+        governor = QueryGovernor('clickhouse', 30)
+        with governor.govern(self.connection, "SELECT 1;") as governed_sql:
+            self.assertEqual(governed_sql, "SELECT 1 SETTINGS max_execution_time = 30")
+
+    def test_watchdog_cancels_slow_query(self):
+        governor = QueryGovernor('athena', 0.2)
+
+        def interrupt(connection):
+            _get_dbapi_connection(connection).interrupt()
+
+        start_time = time.time()
+        with patch.object(governor, '_cancel_on_server', interrupt):
+            with self.assertRaises(QueryTimeoutError):
+                with governor.govern(self.connection, SLOW_SQL) as governed_sql:
+                    self.connection.execute(text(governed_sql)).fetchall()
+        self.assertTrue(governor.timed_out)
+        self.assertLess(time.time() - start_time, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
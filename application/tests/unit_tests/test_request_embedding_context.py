@@ -0,0 +1,85 @@
+import threading
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from nlq.business.vector_store import VectorStore
+from nlq.core.chat_context import RequestEmbeddingContext
+
+
+def embed(text):
+    return [float(len(text)), 1.0]
+
+
+def embed_batch(texts):
+    return np.array([embed(text) for text in texts])
+
+
+class TestRequestEmbeddingContext(unittest.TestCase):
+    def setUp(self):
+        self.create_embedding = patch.object(VectorStore, 'create_vector_embedding', side_effect=embed).start()
+        self.create_embeddings = patch.object(VectorStore, 'create_vector_embeddings', side_effect=embed_batch).start()
+        self.addCleanup(patch.stopall)
+        self.context = RequestEmbeddingContext()
+
+    def test_text_is_embedded_once(self):
+        self.assertEqual(self.context.get_embedding('sales by month'), [14.0, 1.0])
+        self.assertEqual(self.context.get_embedding('sales by month'), [14.0, 1.0])
+        self.context.get_embedding('sales')
+        self.assertEqual(self.create_embedding.call_count, 2)
+        self.assertEqual(self.context.embedding_calls, 2)
+
+    def test_failed_embedding_is_not_memoized(self):
+        self.create_embedding.side_effect = [Exception('throttled'), [1.0, 1.0]]
+        with self.assertRaises(Exception):
+            self.context.get_embedding('sales')
+        self.assertEqual(self.context.get_embedding('sales'), [1.0, 1.0])
+        self.assertEqual(self.create_embedding.call_count, 2)
+
+    def test_concurrent_callers_share_one_call(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_embed(text):
+            started.set()
+            release.wait(5)
+            return embed(text)
+
+        self.create_embedding.side_effect = slow_embed
+        results = []
+        owner = threading.Thread(target=lambda: results.append(self.context.get_embedding('sales')))
+        owner.start()
+        started.wait(5)
+        waiters = [threading.Thread(target=lambda: results.append(self.context.get_embedding('sales')))
+                   for _ in range(3)]
+        for waiter in waiters:
+            waiter.start()
+        release.set()
+        for thread in [owner] + waiters:
+            thread.join()
+        self.assertEqual(results, [[5.0, 1.0]] * 4)
+        self.assertEqual(self.create_embedding.call_count, 1)
+
+    def test_prefetch_embeds_missing_texts_in_one_call(self):
+        self.context.get_embedding('sales')
+        self.context.prefetch(['sales', 'sales by month', 'orders', 'sales by month'])
+        self.create_embeddings.assert_called_once_with(['sales by month', 'orders'])
+
+        self.assertEqual(self.context.get_embedding('orders'), [6.0, 1.0])
+        self.assertEqual(self.context.get_embedding('sales by month'), [14.0, 1.0])
+        self.assertEqual(self.create_embedding.call_count, 1)
+        self.assertEqual(self.context.embedding_calls, 2)
+
+        self.context.prefetch(['orders', 'sales'])
+        self.create_embeddings.assert_called_once()
+
+    def test_failed_prefetch_falls_back_to_single_calls(self):
+        self.create_embeddings.side_effect = Exception('throttled')
+        self.context.prefetch(['sales', 'orders'])
+        self.assertEqual(self.context.get_embedding('orders'), [6.0, 1.0])
+        self.create_embedding.assert_called_once_with('orders')
+
+
+if __name__ == '__main__':
+    unittest.main()
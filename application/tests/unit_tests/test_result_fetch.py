@@ -0,0 +1,62 @@
+import unittest
+from unittest.mock import patch
+
+from sqlalchemy import create_engine, text
+
+from utils.result_fetch import count_rows, fetch_dataframe
+
+
+class TestResultFetch(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        self.connection = self.engine.connect()
+        self.connection.execute(text("CREATE TABLE orders (id INTEGER, region TEXT, sales REAL)"))
+        self.connection.execute(text("INSERT INTO orders VALUES (:id, :region, :sales)"),
+                                [{'id': i, 'region': f'region_{i % 3}', 'sales': i * 1.5} for i in range(25)])
+
+    def tearDown(self):
+        self.connection.close()
+        self.engine.dispose()
+
+    def test_full_result_within_caps(self):
+        data, truncated = fetch_dataframe(self.connection, "SELECT * FROM orders", max_rows=25, chunk_size=4)
+        self.assertFalse(truncated)
+        self.assertEqual(len(data), 25)
+        self.assertEqual(list(data.columns), ['id', 'region', 'sales'])
+        self.assertEqual(data['sales'].dtype.kind, 'f')
+
+    def test_row_cap_truncates(self):
+        data, truncated = fetch_dataframe(self.connection, "SELECT * FROM orders ORDER BY id", max_rows=10,
+                                          chunk_size=4)
+        self.assertTrue(truncated)
+        self.assertEqual(data['id'].tolist(), list(range(10)))
+
+    def test_byte_cap_truncates(self):
+        data, truncated = fetch_dataframe(self.connection, "SELECT * FROM orders", max_bytes=1000, chunk_size=5)
+        self.assertTrue(truncated)
+        self.assertGreater(len(data), 0)
+        self.assertLessEqual(data.memory_usage(deep=True, index=False).sum(), 1000)
+
+    def test_uncapped_fetch(self):
+        data, truncated = fetch_dataframe(self.connection, "SELECT * FROM orders", max_rows=None, max_bytes=None,
+                                          chunk_size=4)
+        self.assertFalse(truncated)
+        self.assertEqual(len(data), 25)
+
+    def test_truncated_mysql_result_drops_the_connection(self):
+        with patch.object(self.connection.dialect, 'driver', 'pymysql'), \
+                patch.object(self.connection, 'invalidate') as invalidate:
+            fetch_dataframe(self.connection, "SELECT * FROM orders", max_rows=25, chunk_size=4)
+            invalidate.assert_not_called()
+            data, truncated = fetch_dataframe(self.connection, "SELECT * FROM orders", max_rows=10, chunk_size=4)
+            invalidate.assert_called_once()
+        self.assertTrue(truncated)
+        self.assertEqual(len(data), 10)
+
+    def test_count_rows(self):
+        self.assertEqual(count_rows(self.connection, "SELECT * FROM orders WHERE id < 7;"), 7)
+        self.assertIsNone(count_rows(self.connection, "SELECT * FROM missing_table"))
+
+
+if __name__ == '__main__':
+    unittest.main()
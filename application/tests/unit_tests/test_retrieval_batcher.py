@@ -0,0 +1,79 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from utils import opensearch
+from utils.opensearch import RetrievalBatcher
+
+OPENSEARCH_INFO = {'sql_index': 'uba', 'ner_index': 'uba_ner', 'agent_index': 'uba_agent', 'domain': 'genbi',
+                   'host': 'localhost', 'port': 9200, 'username': 'admin', 'password': 'admin',
+                   'region': 'us-east-1'}
+
+
+class EmbeddingContext:
+    def __init__(self):
+        self.prefetched = []
+
+    def prefetch(self, texts):
+        self.prefetched.append(list(texts))
+
+    def get_embedding(self, text):
+        return [float(len(text)), 1.0]
+
+
+def hits(*scores):
+    return {'hits': {'hits': [{'_id': f'doc-{score}', '_score': score, '_source': {}} for score in scores]}}
+
+
+class TestRetrievalBatcher(unittest.TestCase):
+    def setUp(self):
+        self.client = MagicMock()
+        patch.object(opensearch, 'get_opensearch_cluster_client', return_value=self.client).start()
+        self.create_embedding = patch.object(opensearch, 'create_vector_embedding').start()
+        self.addCleanup(patch.stopall)
+        self.embedding_context = EmbeddingContext()
+        self.batcher = RetrievalBatcher(OPENSEARCH_INFO, 'sales', self.embedding_context)
+
+    def test_responses_map_back_to_their_lookups(self):
+        self.client.msearch.return_value = {'responses': [hits(0.9, 0.5), hits(0.95), hits(0.8, 0.75)]}
+        sql_position = self.batcher.add('sales by month', 'query', 3)
+        ner_position = self.batcher.add('sales', 'ner', 5, score_threshold=0.9)
+        agent_position = self.batcher.add('why did sales drop', 'agent', 2, score_threshold=0.6)
+        results = self.batcher.execute()
+
+        self.assertEqual([sql_position, ner_position, agent_position], [0, 1, 2])
+        self.assertEqual([[hit['_id'] for hit in result] for result in results],
+                         [['doc-0.9'], ['doc-0.95'], ['doc-0.8', 'doc-0.75']])
+        # one batched embedding call and one msearch round trip
+        self.assertEqual(self.embedding_context.prefetched, [['sales by month', 'sales', 'why did sales drop']])
+        self.client.msearch.assert_called_once()
+        self.create_embedding.assert_not_called()
+        body = self.client.msearch.call_args.kwargs['body']
+        self.assertEqual([line['index'] for line in body[0::2]], ['uba', 'uba_ner', 'uba_agent'])
+        self.assertEqual([line['size'] for line in body[1::2]], [3, 5, 2])
+        knn = body[3]['query']['bool']['must'][0]['knn']['vector_field']
+        self.assertEqual(knn['vector'], [5.0, 1.0])
+        self.assertEqual(body[3]['query']['bool']['filter']['match_phrase']['profile'], 'sales')
+
+    def test_failed_lookup_does_not_fail_the_batch(self):
+        self.client.msearch.return_value = {'responses': [
+            hits(0.9),
+            {'error': {'type': 'index_not_found_exception', 'reason': 'no such index [uba_ner]'}, 'status': 404},
+            hits(0.85),
+        ]}
+        self.batcher.add('sales by month', 'query', 3)
+        self.batcher.add('sales', 'ner', 5)
+        self.batcher.add('why did sales drop', 'agent', 2)
+        results = self.batcher.execute()
+
+        self.assertEqual([[hit['_id'] for hit in result] for result in results], [['doc-0.9'], [], ['doc-0.85']])
+
+    def test_lookups_are_cleared_after_execute(self):
+        self.client.msearch.return_value = {'responses': [hits(0.9)]}
+        self.batcher.add('sales by month', 'query', 3)
+        self.assertEqual(len(self.batcher.execute()), 1)
+        self.assertEqual(self.batcher.execute(), [])
+        self.client.msearch.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pandas as pd
+
+from nlq.business import sample_ingestion
+from nlq.business.sample_ingestion import SampleIngestionPipeline
+
+INDEX_INFO = {'sql_index': 'uba', 'ner_index': 'uba_ner', 'agent_index': 'uba_agent'}
+
+
+class TestSampleIngestionPipeline(unittest.TestCase):
+    def setUp(self):
+        self.dao = MagicMock()
+        self.dao.search_samples_with_embeddings.side_effect = lambda profile, top_k, index, embeddings: \
+            [[] for _ in embeddings]
+        self.dao.parallel_bulk_write.return_value = (0, [])
+        self.dao.build_sample_record.side_effect = lambda index, profile, text, sql, embedding: \
+            {'_index': index, 'text': text, 'sql': sql, 'vector_field': embedding}
+        self.vector_store = patch.object(sample_ingestion, 'VectorStore').start()
+        self.vector_store.opensearch_dao = self.dao
+        self.vector_store.create_vector_embeddings.side_effect = lambda texts: np.ones((len(texts), 4))
+        self.profile_management = patch.object(sample_ingestion, 'ProfileManagement').start()
+        patch.object(sample_ingestion, 'opensearch_info', INDEX_INFO).start()
+        self.addCleanup(patch.stopall)
+
+    @staticmethod
+    def sql_samples(count):
+        return pd.DataFrame({'question': [f'question {i}' for i in range(count)],
+                             'sql': [f'SELECT {i}' for i in range(count)]})
+
+    def bulk_actions(self):
+        return [action for call in self.dao.parallel_bulk_write.call_args_list for action in call.args[0]]
+
+    def test_samples_are_ingested_in_chunks(self):
+        progress = []
+        pipeline = SampleIngestionPipeline('sales', sample_ingestion.SQL_SAMPLE,
+                                           progress_callback=lambda done, total: progress.append((done, total)),
+                                           chunk_size=2)
+        # the duplicated question is embedded once, the last row wins
+        data = pd.concat([self.sql_samples(5), pd.DataFrame({'question': ['question 0'], 'sql': ['SELECT 100']})])
+        result = pipeline.run(data)
+
+        self.assertEqual(result, {'total': 5, 'success': 5, 'failed': 0, 'failures': []})
+        self.assertEqual([len(call.args[0]) for call in self.vector_store.create_vector_embeddings.call_args_list],
+                         [2, 2, 1])
+        self.assertEqual(self.dao.parallel_bulk_write.call_count, 3)
+        self.assertEqual(progress, [(2, 5), (4, 5), (5, 5)])
+        records = {action['text']: action for action in self.bulk_actions()}
+        self.assertEqual(records['question 0']['sql'], 'SELECT 100')
+        self.assertTrue(all(action['_index'] == 'uba' for action in records.values()))
+        self.dao.refresh_index.assert_called_once_with('uba')
+        self.profile_management.samples_changed.assert_called_once_with('sales')
+
+    def test_exact_duplicates_are_replaced(self):
+        self.dao.search_samples_with_embeddings.side_effect = lambda profile, top_k, index, embeddings: \
+            [[{'_id': 'old-0', '_score': 1.0, '_source': {}}], [{'_id': 'old-1', '_score': 0.8, '_source': {}}]]
+        result = SampleIngestionPipeline('sales', sample_ingestion.SQL_SAMPLE).run(self.sql_samples(2))
+
+        self.assertEqual(result['success'], 2)
+        deletes = [action for action in self.bulk_actions() if action.get('_op_type') == 'delete']
+        self.assertEqual(deletes, [{'_op_type': 'delete', '_index': 'uba', '_id': 'old-0'}])
+
+    def test_failures_are_counted(self):
+        def embed(texts):
+            embeddings = np.ones((len(texts), 4))
+            embeddings[texts.index('question 1')] = 0
+            return embeddings
+
+        def bulk_write(actions, chunk_size, thread_count):
+            index_id = next(action['_id'] for action in actions if action.get('text') == 'question 2')
+            return len(actions) - 2, [{'index': {'_id': index_id, 'status': 400, 'error': 'mapper_parsing_exception'}},
+                                      {'delete': {'_id': 'old', 'status': 404}}]
+
+        self.vector_store.create_vector_embeddings.side_effect = embed
+        self.dao.parallel_bulk_write.side_effect = bulk_write
+        result = SampleIngestionPipeline('sales', sample_ingestion.SQL_SAMPLE).run(self.sql_samples(4))
+
+        self.assertEqual(result['total'], 4)
+        self.assertEqual(result['success'], 2)
+        self.assertEqual(result['failed'], 2)
+        self.assertEqual(result['failures'], [{'text': 'question 1', 'error': 'embedding failed'},
+                                              {'text': 'question 2', 'error': 'mapper_parsing_exception'}])
+        self.profile_management.samples_changed.assert_called_once_with('sales')
+
+    def test_failed_embedding_call_fails_the_chunk(self):
+        self.vector_store.create_vector_embeddings.side_effect = [Exception('throttled'), np.ones((1, 4))]
+        result = SampleIngestionPipeline('sales', sample_ingestion.SQL_SAMPLE, chunk_size=2).run(self.sql_samples(3))
+
+        self.assertEqual(result['success'], 1)
+        self.assertEqual(result['failed'], 2)
+        self.assertEqual({failure['error'] for failure in result['failures']}, {'throttled'})
+        self.assertEqual(self.dao.parallel_bulk_write.call_count, 1)
+
+    def test_agent_cot_samples_do_not_invalidate_profile_caches(self):
+        self.dao.build_agent_cot_record.side_effect = lambda index, profile, text, comment, embedding: \
+            {'_index': index, 'text': text}
+        data = pd.DataFrame({'query': ['monthly sales by region'], 'comment': ['group by month and region']})
+        result = SampleIngestionPipeline('sales', sample_ingestion.AGENT_COT_SAMPLE).run(data)
+
+        self.assertEqual(result['success'], 1)
+        self.dao.refresh_index.assert_called_once_with('uba_agent')
+        self.profile_management.samples_changed.assert_not_called()
+
+    def test_refresh_is_paused_for_large_loads(self):
+        self.dao.get_refresh_interval.return_value = '5s'
+        with patch.object(sample_ingestion, 'INGESTION_PAUSE_REFRESH_THRESHOLD', 3):
+            SampleIngestionPipeline('sales', sample_ingestion.SQL_SAMPLE).run(self.sql_samples(3))
+        self.assertEqual([call.args for call in self.dao.set_refresh_interval.call_args_list],
+                         [('uba', '-1'), ('uba', '5s')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from nlq.data_access import schema_catalog
+from nlq.data_access.schema_catalog import SchemaCatalog, fingerprint_columns
+
+
+class Connection:
+    def __init__(self, db_host='localhost'):
+        self.db_type = 'mysql'
+        self.db_host = db_host
+        self.db_port = 3306
+        self.db_name = 'sales'
+        self.db_user = 'genbi'
+        self.db_pwd = 'secret'
+
+
+class TestSchemaCatalog(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path_patcher = patch.object(schema_catalog, 'SCHEMA_CATALOG_PATH',
+                                         os.path.join(self.temp_dir.name, 'schema_catalog.sqlite3'))
+        self.path_patcher.start()
+        SchemaCatalog._disk_store = None
+        SchemaCatalog.invalidate()
+        self.connection = Connection()
+        self.reflected = []
+        self.columns = {'orders': [['id', 'INTEGER', None], ['amount', 'DECIMAL', "'order amount'"]],
+                        'customer': [['id', 'INTEGER', None]]}
+
+    def tearDown(self):
+        self.path_patcher.stop()
+        SchemaCatalog._disk_store = None
+        SchemaCatalog._catalogs.clear()
+        self.temp_dir.cleanup()
+
+    def reflect_tables(self, schema, tables):
+        self.reflected.append((schema, sorted(tables)))
+        return {table: {'comment': None, 'columns': [list(column) for column in self.columns[table]]}
+                for table in tables}
+
+    def fetch_fingerprints(self, schema):
+        return {table: fingerprint_columns([tuple(column) for column in columns])
+                for table, columns in self.columns.items()}
+
+    def get_tables(self):
+        return SchemaCatalog.get_tables(self.connection, {'sales': ['orders', 'customer']},
+                                        self.reflect_tables, self.fetch_fingerprints)
+
+    def test_unchanged_tables_are_not_reflected_again(self):
+        tables = self.get_tables()
+        self.assertEqual(tables['sales.orders']['columns'][1], ['amount', 'DECIMAL', "'order amount'"])
+        self.get_tables()
+        self.assertEqual(self.reflected, [('sales', ['customer', 'orders'])])
+
+    def test_changed_table_is_reflected(self):
+        self.get_tables()
+        self.columns['orders'].append(['region', 'VARCHAR', None])
+        tables = self.get_tables()
+        self.assertEqual(self.reflected[-1], ('sales', ['orders']))
+        self.assertEqual(len(tables['sales.orders']['columns']), 3)
+
+    def test_changed_comment_is_reflected(self):
+        self.get_tables()
+        self.columns['orders'][0][2] = "'order id'"
+        tables = self.get_tables()
+        self.assertEqual(self.reflected[-1], ('sales', ['orders']))
+        self.assertEqual(tables['sales.orders']['columns'][0], ['id', 'INTEGER', "'order id'"])
+
+    def test_refresh_reflects_all_tables(self):
+        self.get_tables()
+        SchemaCatalog.get_tables(self.connection, {'sales': ['orders', 'customer']}, self.reflect_tables,
+                                 self.fetch_fingerprints, refresh=True)
+        self.assertEqual(self.reflected, [('sales', ['customer', 'orders'])] * 2)
+
+    def test_catalog_is_read_from_disk(self):
+        self.get_tables()
+        SchemaCatalog._catalogs.clear()
+        tables = self.get_tables()
+        self.assertEqual(len(self.reflected), 1)
+        self.assertEqual(set(tables), {'sales.orders', 'sales.customer'})
+
+    def test_entries_expire_without_fingerprints(self):
+        SchemaCatalog.get_tables(self.connection, {'sales': ['orders']}, self.reflect_tables)
+        with patch.object(schema_catalog, 'SCHEMA_CATALOG_TTL', 0):
+            time.sleep(0.01)
+            SchemaCatalog.get_tables(self.connection, {'sales': ['orders']}, self.reflect_tables)
+        self.assertEqual(len(self.reflected), 2)
+
+    def test_schema_listing_is_cached(self):
+        calls = []
+
+        def list_schema_tables():
+            calls.append(1)
+            return {'sales': ['orders', 'customer']}
+
+        SchemaCatalog.get_schema_tables(self.connection, list_schema_tables)
+        listing = SchemaCatalog.get_schema_tables(self.connection, list_schema_tables)
+        self.assertEqual(listing, {'sales': ['orders', 'customer']})
+        self.assertEqual(len(calls), 1)
+        SchemaCatalog.get_schema_tables(self.connection, list_schema_tables, refresh=True)
+        self.assertEqual(len(calls), 2)
+
+    def test_catalog_is_serialized_under_the_lock(self):
+        dumps = schema_catalog.json.dumps
+
+        def locked_dumps(*args, **kwargs):
+            self.assertTrue(SchemaCatalog._lock.locked())
+            return dumps(*args, **kwargs)
+
+        with patch.object(schema_catalog.json, 'dumps', side_effect=locked_dumps) as patched:
+            self.get_tables()
+        self.assertEqual(patched.call_count, 1)
+
+    def test_concurrent_reflections_are_saved(self):
+        schemas = {f'schema_{i}': ['orders', 'customer'] for i in range(8)}
+        errors = []
+
+        def get_schema_tables(schema):
+            try:
+                SchemaCatalog.get_tables(self.connection, {schema: schemas[schema]}, self.reflect_tables)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=get_schema_tables, args=(schema,)) for schema in schemas]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        SchemaCatalog._catalogs.clear()
+        tables = SchemaCatalog.get_tables(self.connection, schemas, self.reflect_tables)
+        self.assertEqual(len(tables), 16)
+        self.assertEqual(len(self.reflected), 8)
+
+    def test_password_is_not_part_of_key(self):
+        other = Connection()
+        other.db_pwd = 'rotated'
+        self.assertEqual(SchemaCatalog.build_key(self.connection), SchemaCatalog.build_key(other))
+        self.assertNotEqual(SchemaCatalog.build_key(self.connection), SchemaCatalog.build_key(Connection('db2')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import time
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from nlq.business.schema_linking import SchemaLinker, estimate_tokens
+
+
+def build_table(name, comment, columns):
+    ddl = f"CREATE TABLE {name} (\n" + ",\n".join(
+        f"  {column} VARCHAR(64) COMMENT '{column_comment}'" for column, column_comment in columns) + "\n)"
+    return {'ddl': ddl, 'description': comment}
+
+
+class TestSchemaLinker(unittest.TestCase):
+    def setUp(self):
+        SchemaLinker.index_cache.invalidate()
+        self.tables_info = {
+            'orders': build_table('orders', 'sales orders', [('order_id', 'order id'), ('customer_id', 'buyer'),
+                                                             ('amount', 'order amount'), ('territory', 'sales region')]),
+            'customer': build_table('customer', 'customers', [('id', 'customer id'), ('name', 'customer name')]),
+        }
+        for i in range(30):
+            self.tables_info[f'log_table_{i}'] = build_table(f'log_table_{i}', f'audit log {i}',
+                                                             [('event_id', 'event'), ('payload', 'raw payload')])
+
+    def tearDown(self):
+        SchemaLinker.index_cache.invalidate()
+
+    def test_small_schema_is_unchanged(self):
+        tables_info = {'orders': self.tables_info['orders']}
+        self.assertIs(SchemaLinker.link(tables_info, 'total amount by territory'), tables_info)
+
+    def test_lexical_ranking_keeps_relevant_tables(self):
+        linked = SchemaLinker.link(self.tables_info, 'total order amount by territory', max_tables=3)
+        self.assertIn('orders', linked)
+        self.assertLessEqual(len(linked), 3)
+        self.assertNotIn('log_table_7', linked)
+
+    def test_unrelated_question_keeps_full_schema(self):
+        self.assertIs(SchemaLinker.link(self.tables_info, 'hello', max_tables=3), self.tables_info)
+
+    def test_entity_and_sql_references_are_linked(self):
+        ner_example = [{'_source': {'entity': 'Alice', 'entity_table_info': [
+            {'table_name': 'customer', 'column_name': 'name', 'value': 'Alice'}]}}]
+        sql_examples = [{'_source': {'text': 'payloads', 'sql': 'SELECT payload FROM db.log_table_3 l'}}]
+        linked = SchemaLinker.link(self.tables_info, 'what did she buy', ner_example=ner_example,
+                                   sql_examples=sql_examples, max_tables=2)
+        self.assertEqual(list(linked.keys()), ['customer', 'log_table_3'])
+
+    def test_indented_sample_sql(self):
+        indent = ' ' * 48
+        sql = (f"SELECT\n{indent}o.territory,\n{indent}SUM(\n{indent}o.amount\n{indent})\nFROM\n{indent}(\n"
+               f"{indent}SELECT *\n{indent}FROM\n{indent}orders\n{indent}) o\n{indent}-- by region\n"
+               f"GROUP BY\n{indent}o.territory")
+        start_time = time.perf_counter()
+        linked = SchemaLinker.link(self.tables_info, 'hello', sql_examples=[{'_source': {'text': 'q', 'sql': sql}}],
+                                   max_tables=3)
+        # the backtracking blank pattern took minutes on this SQL
+        self.assertLess(time.perf_counter() - start_time, 1)
+        self.assertEqual(list(linked.keys()), ['orders'])
+
+    def test_token_budget(self):
+        budget = estimate_tokens("orders: sales orders\n" + self.tables_info['orders']['ddl'] + "\n \n")
+        linked = SchemaLinker.link(self.tables_info, 'customer order amount', max_tables=10, token_budget=budget)
+        self.assertEqual(list(linked.keys()), ['orders'])
+
+    def test_embedding_ranking(self):
+        def embed_texts(texts):
+            # the customer table and its columns point to the first axis, every other text to the second
+            return np.array([[1.0, 0.0, 0.0, 0.0] if 'customer' in text and 'orders' not in text
+                             else [0.0, 1.0, 0.0, 0.0] for text in texts])
+
+        with patch.object(SchemaLinker, '_embed_texts', side_effect=embed_texts) as embed:
+            linked = SchemaLinker.link(self.tables_info, 'who are our clients', query_embedding=[1.0, 0.0, 0.0, 0.0],
+                                       max_tables=2)
+            SchemaLinker.link(self.tables_info, 'who are our buyers', query_embedding=[1.0, 0.0, 0.0, 0.0], max_tables=2)
+        self.assertEqual(list(linked.keys()), ['customer'])
+        # the schema embeddings are computed once per tables_info
+        self.assertEqual(embed.call_count, 1)
+
+    def test_embedding_failure_falls_back_to_lexical(self):
+        with patch.object(SchemaLinker, '_embed_texts', side_effect=RuntimeError('no endpoint')):
+            linked = SchemaLinker.link(self.tables_info, 'order amount by territory', query_embedding=[1.0, 0.0],
+                                       max_tables=3)
+        self.assertIn('orders', linked)
+
+
+if __name__ == '__main__':
+    unittest.main()
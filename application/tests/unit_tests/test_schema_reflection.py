@@ -0,0 +1,112 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import sqlalchemy as db
+from sqlalchemy import event, text
+
+from nlq.data_access import schema_catalog
+from nlq.data_access.database import RelationDatabase
+from nlq.data_access.schema_catalog import SchemaCatalog
+
+
+class Connection:
+    db_type = 'mysql'
+    db_host = 'localhost'
+    db_port = 3306
+    db_name = 'main'
+    db_user = 'genbi'
+    db_pwd = 'secret'
+
+
+class TestSchemaReflection(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.sales_path = os.path.join(self.temp_dir.name, 'sales.sqlite3')
+        self.engine = db.create_engine(f"sqlite:///{os.path.join(self.temp_dir.name, 'main.sqlite3')}")
+
+        @event.listens_for(self.engine, 'connect')
+        def attach_sales(dbapi_connection, connection_record):
+            dbapi_connection.execute(f"ATTACH DATABASE '{self.sales_path}' AS sales")
+
+        with self.engine.begin() as connection:
+            for index in range(25):
+                connection.execute(text(f"CREATE TABLE sales.orders_{index} (id INTEGER, amount DECIMAL)"))
+            connection.execute(text("CREATE TABLE customer (id INTEGER, name VARCHAR(20))"))
+        self.path_patcher = patch.object(schema_catalog, 'SCHEMA_CATALOG_PATH', '')
+        self.path_patcher.start()
+        self.engine_patcher = patch.object(RelationDatabase, 'get_engine_by_connection', return_value=self.engine)
+        self.engine_patcher.start()
+        self.fingerprint_patcher = patch.object(RelationDatabase, '_fetch_table_fingerprints', return_value=None)
+        self.fingerprint_patcher.start()
+        SchemaCatalog._catalogs.clear()
+
+    def tearDown(self):
+        self.fingerprint_patcher.stop()
+        self.engine_patcher.stop()
+        self.path_patcher.stop()
+        SchemaCatalog._catalogs.clear()
+        self.engine.dispose()
+        self.temp_dir.cleanup()
+
+    def test_table_definitions_reflected_in_batches(self):
+        tables = [f'orders_{index}' for index in range(25)]
+        table_info = RelationDatabase.get_table_definition_by_connection(Connection(), {'sales': tables})
+        self.assertEqual(len(table_info), 25)
+        self.assertEqual(table_info['sales.orders_7']['ddl'],
+                         'CREATE TABLE sales.orders_7  \n (\n  id INTEGER ,\n  amount DECIMAL \n)')
+
+    def test_missing_table_is_skipped(self):
+        table_info = RelationDatabase.get_metadata_by_table(Connection(), ['sales.orders_1', 'sales.missing'])
+        self.assertEqual(table_info['sales.orders_1'], {'id': 'INTEGER', 'amount': 'DECIMAL'})
+        self.assertEqual(table_info['sales.missing'], {})
+
+    def test_schemas_reflected_in_parallel(self):
+        metadata = RelationDatabase.get_metadata_by_connection(Connection(), ['main', 'sales'])
+        self.assertIn('main.customer', metadata.tables)
+        self.assertIn('sales.orders_24', metadata.tables)
+        self.assertEqual(len(metadata.tables), 26)
+
+
+class TestTableFingerprints(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        information_schema_path = os.path.join(self.temp_dir.name, 'information_schema.sqlite3')
+        self.engine = db.create_engine(f"sqlite:///{os.path.join(self.temp_dir.name, 'main.sqlite3')}")
+
+        @event.listens_for(self.engine, 'connect')
+        def attach_information_schema(dbapi_connection, connection_record):
+            dbapi_connection.execute(f"ATTACH DATABASE '{information_schema_path}' AS information_schema")
+
+        with self.engine.begin() as connection:
+            connection.execute(text("CREATE TABLE information_schema.columns (table_schema TEXT, table_name TEXT, "
+                                    "column_name TEXT, data_type TEXT, column_comment TEXT)"))
+            connection.execute(text("CREATE TABLE information_schema.tables (table_schema TEXT, table_name TEXT, "
+                                    "table_comment TEXT)"))
+            connection.execute(text("INSERT INTO information_schema.columns VALUES "
+                                    "('sales', 'orders', 'id', 'int', ''), "
+                                    "('sales', 'orders', 'amount', 'decimal', 'order amount')"))
+            connection.execute(text("INSERT INTO information_schema.tables VALUES ('sales', 'orders', 'orders')"))
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.temp_dir.cleanup()
+
+    def update(self, sql):
+        with self.engine.begin() as connection:
+            connection.execute(text(sql))
+
+    def test_comments_change_the_fingerprint(self):
+        fingerprint = RelationDatabase._fetch_table_fingerprints(Connection(), self.engine, 'sales')['orders']
+        self.update("UPDATE information_schema.columns SET column_comment = 'amount in USD' "
+                    "WHERE column_name = 'amount'")
+        column_fingerprint = RelationDatabase._fetch_table_fingerprints(Connection(), self.engine, 'sales')['orders']
+        self.assertNotEqual(fingerprint, column_fingerprint)
+        self.update("UPDATE information_schema.tables SET table_comment = 'sales orders'")
+        self.assertNotEqual(column_fingerprint,
+                            RelationDatabase._fetch_table_fingerprints(Connection(), self.engine, 'sales')['orders'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import time
+import unittest
+from unittest.mock import patch
+
+import pandas as pd
+
+from nlq.business import semantic_cache
+from nlq.business.semantic_cache import SemanticAnswerCache
+
+
+class TestSemanticAnswerCache(unittest.TestCase):
+    def setUp(self):
+        SemanticAnswerCache.invalidate()
+        self.profile = {'db_type': 'mysql', 'tables_info': {'orders': {}}, 'prompt_map': {},
+                        'row_level_security_config': None}
+        self.data = pd.DataFrame({'region': ['east'], 'sales': [10]})
+
+    def tearDown(self):
+        SemanticAnswerCache.invalidate()
+
+    def put(self, profile=None, username='alice', embedding=(1.0, 0.0, 0.0)):
+        SemanticAnswerCache.put('demo', profile or self.profile, username, 'sales by region', list(embedding),
+                                'SELECT 1', 'SELECT 1', '<sql>SELECT 1</sql>', 'explain', data=self.data)
+
+    def test_similar_question_hits(self):
+        self.put()
+        cached = SemanticAnswerCache.lookup('demo', self.profile, 'bob', [0.99, 0.05, 0.0])
+        self.assertEqual(cached['sql'], 'SELECT 1')
+        pd.testing.assert_frame_equal(cached['data'], self.data)
+
+    def test_dissimilar_question_misses(self):
+        self.put()
+        self.assertIsNone(SemanticAnswerCache.lookup('demo', self.profile, 'alice', [0.0, 1.0, 0.0]))
+
+    def test_rls_profile_is_partitioned_by_user(self):
+        profile = dict(self.profile, row_level_security_config='tables: []')
+        self.put(profile=profile)
+        self.assertIsNone(SemanticAnswerCache.lookup('demo', profile, 'bob', [1.0, 0.0, 0.0]))
+        self.assertIsNotNone(SemanticAnswerCache.lookup('demo', profile, 'alice', [1.0, 0.0, 0.0]))
+
+    def test_profile_change_invalidates(self):
+        self.put()
+        changed = dict(self.profile, tables_info={'orders': {'ddl': 'changed'}})
+        self.assertIsNone(SemanticAnswerCache.lookup('demo', changed, 'alice', [1.0, 0.0, 0.0]))
+
+    def test_sample_change_invalidates(self):
+        self.put()
+        SemanticAnswerCache.invalidate('demo')
+        self.assertIsNone(SemanticAnswerCache.lookup('demo', self.profile, 'alice', [1.0, 0.0, 0.0]))
+
+    def test_samples_version_change_invalidates(self):
+        # samples changed from another container: only the samples version of the reloaded profile differs
+        self.put(profile=dict(self.profile, samples_version=3))
+        self.assertIsNotNone(SemanticAnswerCache.lookup('demo', dict(self.profile, samples_version=3), 'alice',
+                                                        [1.0, 0.0, 0.0]))
+        self.assertIsNone(SemanticAnswerCache.lookup('demo', dict(self.profile, samples_version=4), 'alice',
+                                                     [1.0, 0.0, 0.0]))
+
+    def test_stale_result_is_not_reused(self):
+        with patch.object(semantic_cache, 'SEMANTIC_CACHE_RESULT_TTL', 0.01):
+            self.put()
+            time.sleep(0.02)
+            cached = SemanticAnswerCache.lookup('demo', self.profile, 'alice', [1.0, 0.0, 0.0])
+        self.assertEqual(cached['sql'], 'SELECT 1')
+        self.assertIsNone(cached['data'])
+
+
+if __name__ == '__main__':
+    unittest.main()
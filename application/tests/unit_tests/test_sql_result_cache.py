@@ -0,0 +1,82 @@
+import time
+import unittest
+from unittest.mock import patch
+
+import pandas as pd
+
+from utils import sql_result_cache
+from utils.sql_result_cache import SQLResultCache, ColumnarResult, normalize_sql
+
+
+class TestNormalizeSql(unittest.TestCase):
+    def test_comments_and_whitespace_are_stripped(self):
+        sql = "-- total sales\nSELECT  region,\n\tSUM(sales) /* amount */ FROM orders   GROUP BY region;"
+        self.assertEqual(normalize_sql(sql), normalize_sql("SELECT region, SUM(sales) FROM orders GROUP BY region"))
+
+    def test_literals_are_kept(self):
+        self.assertNotEqual(normalize_sql("SELECT * FROM t WHERE name = 'a  b'"),
+                            normalize_sql("SELECT * FROM t WHERE name = 'a b'"))
+        self.assertNotEqual(normalize_sql("SELECT * FROM t WHERE id = 1"),
+                            normalize_sql("SELECT * FROM t WHERE id = 2"))
+
+
+class TestSQLResultCache(unittest.TestCase):
+    def setUp(self):
+        SQLResultCache.invalidate()
+        self.profile = {'conn_name': 'demo_conn', 'db_url': '', 'row_level_security_config': None}
+        self.data = pd.DataFrame({'region': ['east', 'west', 'east'], 'sales': [10, 20, 30],
+                                  'ratio': [0.5, 0.25, 0.125]})
+
+    def tearDown(self):
+        SQLResultCache.invalidate()
+
+    def test_columnar_round_trip(self):
+        data = self.data.copy()
+        data['day'] = pd.to_datetime(['2024-01-01', '2024-01-02', '2024-01-03'])
+        data.columns = ['region', 'sales', 'sales', 'day']
+        pd.testing.assert_frame_equal(ColumnarResult(data).to_dataframe(), data)
+        empty = pd.DataFrame({'region': pd.Series([], dtype=object)})
+        pd.testing.assert_frame_equal(ColumnarResult(empty).to_dataframe(), empty)
+
+    def test_hit_with_reformatted_sql(self):
+        key = SQLResultCache.build_key(self.profile, "SELECT region, sales FROM orders", 'alice')
+        SQLResultCache.put(key, self.data, ttl=60, conn_name='demo_conn', attributes={'truncated': True})
+        other_key = SQLResultCache.build_key(self.profile, "SELECT region,\n  sales FROM orders -- all", 'bob')
+        data, attributes = SQLResultCache.get(other_key)
+        pd.testing.assert_frame_equal(data, self.data)
+        self.assertEqual(attributes, {'truncated': True})
+
+    def test_rls_profile_is_keyed_by_user(self):
+        profile = dict(self.profile, row_level_security_config='tables: []')
+        self.assertNotEqual(SQLResultCache.build_key(profile, "SELECT 1", 'alice'),
+                            SQLResultCache.build_key(profile, "SELECT 1", 'bob'))
+
+    def test_expired_result_misses(self):
+        key = SQLResultCache.build_key(self.profile, "SELECT 1", '')
+        SQLResultCache.put(key, self.data, ttl=0.01)
+        time.sleep(0.02)
+        self.assertIsNone(SQLResultCache.get(key))
+
+    def test_lru_eviction_by_bytes(self):
+        entry_bytes = ColumnarResult(self.data).nbytes
+        with patch.object(sql_result_cache, 'SQL_RESULT_CACHE_MAX_BYTES', entry_bytes * 2):
+            keys = [SQLResultCache.build_key(self.profile, f"SELECT {i}", '') for i in range(3)]
+            SQLResultCache.put(keys[0], self.data, ttl=60)
+            SQLResultCache.put(keys[1], self.data, ttl=60)
+            self.assertIsNotNone(SQLResultCache.get(keys[0]))
+            SQLResultCache.put(keys[2], self.data, ttl=60)
+        self.assertIsNotNone(SQLResultCache.get(keys[0]))
+        self.assertIsNone(SQLResultCache.get(keys[1]))
+        self.assertEqual(SQLResultCache.get_stats()['bytes'], entry_bytes * 2)
+
+    def test_invalidate_connection(self):
+        key = SQLResultCache.build_key(self.profile, "SELECT 1", '')
+        SQLResultCache.put(key, self.data, ttl=60, conn_name='demo_conn')
+        SQLResultCache.invalidate('other_conn')
+        self.assertIsNotNone(SQLResultCache.get(key))
+        SQLResultCache.invalidate('demo_conn')
+        self.assertIsNone(SQLResultCache.get(key))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+
+from nlq.business.sql_validator import SQLValidator, build_schema_catalog
+
+
+class TestSQLValidator(unittest.TestCase):
+    def setUp(self):
+        self.tables_info = {
+            'customer': {'ddl': "CREATE TABLE customer -- customers \n (\n  id INTEGER ,\n"
+                                "  name VARCHAR COMMENT 'customer name',\n  created_by VARCHAR \n)"},
+            'sales.orders': {'ddl': "CREATE TABLE sales.orders  \n (\n  id INTEGER ,\n  customer_id INTEGER ,\n"
+                                    "  product VARCHAR ,\n  quantity INTEGER ,\n  order_date DATE \n)"},
+        }
+
+    def validate(self, sql, db_type='mysql'):
+        return SQLValidator.validate(sql, self.tables_info, db_type)
+
+    def test_catalog_from_ddl(self):
+        catalog = build_schema_catalog(self.tables_info)
+        self.assertEqual(catalog[('customer',)], {'id', 'name', 'created_by'})
+        self.assertIn('order_date', catalog[('sales', 'orders')])
+
+    def test_valid_queries(self):
+        valid_sqls = [
+            "SELECT c.`name`, o.`product` FROM customer c JOIN sales.orders o ON c.`id` = o.`customer_id` LIMIT 100",
+            "SELECT DATE_FORMAT(order_date, '%Y-%m') AS month, SUM(quantity) total FROM orders "
+            "WHERE order_date >= DATE_SUB(CURDATE(), INTERVAL 7 DAY) GROUP BY month ORDER BY total DESC",
+            "SELECT EXTRACT(YEAR FROM order_date) AS y, COUNT(*) FROM orders GROUP BY 1",
+            "WITH top_customer AS (SELECT customer_id, SUM(quantity) AS q FROM orders GROUP BY customer_id) "
+            "SELECT c.name, t.q FROM top_customer t JOIN customer c ON c.id = t.customer_id",
+            "SELECT name FROM customer WHERE id IN (SELECT customer_id FROM sales.orders)",
+            "(SELECT id FROM customer) UNION (SELECT id FROM orders)",
+        ]
+        for sql in valid_sqls:
+            self.assertEqual(self.validate(sql), [], sql)
+
+    def test_non_select_is_rejected(self):
+        self.assertIn('Only SELECT', self.validate("DELETE FROM customer")[0])
+        self.assertIn('Exactly one', self.validate("SELECT 1; DROP TABLE customer")[0])
+
+    def test_unknown_table(self):
+        errors = self.validate("SELECT * FROM custmer")
+        self.assertEqual(len(errors), 1)
+        self.assertIn('Table custmer does not exist', errors[0])
+
+    def test_unknown_columns(self):
+        self.assertEqual(self.validate("SELECT o.prodct FROM orders o"),
+                         ["Column prodct does not exist in table sales.orders."])
+        self.assertEqual(self.validate("SELECT SUM(quantty) FROM orders"),
+                         ["Column quantty does not exist in the referenced tables."])
+
+    def test_lateral_view_columns_are_not_checked(self):
+        self.assertEqual(self.validate("SELECT item FROM orders LATERAL VIEW explode(product) t AS item", 'hive'), [])
+
+    def test_multi_word_column_names(self):
+        self.tables_info['refunds'] = {'ddl': "CREATE TABLE refunds  \n (\n  id INTEGER ,\n"
+                                              "  order date DATE COMMENT 'date of the order',\n  reason VARCHAR \n)"}
+        # the name can not be told apart from the type, the columns of the table are not checked
+        self.assertEqual(build_schema_catalog(self.tables_info)[('refunds',)], set())
+        self.assertEqual(self.validate("SELECT `order date`, reason FROM refunds"), [])
+        self.assertEqual(self.validate("SELECT r.`order date` FROM refunds r"), [])
+
+        self.tables_info['refunds'] = {'ddl': "CREATE TABLE refunds  \n (\n  id INTEGER ,\n"
+                                              "  `order date` DATE COMMENT 'date of the order',\n"
+                                              "  amount DECIMAL(10, 2) \n)"}
+        self.assertEqual(build_schema_catalog(self.tables_info)[('refunds',)], {'id', 'order date', 'amount'})
+        self.assertEqual(self.validate("SELECT `order date`, amount FROM refunds"), [])
+        self.assertIn('reason', self.validate("SELECT reason FROM refunds")[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import threading
+import time
+import unittest
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from nlq.core.stage_executor import Stage, StageExecutor, run_tasks_with_timeout
+from nlq.core.state import QueryState
+from utils.query_governor import CancelToken
+
+
+class TestStageExecutor(unittest.TestCase):
+    def test_stage_starts_after_all_dependencies(self):
+        executor = StageExecutor([Stage(name="S", run=lambda: 1,
+                                        depends_on=(QueryState.INITIAL, QueryState.INTENT_RECOGNITION))])
+        executor.state_finished(QueryState.INITIAL)
+        self.assertFalse(executor.started("S"))
+        executor.state_finished(QueryState.INTENT_RECOGNITION)
+        self.assertTrue(executor.started("S"))
+        self.assertEqual(executor.result("S"), 1)
+
+    def test_condition_false_skips_stage(self):
+        executor = StageExecutor([Stage(name="S", run=lambda: 1, depends_on=(QueryState.INITIAL,),
+                                        condition=lambda: False)])
+        executor.state_finished(QueryState.INITIAL)
+        self.assertFalse(executor.started("S"))
+
+    def test_stage_runs_concurrently_with_caller(self):
+        release = threading.Event()
+        events = []
+        executor = StageExecutor([Stage(name="S", run=lambda: release.wait(5), depends_on=(QueryState.INITIAL,),
+                                        event="Stage")],
+                                 emit_state=lambda text, status: events.append((text, status)))
+        executor.state_finished(QueryState.INITIAL)
+        # the caller is not blocked by the running stage
+        release.set()
+        self.assertTrue(executor.result("S"))
+        self.assertEqual(events, [("Stage", "start"), ("Stage", "end")])
+
+    def test_stage_error_raised_to_consumer(self):
+        def failing():
+            raise ValueError("boom")
+
+        executor = StageExecutor([Stage(name="S", run=failing, depends_on=(QueryState.INITIAL,))])
+        executor.state_finished(QueryState.INITIAL)
+        with self.assertRaises(ValueError):
+            executor.result("S")
+
+
+class TestRunTasksWithTimeout(unittest.TestCase):
+    def test_results_in_task_order(self):
+        def task(i, cancel_token):
+            time.sleep(0.03 * (3 - i))
+            if i == 1:
+                raise ValueError("boom")
+            return i * 10
+
+        outcomes = run_tasks_with_timeout(task, 3, 3, timeout=5)
+        self.assertEqual([result for result, _ in outcomes], [0, None, 20])
+        self.assertIsInstance(outcomes[1][1], ValueError)
+        self.assertEqual(run_tasks_with_timeout(task, 0, 3, timeout=5), [])
+
+    def test_timed_out_task_is_cancelled(self):
+        task_tokens = {}
+        finished = threading.Event()
+
+        def task(i, cancel_token):
+            task_tokens[i] = cancel_token
+            if i == 0:
+                # a running query polls its token, as the QueryGovernor watchdog does
+                while not cancel_token.is_cancelled():
+                    time.sleep(0.01)
+                finished.set()
+            return i
+
+        start_time = time.time()
+        outcomes = run_tasks_with_timeout(task, 2, 2, timeout=0.2)
+        self.assertLess(time.time() - start_time, 2)
+        self.assertIsInstance(outcomes[0][1], FutureTimeoutError)
+        self.assertEqual(outcomes[1], (1, None))
+        self.assertTrue(finished.wait(1))
+        self.assertTrue(task_tokens[0].is_cancelled())
+        self.assertFalse(task_tokens[1].is_cancelled())
+
+    def test_timeout_starts_when_task_is_picked_up(self):
+        def task(i, cancel_token):
+            time.sleep(0.15)
+            return i
+
+        # the second task waits for the only worker longer than the timeout, but runs within it
+        outcomes = run_tasks_with_timeout(task, 2, 1, timeout=0.3)
+        self.assertEqual(outcomes, [(0, None), (1, None)])
+
+    def test_request_cancellation_reaches_tasks(self):
+        request_token = CancelToken()
+        request_token.cancel('client disconnected')
+        outcomes = run_tasks_with_timeout(lambda i, cancel_token: cancel_token.is_cancelled(), 2, 2, timeout=5,
+                                          cancel_token=request_token)
+        self.assertEqual(outcomes, [(True, None), (True, None)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import asyncio
+import threading
+import unittest
+
+from api.worker_pool import EventChannel, WorkerPool
+
+
+class TestWorkerPool(unittest.TestCase):
+    def test_run_off_event_loop_and_deliver_events_in_order(self):
+        received = []
+
+        async def handler(text, status):
+            received.append((text, status))
+
+        def blocking_task(emit):
+            emit('stage', 'start')
+            emit('stage', 'end')
+            return threading.current_thread().name
+
+        async def main():
+            channel = EventChannel()
+            sender = asyncio.create_task(channel.consume(handler))
+            try:
+                return await WorkerPool.run(blocking_task, channel.emit)
+            finally:
+                channel.close()
+                await sender
+
+        thread_name = asyncio.run(main())
+        self.assertTrue(thread_name.startswith('ws-worker'))
+        self.assertEqual(received, [('stage', 'start'), ('stage', 'end')])
+
+    def test_event_loop_not_blocked_while_worker_runs(self):
+        release = threading.Event()
+
+        async def main():
+            task = asyncio.create_task(WorkerPool.run(release.wait, 5))
+            # the loop still runs other coroutines while the worker blocks
+            await asyncio.sleep(0.05)
+            self.assertEqual(WorkerPool.get_stats()['active_workers'], 1)
+            release.set()
+            return await task
+
+        self.assertTrue(asyncio.run(main()))
+        self.assertEqual(WorkerPool.get_stats()['active_workers'], 0)
+
+    def test_failed_handler_keeps_draining(self):
+        async def handler(*event):
+            raise RuntimeError('client disconnected')
+
+        async def main():
+            channel = EventChannel()
+            sender = asyncio.create_task(channel.consume(handler))
+            channel.emit('a', 'start')
+            channel.emit('a', 'end')
+            channel.close()
+            await asyncio.wait_for(sender, 1)
+            return channel.queue.qsize()
+
+        self.assertEqual(asyncio.run(main()), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
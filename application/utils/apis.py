@@ -1,32 +1,42 @@
 import json
 
-import sqlalchemy as db
 from sqlalchemy import text
 from utils.env_var import RDS_MYSQL_HOST, RDS_MYSQL_PORT, RDS_MYSQL_USERNAME, RDS_MYSQL_PASSWORD, RDS_MYSQL_DBNAME, RDS_PQ_SCHEMA
 import pandas as pd
 import sqlparse
 from nlq.business.connection import ConnectionManagement
+from nlq.data_access.engine_registry import EngineRegistry, is_authentication_error
 from utils.logging import getLogger
+from utils.query_governor import QueryCancelledError, QueryGovernor, QueryTimeoutError, get_statement_timeout
+from utils.result_fetch import count_rows, fetch_dataframe, get_fetch_limits
+from utils.sql_result_cache import SQLResultCache
 
 logger = getLogger()
 
 ALLOWED_QUERY_TYPES = ['SELECT']
+
+
+def format_db_url(p_db_url):
+    """
+    Fill the RDS MySQL placeholders of the default sample database url
+    """
+    if isinstance(p_db_url, str) and '{RDS_MYSQL_USERNAME}' in p_db_url:
+        return p_db_url.format(
+            RDS_MYSQL_HOST=RDS_MYSQL_HOST,
+            RDS_MYSQL_PORT=RDS_MYSQL_PORT,
+            RDS_MYSQL_USERNAME=RDS_MYSQL_USERNAME,
+            RDS_MYSQL_PASSWORD=RDS_MYSQL_PASSWORD,
+            RDS_MYSQL_DBNAME=RDS_MYSQL_DBNAME,
+        )
+    return p_db_url
+
+
 def query_from_database(p_db_url: str, query, schema=None):
     """
     Query the database
     """
     try:
-        if '{RDS_MYSQL_USERNAME}' in p_db_url:
-            engine = db.create_engine(p_db_url.format(
-                RDS_MYSQL_HOST=RDS_MYSQL_HOST,
-                RDS_MYSQL_PORT=RDS_MYSQL_PORT,
-                RDS_MYSQL_USERNAME=RDS_MYSQL_USERNAME,
-                RDS_MYSQL_PASSWORD=RDS_MYSQL_PASSWORD,
-                RDS_MYSQL_DBNAME=RDS_MYSQL_DBNAME,
-            ))
-        else:
-            engine = db.create_engine(p_db_url)
-        with engine.connect() as connection:
+        with EngineRegistry.connect(format_db_url(p_db_url)) as connection:
             logger.info(f'{query=}')
             sanitized_query = sqlparse.format(query, strip_comments=True)
             query_type = sqlparse.parse(sanitized_query)[0].get_type()
@@ -52,18 +62,7 @@ def query_from_sql_pd(p_db_url: str, query, schema=None):
     """
     Query the database
     """
-    if '{RDS_MYSQL_USERNAME}' in p_db_url:
-        engine = db.create_engine(p_db_url.format(
-            RDS_MYSQL_HOST=RDS_MYSQL_HOST,
-            RDS_MYSQL_PORT=RDS_MYSQL_PORT,
-            RDS_MYSQL_USERNAME=RDS_MYSQL_USERNAME,
-            RDS_MYSQL_PASSWORD=RDS_MYSQL_PASSWORD,
-            RDS_MYSQL_DBNAME=RDS_MYSQL_DBNAME,
-        ))
-    else:
-        engine = db.create_engine(p_db_url)
-
-    with engine.connect() as connection:
+    with EngineRegistry.connect(format_db_url(p_db_url)) as connection:
         logger.info(f'{query=}')
         res = pd.DataFrame()
         try:
@@ -73,33 +72,87 @@ def query_from_sql_pd(p_db_url: str, query, schema=None):
             logger.error(e)
         return res
 
-def get_sql_result_tool(profile, sql):
-    result_dict = {"data": pd.DataFrame(), "sql": sql, "status_code": 200, "error_info": ""}
-    try:
-        p_db_url = profile['db_url']
-        if not p_db_url:
-            conn_name = profile['conn_name']
-            p_db_url = ConnectionManagement.get_db_url_by_name(conn_name)
+def _execute_sql(profile, sql, cancel_token=None, capped=True):
+    """
+    Run the SQL on the database of the profile, returns (DataFrame, truncated, total_count)
+    """
+    profile_name = profile.get('profile_name')
+    p_db_url = profile['db_url']
+    if not p_db_url:
+        conn_name = profile['conn_name']
+        p_db_url = ConnectionManagement.get_db_url_by_name(conn_name)
 
-        if '{RDS_MYSQL_USERNAME}' in p_db_url:
-            engine = db.create_engine(p_db_url.format(
-                RDS_MYSQL_HOST=RDS_MYSQL_HOST,
-                RDS_MYSQL_PORT=RDS_MYSQL_PORT,
-                RDS_MYSQL_USERNAME=RDS_MYSQL_USERNAME,
-                RDS_MYSQL_PASSWORD=RDS_MYSQL_PASSWORD,
-                RDS_MYSQL_DBNAME=RDS_MYSQL_DBNAME,
-            ))
-        else:
-            if profile['db_type'] == "bigquery":
-                password, host = ConnectionManagement.get_db_password_host_by_name(profile['conn_name'])
-                password = json.loads(password)
-                engine = db.create_engine(url=host, credentials_info=password)
-            else:
-                engine = db.create_engine(p_db_url)
-        with engine.connect() as connection:
-            logger.info(f'{sql=}')
-            executed_result_df = pd.read_sql_query(text(sql), connection)
-            result_dict["data"] = executed_result_df.fillna("")
+    if profile['db_type'] == "bigquery":
+        password, host = ConnectionManagement.get_db_password_host_by_name(profile['conn_name'])
+        password = json.loads(password)
+        connect_context = EngineRegistry.connect(host, credentials_info=password)
+    else:
+        connect_context = EngineRegistry.connect(format_db_url(p_db_url))
+    governor = QueryGovernor(profile['db_type'], get_statement_timeout(profile_name), cancel_token)
+    total_count = None
+    with connect_context as connection:
+        logger.info(f'{sql=}')
+        max_rows, max_bytes, count_total = get_fetch_limits(profile_name) if capped else (None, None, False)
+        with governor.govern(connection, sql) as governed_sql:
+            executed_result_df, truncated = fetch_dataframe(connection, governed_sql, max_rows, max_bytes)
+        if truncated and count_total:
+            with governor.govern(connection, sql) as governed_sql:
+                total_count = count_rows(connection, governed_sql)
+    return executed_result_df.fillna(""), truncated, total_count
+
+
+def get_sql_result_tool(profile, sql, username='', bypass_cache=False, cancel_token=None, capped=True):
+    """
+    Execute the SQL on the database of the profile, the result is served from SQLResultCache when it is enabled
+    for the profile, bypass_cache forces the execution and refreshes the cached result.
+    The rows are streamed up to the row / byte cap of the profile, "truncated" tells whether rows were left out
+    and "total_count" is the full row count when counting is enabled for the profile.
+    capped=False reads every row, for exports that need the complete result, and skips the result cache.
+    The SQL runs under the statement timeout of the profile and is cancelled with the cancel_token of the request,
+    "error_type" is "timeout" / "cancelled" for those failures.
+    A connection whose credentials are rejected is retried once with credentials read again from Secrets Manager.
+    """
+    result_dict = {"data": pd.DataFrame(), "sql": sql, "status_code": 200, "error_info": "", "error_type": "",
+                   "truncated": False, "total_count": None}
+    profile_name = profile.get('profile_name')
+    use_cache = capped and SQLResultCache.is_enabled(profile_name)
+    cache_key = None
+    if use_cache:
+        cache_key = SQLResultCache.build_key(profile, sql, username)
+        if not bypass_cache:
+            cached = SQLResultCache.get(cache_key)
+            if cached is not None:
+                logger.info(f'SQL result cache hit: {sql=}')
+                result_dict["data"], attributes = cached
+                result_dict.update(attributes)
+                return result_dict
+    try:
+        try:
+            data, truncated, total_count = _execute_sql(profile, sql, cancel_token, capped)
+        except Exception as e:
+            if not profile.get('conn_name') or not is_authentication_error(e):
+                raise
+            # 密码可能已经在 Secrets Manager 中轮换, 重新获取凭证后重试一次
+            logger.warning(f"Authentication failed for connection {profile['conn_name']}, retrying with "
+                           f"refreshed credentials: {e}")
+            ConnectionManagement.refresh_credentials(profile['conn_name'])
+            # the caller keeps the profile (e.g. in the Streamlit session), it must not hold the old password
+            profile['db_url'] = ConnectionManagement.get_db_url_by_name(profile['conn_name'])
+            data, truncated, total_count = _execute_sql(profile, sql, cancel_token, capped)
+        result_dict["data"] = data
+        result_dict["truncated"] = truncated
+        result_dict["total_count"] = total_count
+        if use_cache:
+            SQLResultCache.put(cache_key, result_dict["data"], SQLResultCache.get_ttl(profile_name),
+                               conn_name=profile.get('conn_name', ''),
+                               attributes={"truncated": result_dict["truncated"],
+                                           "total_count": result_dict["total_count"]})
+    except (QueryTimeoutError, QueryCancelledError) as e:
+        logger.error("get_sql_result is error: {}".format(e))
+        result_dict["error_info"] = str(e)
+        result_dict["error_type"] = "timeout" if isinstance(e, QueryTimeoutError) else "cancelled"
+        result_dict["status_code"] = 500
+        result_dict["data"] = []
     except Exception as e:
         logger.error("get_sql_result is error: {}".format(e))
         result_dict["error_info"] = str(e)
@@ -4,6 +4,9 @@ import jwt
 import requests
 import json
 import os
+import threading
+import time
+from collections import OrderedDict
 
 from utils.logging import getLogger
 
@@ -18,28 +21,104 @@ if OPTIONS:
 AWS_DEFAULT_REGION = os.getenv("AWS_DEFAULT_REGION")
 skipAuthentication = AWS_DEFAULT_REGION.startswith("cn")
 
+# JWKS 缓存时间（秒），未知 kid 会强制刷新，但两次刷新之间至少间隔 JWKS_MIN_REFRESH_INTERVAL
+JWKS_CACHE_TTL = int(os.getenv("OIDC_JWKS_CACHE_TTL", "3600"))
+JWKS_MIN_REFRESH_INTERVAL = int(os.getenv("OIDC_JWKS_MIN_REFRESH_INTERVAL", "30"))
+# 获取 JWKS 失败后重试的间隔（秒）
+JWKS_RETRY_INTERVAL = int(os.getenv("OIDC_JWKS_RETRY_INTERVAL", "5"))
+JWKS_REQUEST_TIMEOUT = 5
+# 已验证 token 的 LRU 缓存大小，token 在 exp 之前有效
+VERIFIED_TOKEN_CACHE_SIZE = int(os.getenv("OIDC_VERIFIED_TOKEN_CACHE_SIZE", "1024"))
+
 logger = getLogger()
 
+_jwks_public_keys = {}
+_jwks_fetched_at = 0.0
+_jwks_failed_at = 0.0
+_jwks_lock = threading.Lock()
+_verified_tokens = OrderedDict()
+_verified_tokens_lock = threading.Lock()
+
+
+def _refresh_jwks():
+    """
+    Reload the signing keys from the JWKS endpoint. On failure the previous keys are kept,
+    so a short identity provider outage does not reject tokens signed by known keys,
+    and the fetch is retried after JWKS_RETRY_INTERVAL.
+    """
+    global _jwks_public_keys, _jwks_fetched_at, _jwks_failed_at
+    try:
+        keys = requests.get(JWKS_URL, timeout=JWKS_REQUEST_TIMEOUT).json()['keys']
+        public_keys = {}
+        for key in keys:
+            rsa_pem_key = jwt.algorithms.RSAAlgorithm.from_jwk(json.dumps(key))
+            public_keys[key['kid']] = rsa_pem_key.public_bytes(
+                encoding=serialization.Encoding.PEM,
+                format=serialization.PublicFormat.SubjectPublicKeyInfo
+            )
+    except Exception as e:
+        _jwks_failed_at = time.time()
+        logger.error(f"Failed to fetch JWKS, keep {len(_jwks_public_keys)} cached keys: {e}")
+        return
+    _jwks_public_keys = public_keys
+    _jwks_fetched_at = time.time()
+    logger.info(f"JWKS refreshed, {len(public_keys)} keys loaded")
+
+
+def _jwks_refresh_needed(kid, now):
+    if now - _jwks_failed_at <= JWKS_RETRY_INTERVAL:
+        return False
+    return now - _jwks_fetched_at > JWKS_CACHE_TTL or (
+            kid not in _jwks_public_keys and now - _jwks_fetched_at > JWKS_MIN_REFRESH_INTERVAL)
+
+
+def get_public_key(kid):
+    if _jwks_refresh_needed(kid, time.time()):
+        with _jwks_lock:
+            # another thread may have refreshed while waiting for the lock
+            if _jwks_refresh_needed(kid, time.time()):
+                _refresh_jwks()
+    if kid not in _jwks_public_keys:
+        raise jwt.InvalidKeyError(f"Unknown signing key id {kid}")
+    return _jwks_public_keys[kid]
+
+
+def _get_verified_token(token):
+    with _verified_tokens_lock:
+        cached = _verified_tokens.get(token)
+        if cached is None:
+            return None
+        claims, exp = cached
+        if exp <= time.time():
+            del _verified_tokens[token]
+            return None
+        _verified_tokens.move_to_end(token)
+        return claims
+
+
+def _put_verified_token(token, claims):
+    exp = claims.get('exp')
+    if not exp:
+        return
+    with _verified_tokens_lock:
+        _verified_tokens[token] = (claims, exp)
+        _verified_tokens.move_to_end(token)
+        while len(_verified_tokens) > VERIFIED_TOKEN_CACHE_SIZE:
+            _verified_tokens.popitem(last=False)
+
+
 def jwt_decode(token):
+    claims = _get_verified_token(token)
+    if claims is not None:
+        return claims
+
     header = jwt.get_unverified_header(token)
     alg = header['alg']
     kid = header['kid']
-
-    keys = requests.get(JWKS_URL).json()['keys']
-    public_key = None
-    for key in keys:
-        if key['kid'] == kid:
-            public_key = key
-
-    rsa_pem_key = jwt.algorithms.RSAAlgorithm.from_jwk(json.dumps(public_key))
-    rsa_pem_key_bytes = rsa_pem_key.public_bytes(
-        encoding=serialization.Encoding.PEM,
-        format=serialization.PublicFormat.SubjectPublicKeyInfo
-    )
+    rsa_pem_key_bytes = get_public_key(kid)
 
     logger.info('---JWT_DECODE Params---')
-    print(token, AUDIENCE, OPTIONS)
-    return jwt.decode(
+    claims = jwt.decode(
         token,
         key=rsa_pem_key_bytes,
         algorithms=[alg],
@@ -47,6 +126,8 @@ def jwt_decode(token):
         audience=AUDIENCE,
         options=OPTIONS
     )
+    _put_verified_token(token, claims)
+    return claims
 
 def authenticate(access_token):
 
@@ -72,7 +153,7 @@ def authenticate(access_token):
         jwt_decode(access_token)
 
     except Exception as e:
-        logger.error('Token decode exception: ', str(e))
+        logger.error(f'Token decode exception: {e}')
         response = {}
         response['X-Status-Code'] = status.HTTP_401_UNAUTHORIZED
         return response
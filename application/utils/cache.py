@@ -0,0 +1,215 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from utils.logging import getLogger
+
+logger = getLogger()
+
+# 默认缓存过期时间（秒）
+CONFIG_CACHE_TTL = int(os.getenv('CONFIG_CACHE_TTL', '60'))
+# SQLite 缓存清理过期数据的最小间隔（秒）
+SQLITE_CACHE_PURGE_INTERVAL = int(os.getenv('SQLITE_CACHE_PURGE_INTERVAL', '300'))
+
+_MISSING = object()
+
+# all named caches, used to expose hit / miss counters
+_cache_registry = {}
+_cache_registry_lock = threading.Lock()
+
+
+class TTLCache:
+    """
+    Thread safe in-process LRU cache with per-key TTL and hit / miss counters.
+
+    Every invalidation bumps the cache version, a value loaded by get_or_load is only stored
+    when no invalidation happened while it was loading, so a write during a slow read
+    can not put the stale value back.
+    """
+
+    def __init__(self, name, ttl=CONFIG_CACHE_TTL, max_size=1024):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        with _cache_registry_lock:
+            _cache_registry[name] = self
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING:
+                value, expire_at = item
+                if expire_at > time.time():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value, ttl=None, version=None):
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            self._data[key] = (value, time.time() + (self.ttl if ttl is None else ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def get_or_load(self, key, loader, ttl=None):
+        """
+        Read through: return the cached value, or call loader() and cache its result
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        version = self.version
+        value = loader()
+        self.put(key, value, ttl=ttl, version=version)
+        return value
+
+    def invalidate(self, key=_MISSING):
+        """
+        Remove one key, or everything when no key is given
+        """
+        with self._lock:
+            self.version += 1
+            if key is _MISSING:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'version': self.version,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+def get_cache_stats():
+    with _cache_registry_lock:
+        caches = list(_cache_registry.values())
+    return {cache.name: cache.stats() for cache in caches}
+
+
+class SqliteCacheStore:
+    """
+    Local on-disk key / blob store backed by SQLite, used as the second tier behind TTLCache.
+    The store is only a cache, any error is logged and treated as a miss.
+
+    Expired rows are deleted at most every SQLITE_CACHE_PURGE_INTERVAL seconds on write. With max_rows set,
+    the least recently read or written rows beyond max_rows are deleted at the same time.
+    """
+
+    def __init__(self, path, table='cache', max_rows=None):
+        self.path = path
+        self.table = table
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._conn = None
+        self._purged_at = 0.0
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(f'CREATE TABLE IF NOT EXISTS {table} '
+                               f'(key TEXT PRIMARY KEY, value BLOB NOT NULL, expire_at REAL, accessed_at REAL)')
+            columns = [row[1] for row in self._conn.execute(f'PRAGMA table_info({table})')]
+            if 'accessed_at' not in columns:
+                # store created before the size cap
+                self._conn.execute(f'ALTER TABLE {table} ADD COLUMN accessed_at REAL')
+            self._conn.execute(f'CREATE INDEX IF NOT EXISTS {table}_accessed_at ON {table} (accessed_at)')
+            self._conn.commit()
+            with self._lock:
+                self._purge()
+        except Exception as e:
+            logger.error(f"Failed to open cache store {path}: {e}")
+            self._conn = None
+
+    def _purge(self):
+        """
+        Delete the expired rows and the rows beyond max_rows, the caller holds the lock
+        """
+        now = time.time()
+        self._purged_at = now
+        deleted = self._conn.execute(f'DELETE FROM {self.table} WHERE expire_at IS NOT NULL AND expire_at <= ?',
+                                     (now,)).rowcount
+        if self.max_rows is not None:
+            excess = self._conn.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0] - self.max_rows
+            if excess > 0:
+                deleted += self._conn.execute(
+                    f'DELETE FROM {self.table} WHERE key IN '
+                    f'(SELECT key FROM {self.table} ORDER BY accessed_at IS NOT NULL, accessed_at LIMIT ?)',
+                    (excess,)).rowcount
+        self._conn.commit()
+        if deleted:
+            logger.info(f"Purged {deleted} rows from cache store {self.path}")
+
+    def get_many(self, keys):
+        if self._conn is None or not keys:
+            return {}
+        result = {}
+        now = time.time()
+        try:
+            with self._lock:
+                # stay below the SQLite host parameter limit
+                for start in range(0, len(keys), 500):
+                    chunk = keys[start:start + 500]
+                    placeholders = ','.join('?' * len(chunk))
+                    rows = self._conn.execute(
+                        f'SELECT key, value, expire_at FROM {self.table} WHERE key IN ({placeholders})', chunk)
+                    for key, value, expire_at in rows:
+                        if expire_at is None or expire_at > now:
+                            result[key] = value
+                if result and self.max_rows is not None:
+                    hits = list(result.keys())
+                    for start in range(0, len(hits), 500):
+                        chunk = hits[start:start + 500]
+                        placeholders = ','.join('?' * len(chunk))
+                        self._conn.execute(f'UPDATE {self.table} SET accessed_at = ? WHERE key IN ({placeholders})',
+                                           [now] + chunk)
+                    self._conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to read cache store {self.path}: {e}")
+        return result
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items, ttl=None):
+        if self._conn is None or not items:
+            return
+        now = time.time()
+        expire_at = now + ttl if ttl else None
+        try:
+            with self._lock:
+                self._conn.executemany(f'INSERT OR REPLACE INTO {self.table} (key, value, expire_at, accessed_at) '
+                                       f'VALUES (?, ?, ?, ?)', [(key, value, expire_at, now) for key, value in items])
+                self._conn.commit()
+                if now - self._purged_at >= SQLITE_CACHE_PURGE_INTERVAL:
+                    self._purge()
+        except Exception as e:
+            logger.error(f"Failed to write cache store {self.path}: {e}")
+
+    def put(self, key, value, ttl=None):
+        self.put_many([(key, value)], ttl=ttl)
+
+    def clear(self):
+        if self._conn is None:
+            return
+        with self._lock:
+            self._conn.execute(f'DELETE FROM {self.table}')
+            self._conn.commit()
@@ -18,3 +18,5 @@ class ModelResponse:
     response: str = ''
     text: str = ''
     token_info: dict[str, Any] = None
+    '''Error message when the invocation failed'''
+    error: str = ''
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import re
+import threading
+import unicodedata
+
+import numpy as np
+
+from utils.cache import TTLCache, SqliteCacheStore
+from utils.logging import getLogger
+
+logger = getLogger()
+
+EMBEDDING_CACHE_ENABLED = os.getenv('EMBEDDING_CACHE_ENABLED', 'true').lower() == 'true'
+EMBEDDING_CACHE_SIZE = int(os.getenv('EMBEDDING_CACHE_SIZE', '20000'))
+# 为空时只使用内存缓存
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', '/tmp/genbi/embedding_cache.sqlite3')
+# 本地 SQLite 缓存的最大行数, 1024 维的向量每行约 4KB
+EMBEDDING_CACHE_DISK_SIZE = int(os.getenv('EMBEDDING_CACHE_DISK_SIZE', '100000'))
+# embeddings of a fixed model never change, the TTL only bounds how long unused texts stay on disk
+EMBEDDING_CACHE_TTL = int(os.getenv('EMBEDDING_CACHE_TTL', str(30 * 24 * 3600)))
+
+
+def normalize_text(text):
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFKC', text)).strip()
+
+
+class EmbeddingCache:
+    """
+    Two tier embedding cache, an in-memory LRU in front of a local SQLite store.
+    Vectors are keyed by (platform, model, dimension, normalized text hash) and stored as float32.
+    """
+    memory_cache = TTLCache('embedding', ttl=EMBEDDING_CACHE_TTL, max_size=EMBEDDING_CACHE_SIZE)
+    _disk_store = None
+    _disk_store_lock = threading.Lock()
+    memory_hits = 0
+    disk_hits = 0
+    misses = 0
+
+    @classmethod
+    def _get_disk_store(cls):
+        if not EMBEDDING_CACHE_PATH:
+            return None
+        if cls._disk_store is None:
+            with cls._disk_store_lock:
+                if cls._disk_store is None:
+                    cls._disk_store = SqliteCacheStore(EMBEDDING_CACHE_PATH, table='embedding',
+                                                       max_rows=EMBEDDING_CACHE_DISK_SIZE)
+        return cls._disk_store
+
+    @classmethod
+    def build_key(cls, platform, model_name, dimension, text):
+        raw_key = '\x1f'.join([str(platform), str(model_name), str(dimension), normalize_text(text)])
+        return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def get_many(cls, platform, model_name, dimension, texts):
+        """
+        Look up the texts, return {index: float32 vector} for the cached ones
+        """
+        if not EMBEDDING_CACHE_ENABLED:
+            return {}
+        keys = [cls.build_key(platform, model_name, dimension, text) for text in texts]
+        found = {}
+        disk_lookup = {}
+        for index, key in enumerate(keys):
+            vector = cls.memory_cache.get(key)
+            if vector is not None:
+                found[index] = vector
+            else:
+                disk_lookup.setdefault(key, []).append(index)
+        cls.memory_hits += len(found)
+
+        disk_store = cls._get_disk_store()
+        if disk_lookup and disk_store is not None:
+            for key, value in disk_store.get_many(list(disk_lookup.keys())).items():
+                vector = np.frombuffer(value, dtype=np.float32)
+                cls.memory_cache.put(key, vector)
+                for index in disk_lookup[key]:
+                    found[index] = vector
+                    cls.disk_hits += 1
+        cls.misses += len(texts) - len(found)
+        return found
+
+    @classmethod
+    def get(cls, platform, model_name, dimension, text):
+        return cls.get_many(platform, model_name, dimension, [text]).get(0)
+
+    @classmethod
+    def put_many(cls, platform, model_name, dimension, texts, vectors):
+        if not EMBEDDING_CACHE_ENABLED:
+            return
+        disk_items = []
+        for text, vector in zip(texts, vectors):
+            vector = np.asarray(vector, dtype=np.float32)
+            # never cache the zero vector returned on embedding errors, or a vector of the wrong size
+            if vector.ndim != 1 or vector.shape[0] != int(dimension) or not vector.any():
+                continue
+            key = cls.build_key(platform, model_name, dimension, text)
+            cls.memory_cache.put(key, vector)
+            disk_items.append((key, vector.tobytes()))
+        disk_store = cls._get_disk_store()
+        if disk_items and disk_store is not None:
+            disk_store.put_many(disk_items, ttl=EMBEDDING_CACHE_TTL)
+
+    @classmethod
+    def put(cls, platform, model_name, dimension, text, vector):
+        cls.put_many(platform, model_name, dimension, [text], [vector])
+
+    @classmethod
+    def invalidate(cls):
+        """
+        Drop the in-memory tier, called when the embedding model is switched.
+        Disk entries are keyed by model, so they can not be served for another model.
+        """
+        cls.memory_cache.invalidate()
+        logger.info("Embedding cache invalidated")
+
+    @classmethod
+    def get_stats(cls):
+        total = cls.memory_hits + cls.disk_hits + cls.misses
+        return {
+            'memory_size': cls.memory_cache.stats()['size'],
+            'memory_hits': cls.memory_hits,
+            'disk_hits': cls.disk_hits,
+            'misses': cls.misses,
+            'hit_ratio': round((cls.memory_hits + cls.disk_hits) / total, 4) if total else 0.0,
+        }
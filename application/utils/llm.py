@@ -5,6 +5,7 @@ import requests
 from botocore.config import Config
 
 from utils.domain import ModelResponse
+from utils.llm_cache import LLMResponseCache
 from utils.logging import getLogger
 
 from langchain_core.output_parsers import JsonOutputParser
@@ -18,6 +19,7 @@ from utils.env_var import bedrock_ak_sk_info, BEDROCK_REGION, SAGEMAKER_EMBEDDIN
 from utils.tool import convert_timestamps_to_str
 
 from nlq.business.model import ModelManagement
+from nlq.business.schema_linking import SchemaLinker, SCHEMA_LINKING_EMBEDDING_ENABLED
 from utils.converse import bedrock_model_connect
 
 logger = getLogger()
@@ -350,7 +352,27 @@ def invoke_bedrock_api(api_url, headers, body, user_credentials=None):
     return response.json()
 
 
-def invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens=2048, with_response_stream=False):
+def invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens=2048, with_response_stream=False,
+                     prompt_type=None):
+    """
+    :param prompt_type: kind of prompt, e.g. intent / data_visualization, responses of the prompt types enabled in
+        LLM_CACHE_PROMPT_TYPES are served from the exact match response cache
+    """
+    if with_response_stream or not LLMResponseCache.is_enabled(prompt_type):
+        return invoke_llm_model_without_cache(model_id, system_prompt, user_prompt, max_tokens, with_response_stream)
+    cache_key = LLMResponseCache.build_key(model_id, system_prompt, user_prompt, {"max_tokens": max_tokens})
+    cached_response = LLMResponseCache.get(prompt_type, cache_key)
+    if cached_response is not None:
+        logger.info(f"LLM response cache hit for prompt type {prompt_type}")
+        return cached_response
+    model_response = invoke_llm_model_without_cache(model_id, system_prompt, user_prompt, max_tokens,
+                                                    with_response_stream)
+    if not model_response.error:
+        LLMResponseCache.put(cache_key, model_response)
+    return model_response
+
+
+def invoke_llm_model_without_cache(model_id, system_prompt, user_prompt, max_tokens=2048, with_response_stream=False):
     # Prompt with user turn only.
     user_message = {"role": "user", "content": user_prompt}
     messages = [user_message]
@@ -495,22 +517,36 @@ def invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens=2048, with
             elif isinstance(response, dict) and "content" in response and isinstance(response["content"], list):
                 final_response = response.get("content")[0].get("text")
                 model_response.text = final_response
-            # 其他情况
+            # 其他情况, 例如 invoke_bedrock_converse 出错时返回 None
             else:
-                model_response.text = str(response)
+                model_response.text = "" if response is None else str(response)
+                model_response.error = f"Unexpected response from model {model_id}: {type(response).__name__}"
             return model_response
     except Exception as e:
         logger.error(f"Unexpected error in invoke_llm_model: {e}", exc_info=True)
         model_response.text = str(response) if 'response' in locals() else ""
+        model_response.error = str(e)
         return model_response
 
 def text_to_sql(ddl, hints, prompt_map, search_box, sql_examples=None, ner_example=None, model_id=None, dialect='mysql',
-                model_provider=None, with_response_stream=False, additional_info='', environment_dict=None):
+                model_provider=None, with_response_stream=False, additional_info='', environment_dict=None,
+                embedding_context=None):
+    """
+    :param embedding_context: optional RequestEmbeddingContext, the embedding of the question is used to link
+        the relevant tables of the schema
+    """
+    query_embedding = None
+    if embedding_context is not None and SCHEMA_LINKING_EMBEDDING_ENABLED:
+        try:
+            query_embedding = embedding_context.get_embedding(search_box)
+        except Exception as e:
+            logger.error(f"Failed to get the question embedding for schema linking: {e}")
+    ddl = SchemaLinker.link(ddl, search_box, query_embedding, ner_example, sql_examples)
     user_prompt, system_prompt = generate_llm_prompt(ddl, hints, prompt_map, search_box, sql_examples, ner_example,
                                                      model_id, dialect=dialect, environment_dict=environment_dict)
     max_tokens = 4096
     model_response = invoke_llm_model(model_id, system_prompt, user_prompt + additional_info, max_tokens,
-                                      with_response_stream)
+                                      with_response_stream, prompt_type="text_to_sql")
     return model_response.text, model_response
 
 
@@ -520,7 +556,7 @@ def get_agent_cot_task(model_id, prompt_map, search_box, ddl, agent_cot_example=
                                                                   agent_cot_example, environment_dict)
     try:
         max_tokens = 2048
-        model_response = invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens, False)
+        model_response = invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens, False, "agent_task")
         final_response = model_response.text
         logger.info(f'{final_response=}')
         intent_result_dict = json_parse.parse(final_response)
@@ -539,7 +575,8 @@ def data_analyse_tool(model_id, prompt_map, search_box, sql_data, search_type, e
         else:
             user_prompt, system_prompt = generate_data_summary_prompt(prompt_map, search_box, model_id, sql_data,
                                                                       environment_dict)
-        model_response = invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens, False)
+        model_response = invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens, False,
+                                          "agent_analyse" if search_type == "agent" else "data_summary")
         final_response = model_response.text
         logger.info(f'{final_response=}')
         return final_response, model_response
@@ -567,7 +604,7 @@ def get_query_intent(model_id, search_box, prompt_map, environment_dict=None):
         
         # 继续处理
         max_tokens = 2048
-        model_response = invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens, False)
+        model_response = invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens, False, "intent")
         final_response = model_response.text
         logger.info(f'{final_response=}')
         
@@ -606,7 +643,7 @@ def get_query_rewrite(model_id, search_box, prompt_map, chat_history, environmen
         # 调用模型
         max_tokens = 2048
         logger.info(f"Calling invoke_llm_model with model_id: {model_id}, max_tokens: {max_tokens}")
-        model_response = invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens, False)
+        model_response = invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens, False, "query_rewrite")
         
         # 检查模型响应对象
         logger.info(f"model_response type: {type(model_response)}")
@@ -678,7 +715,7 @@ def knowledge_search(model_id, search_box, prompt_map, environment_dict=None, en
     # 生成提示并调用模型
     user_prompt, system_prompt = generate_knowledge_prompt(prompt_map, search_box, model_id, environment_dict)
     max_tokens = 2048
-    model_response = invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens, False)
+    model_response = invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens, False, "knowledge")
     final_response = model_response.text
     return final_response, model_response
 
@@ -692,7 +729,7 @@ def select_data_visualization_type(model_id, search_box, search_data, prompt_map
         user_prompt, system_prompt = generate_data_visualization_prompt(prompt_map, search_box, search_data, model_id,
                                                                         environment_dict)
         max_tokens = 2048
-        model_response = invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens, False)
+        model_response = invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens, False, "data_visualization")
         final_response = model_response.text
         data_visualization_dict = json_parse.parse(final_response)
         return data_visualization_dict, model_response
@@ -887,6 +924,7 @@ def create_vector_embedding_with_sagemaker(endpoint_name, text, index_name):
 def generate_suggested_question(prompt_map, search_box, model_id=None, environment_dict=None):
     max_tokens = 2048
     user_prompt, system_prompt = generate_suggest_question_prompt(prompt_map, search_box, model_id, environment_dict)
-    model_response = invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens)
+    model_response = invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens,
+                                      prompt_type="suggested_question")
     final_response = model_response.text
     return final_response, model_response
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import threading
+
+from utils.cache import TTLCache, SqliteCacheStore
+from utils.domain import ModelResponse
+from utils.logging import getLogger
+
+logger = getLogger()
+
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'false').lower() == 'true'
+# 允许缓存的 prompt 类型, 只有输入相同输出也应该相同的 prompt 才适合缓存
+LLM_CACHE_PROMPT_TYPES = set(
+    each.strip() for each in os.getenv('LLM_CACHE_PROMPT_TYPES', 'intent,data_visualization,suggested_question').split(',')
+    if each.strip())
+LLM_CACHE_TTL = int(os.getenv('LLM_CACHE_TTL', '3600'))
+LLM_CACHE_SIZE = int(os.getenv('LLM_CACHE_SIZE', '2048'))
+# 本地 SQLite 缓存的最大行数
+LLM_CACHE_DISK_SIZE = int(os.getenv('LLM_CACHE_DISK_SIZE', '20000'))
+# 为空时只使用内存缓存
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', '/tmp/genbi/llm_cache.sqlite3')
+
+# prompt type -> QueryState name (or token_info key) of the stage issuing it
+PROMPT_TYPE_STAGES = {
+    'query_rewrite': 'QUERY_REWRITE',
+    'intent': 'INTENT_RECOGNITION',
+    'knowledge': 'KNOWLEDGE_SEARCH',
+    'text_to_sql': 'SQL_GENERATION',
+    'agent_task': 'AGENT_TASK',
+    'data_summary': 'ANALYZE_DATA',
+    'agent_analyse': 'AGENT_DATA_SUMMARY',
+    'data_visualization': 'DATA_VISUALIZATION',
+    'suggested_question': 'SUGGEST_QUESTION',
+}
+
+
+class LLMResponseCache:
+    """
+    Exact match cache of LLM responses, keyed by (model id, system and user prompt hash, inference parameters).
+    An in-memory LRU with TTL sits in front of a local SQLite store. Only the prompt types listed in
+    LLM_CACHE_PROMPT_TYPES are cached, a cached response reports zero tokens and cache_hit in its token_info.
+    """
+    memory_cache = TTLCache('llm_response', ttl=LLM_CACHE_TTL, max_size=LLM_CACHE_SIZE)
+    _disk_store = None
+    _disk_store_lock = threading.Lock()
+    _stats_lock = threading.Lock()
+    stage_stats = {}
+
+    @classmethod
+    def _get_disk_store(cls):
+        if not LLM_CACHE_PATH:
+            return None
+        if cls._disk_store is None:
+            with cls._disk_store_lock:
+                if cls._disk_store is None:
+                    cls._disk_store = SqliteCacheStore(LLM_CACHE_PATH, table='llm_response',
+                                                       max_rows=LLM_CACHE_DISK_SIZE)
+        return cls._disk_store
+
+    @classmethod
+    def is_enabled(cls, prompt_type):
+        return LLM_CACHE_ENABLED and prompt_type in LLM_CACHE_PROMPT_TYPES
+
+    @classmethod
+    def build_key(cls, model_id, system_prompt, user_prompt, inference_params):
+        raw_key = '\x1f'.join([str(model_id), str(system_prompt), str(user_prompt),
+                               json.dumps(inference_params, sort_keys=True, default=str)])
+        return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def _record(cls, prompt_type, hit, token_info=None):
+        stage = PROMPT_TYPE_STAGES.get(prompt_type, prompt_type)
+        with cls._stats_lock:
+            stats = cls.stage_stats.setdefault(stage, {'hits': 0, 'misses': 0,
+                                                       'saved_input_tokens': 0, 'saved_output_tokens': 0})
+            if hit:
+                stats['hits'] += 1
+                stats['saved_input_tokens'] += (token_info or {}).get('input_tokens', 0)
+                stats['saved_output_tokens'] += (token_info or {}).get('output_tokens', 0)
+            else:
+                stats['misses'] += 1
+
+    @classmethod
+    def get(cls, prompt_type, key):
+        """
+        Return a ModelResponse rebuilt from the cache, or None
+        """
+        value = cls.memory_cache.get(key)
+        if value is None:
+            disk_store = cls._get_disk_store()
+            raw_value = disk_store.get(key) if disk_store is not None else None
+            if raw_value is not None:
+                try:
+                    value = json.loads(raw_value)
+                    cls.memory_cache.put(key, value)
+                except Exception as e:
+                    logger.error(f"Failed to decode cached LLM response: {e}")
+                    value = None
+        if value is None:
+            cls._record(prompt_type, False)
+            return None
+        original_token_info = value.get('token_info') or {}
+        cls._record(prompt_type, True, original_token_info)
+        token_info = {
+            'input_tokens': 0,
+            'output_tokens': 0,
+            'cache_hit': True,
+            'cached_input_tokens': original_token_info.get('input_tokens', 0),
+            'cached_output_tokens': original_token_info.get('output_tokens', 0),
+        }
+        return ModelResponse(response=value['text'], text=value['text'], token_info=token_info)
+
+    @classmethod
+    def put(cls, key, model_response):
+        # failed calls and responses that are not text are never cached
+        if model_response.error or not isinstance(model_response.text, str) or not model_response.text:
+            return
+        value = {'text': model_response.text, 'token_info': dict(model_response.token_info or {})}
+        cls.memory_cache.put(key, value)
+        disk_store = cls._get_disk_store()
+        if disk_store is not None:
+            try:
+                disk_store.put(key, json.dumps(value, ensure_ascii=False, default=str), ttl=LLM_CACHE_TTL)
+            except Exception as e:
+                logger.error(f"Failed to write LLM response cache: {e}")
+
+    @classmethod
+    def invalidate(cls):
+        """
+        Drop every cached response, called when a model configuration changes
+        """
+        cls.memory_cache.invalidate()
+        disk_store = cls._get_disk_store()
+        if disk_store is not None:
+            try:
+                disk_store.clear()
+            except Exception as e:
+                logger.error(f"Failed to clear LLM response cache: {e}")
+        logger.info("LLM response cache invalidated")
+
+    @classmethod
+    def get_stats(cls):
+        with cls._stats_lock:
+            stages = {}
+            for stage, stats in cls.stage_stats.items():
+                total = stats['hits'] + stats['misses']
+                stages[stage] = dict(stats, hit_ratio=round(stats['hits'] / total, 4) if total else 0.0)
+        return {
+            'enabled': LLM_CACHE_ENABLED,
+            'prompt_types': sorted(LLM_CACHE_PROMPT_TYPES),
+            'memory_size': cls.memory_cache.stats()['size'],
+            'stages': stages,
+        }
@@ -1,3 +1,6 @@
+import os
+import threading
+
 import boto3
 from opensearchpy import OpenSearch
 from opensearchpy.helpers import bulk
@@ -7,6 +10,48 @@ from utils.logging import getLogger
 
 logger = getLogger()
 
+# 共享 OpenSearch client 的连接池参数
+AOS_POOL_MAXSIZE = int(os.getenv('AOS_POOL_MAXSIZE', '20'))
+AOS_TIMEOUT = int(os.getenv('AOS_TIMEOUT', '30'))
+AOS_MAX_RETRIES = int(os.getenv('AOS_MAX_RETRIES', '3'))
+
+# process wide clients keyed by (host, port, user, password), endpoints keyed by (domain, region)
+_opensearch_clients = {}
+_opensearch_endpoints = {}
+_opensearch_client_lock = threading.Lock()
+
+
+def get_opensearch_client(host, port, opensearch_user, opensearch_password):
+    """
+    Get the shared, keep-alive OpenSearch client of the host, create it on first use
+    :param host:
+    :param port:
+    :param opensearch_user:
+    :param opensearch_password:
+    :return:
+    """
+    key = (host, str(port), opensearch_user, opensearch_password)
+    with _opensearch_client_lock:
+        opensearch_client = _opensearch_clients.get(key)
+        if opensearch_client is None:
+            # Create the client with SSL/TLS enabled, but hostname verification disabled.
+            opensearch_client = OpenSearch(
+                hosts=[{'host': host, 'port': port}],
+                http_compress=True,  # enables gzip compression for request bodies
+                http_auth=(opensearch_user, opensearch_password),
+                use_ssl=True,
+                verify_certs=False,
+                ssl_assert_hostname=False,
+                ssl_show_warn=False,
+                pool_maxsize=AOS_POOL_MAXSIZE,
+                timeout=AOS_TIMEOUT,
+                max_retries=AOS_MAX_RETRIES,
+                retry_on_timeout=True
+            )
+            _opensearch_clients[key] = opensearch_client
+            logger.info(f"Created shared OpenSearch client for {host}:{port}")
+    return opensearch_client
+
 
 def get_opensearch_cluster_client(domain, host, port, opensearch_user, opensearch_password, region_name):
     """
@@ -19,35 +64,46 @@ def get_opensearch_cluster_client(domain, host, port, opensearch_user, opensearc
     :param region_name:
     :return:
     """
-    auth = (opensearch_user, opensearch_password)
-    if len(host) == 0:
+    if not host:
         host = get_opensearch_endpoint(domain, region_name)
-
-    # Create the client with SSL/TLS enabled, but hostname verification disabled.
-    opensearch_client = OpenSearch(
-        hosts=[{'host': host, 'port': port}],
-        http_compress=True,  # enables gzip compression for request bodies
-        http_auth=auth,
-        use_ssl=True,
-        verify_certs=False,
-        ssl_assert_hostname=False,
-        ssl_show_warn=False
-    )
-    return opensearch_client
+    return get_opensearch_client(host, port, opensearch_user, opensearch_password)
 
 
 def get_opensearch_endpoint(domain, region):
     """
-    Get OpenseSearch endpoint
+    Get OpenseSearch endpoint, the describe result is cached for the process lifetime
     :param domain:
     :param region:
     :return:
     """
-    client = boto3.client('es', region_name=region)
-    response = client.describe_elasticsearch_domain(
-        DomainName=domain
-    )
-    return response['DomainStatus']['Endpoint']
+    key = (domain, region)
+    if key not in _opensearch_endpoints:
+        client = boto3.client('es', region_name=region)
+        response = client.describe_elasticsearch_domain(
+            DomainName=domain
+        )
+        _opensearch_endpoints[key] = response['DomainStatus']['Endpoint']
+    return _opensearch_endpoints[key]
+
+
+def get_opensearch_client_stats():
+    """
+    Connection pool usage of the shared OpenSearch clients
+    :return:
+    """
+    stats = []
+    with _opensearch_client_lock:
+        clients = list(_opensearch_clients.items())
+    for (host, port, _, _), opensearch_client in clients:
+        for connection in opensearch_client.transport.connection_pool.connections:
+            http_pool = getattr(connection, 'pool', None)
+            stats.append({
+                'host': f"{host}:{port}",
+                'pool_maxsize': AOS_POOL_MAXSIZE,
+                'num_connections': getattr(http_pool, 'num_connections', None),
+                'num_requests': getattr(http_pool, 'num_requests', None),
+            })
+    return stats
 
 
 def put_bulk_in_opensearch(list, client):
@@ -204,14 +260,39 @@ def check_field_exists(opensearch_client, index_name, field_name):
 
     return False
 
-def get_retrieve_opensearch(opensearch_info, query, search_type, selected_profile, top_k, score_threshold=0.7):
+def get_retrieve_index_name(opensearch_info, search_type):
     if search_type == "query":
-        index_name = opensearch_info['sql_index']
+        return opensearch_info['sql_index']
     elif search_type == "ner":
-        index_name = opensearch_info['ner_index']
+        return opensearch_info['ner_index']
     else:
-        index_name = opensearch_info['agent_index']
-    records_with_embedding = create_vector_embedding(query, index_name=index_name)
+        return opensearch_info['agent_index']
+
+
+def get_query_embedding(query, index_name, embedding_context=None):
+    query_embedding = None
+    if embedding_context is not None:
+        try:
+            query_embedding = embedding_context.get_embedding(query)
+        except Exception as e:
+            logger.error(f"Failed to get embedding from request context: {e}")
+    if query_embedding is None:
+        query_embedding = create_vector_embedding(query, index_name=index_name)['vector_field']
+    return query_embedding
+
+
+def filter_retrieve_result(retrieve_result, score_threshold):
+    return [item for item in retrieve_result if item["_score"] > score_threshold]
+
+
+def get_retrieve_opensearch(opensearch_info, query, search_type, selected_profile, top_k, score_threshold=0.7,
+                            embedding_context=None):
+    """
+    :param embedding_context: optional RequestEmbeddingContext, reuses the embedding of a text already
+        embedded in the same request
+    """
+    index_name = get_retrieve_index_name(opensearch_info, search_type)
+    query_embedding = get_query_embedding(query, index_name, embedding_context)
     retrieve_result = retrieve_results_from_opensearch(
         index_name=index_name,
         region_name=opensearch_info['region'],
@@ -220,21 +301,14 @@ def get_retrieve_opensearch(opensearch_info, query, search_type, selected_profil
         opensearch_password=opensearch_info['password'],
         host=opensearch_info['host'],
         port=opensearch_info['port'],
-        query_embedding=records_with_embedding['vector_field'],
+        query_embedding=query_embedding,
         top_k=top_k,
         profile_name=selected_profile)
-
-    filter_retrieve_result = []
-    for item in retrieve_result:
-        if item["_score"] > score_threshold:
-            filter_retrieve_result.append(item)
-    return filter_retrieve_result
+    return filter_retrieve_result(retrieve_result, score_threshold)
 
 
-def retrieve_results_from_opensearch(index_name, region_name, domain, opensearch_user, opensearch_password,
-                                     query_embedding, top_k=3, host='', port=443, profile_name=None):
-    opensearch_client = get_opensearch_cluster_client(domain, host, port, opensearch_user, opensearch_password, region_name)
-    search_query = {
+def build_knn_search_query(query_embedding, top_k, profile_name):
+    return {
         "size": top_k,  # Adjust the size as needed to retrieve more or fewer results
         "query": {
             "bool": {
@@ -258,6 +332,12 @@ def retrieve_results_from_opensearch(index_name, region_name, domain, opensearch
         }
     }
 
+
+def retrieve_results_from_opensearch(index_name, region_name, domain, opensearch_user, opensearch_password,
+                                     query_embedding, top_k=3, host='', port=443, profile_name=None):
+    opensearch_client = get_opensearch_cluster_client(domain, host, port, opensearch_user, opensearch_password, region_name)
+    search_query = build_knn_search_query(query_embedding, top_k, profile_name)
+
     # Execute the search query
     response = opensearch_client.search(
         body=search_query,
@@ -267,6 +347,60 @@ def retrieve_results_from_opensearch(index_name, region_name, domain, opensearch
     return response['hits']['hits']
 
 
+class RetrievalBatcher:
+    """
+    Collect the kNN lookups of one stage, or of several independent stages, and run them
+    in a single _msearch round trip. Query texts are embedded in one batched call through the
+    request embedding context, results are filtered by each lookup's score threshold and returned
+    in the order the lookups were added.
+    """
+
+    def __init__(self, opensearch_info, selected_profile, embedding_context=None):
+        self.opensearch_info = opensearch_info
+        self.selected_profile = selected_profile
+        if embedding_context is None:
+            from nlq.core.chat_context import RequestEmbeddingContext
+            embedding_context = RequestEmbeddingContext()
+        self.embedding_context = embedding_context
+        self._lookups = []
+
+    def add(self, query, search_type, top_k, score_threshold=0.7):
+        """
+        Register a lookup, return its position in the result list of execute()
+        """
+        self._lookups.append((query, search_type, top_k, score_threshold))
+        return len(self._lookups) - 1
+
+    def execute(self):
+        if len(self._lookups) == 0:
+            return []
+        self.embedding_context.prefetch([lookup[0] for lookup in self._lookups])
+        body = []
+        for query, search_type, top_k, _ in self._lookups:
+            index_name = get_retrieve_index_name(self.opensearch_info, search_type)
+            query_embedding = get_query_embedding(query, index_name, self.embedding_context)
+            body.append({'index': index_name})
+            body.append(build_knn_search_query(query_embedding, top_k, self.selected_profile))
+
+        opensearch_client = get_opensearch_cluster_client(self.opensearch_info['domain'], self.opensearch_info['host'],
+                                                          self.opensearch_info['port'],
+                                                          self.opensearch_info['username'],
+                                                          self.opensearch_info['password'],
+                                                          self.opensearch_info['region'])
+        response = opensearch_client.msearch(body=body)
+
+        results = []
+        for (query, search_type, _, score_threshold), item in zip(self._lookups, response['responses']):
+            if 'error' in item:
+                # 单个查询失败不影响同一批次的其他查询
+                logger.error(f"{search_type} retrieval failed for query {query}: {item['error']}")
+                results.append([])
+                continue
+            results.append(filter_retrieve_result(item['hits']['hits'], score_threshold))
+        self._lookups = []
+        return results
+
+
 def update_index_mapping(opensearch_client, index_name, dimension):
     """
     Create index mapping
@@ -362,19 +496,8 @@ def opensearch_index_init():
     :return:
     """
     try:
-        auth = (opensearch_info["username"], opensearch_info["password"])
-        host = opensearch_info["host"]
-        port = opensearch_info["port"]
-        # Create the client with SSL/TLS enabled, but hostname verification disabled.
-        opensearch_client = OpenSearch(
-            hosts=[{'host': host, 'port': port}],
-            http_compress=True,  # enables gzip compression for request bodies
-            http_auth=auth,
-            use_ssl=True,
-            verify_certs=False,
-            ssl_assert_hostname=False,
-            ssl_show_warn=False
-        )
+        opensearch_client = get_opensearch_client(opensearch_info["host"], opensearch_info["port"],
+                                                  opensearch_info["username"], opensearch_info["password"])
         index_list = [opensearch_info['sql_index'], opensearch_info['ner_index'], opensearch_info['agent_index']]
         dimension = opensearch_info['embedding_dimension']
         index_create_success = True
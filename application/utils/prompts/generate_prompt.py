@@ -1,5 +1,6 @@
-import copy
+import string
 
+from utils.cache import TTLCache
 from utils.logging import getLogger
 from utils.prompt import POSTGRES_DIALECT_PROMPT_CLAUDE3, MYSQL_DIALECT_PROMPT_CLAUDE3, \
     DEFAULT_DIALECT_PROMPT, AGENT_COT_EXAMPLE, AWS_REDSHIFT_DIALECT_PROMPT_CLAUDE3, STARROCKS_DIALECT_PROMPT_CLAUDE3, \
@@ -2603,51 +2604,207 @@ table_prompt_mapper = table_prompt.TablePromptMapper()
 guidance_prompt_mapper = guidance_prompt.GuidancePromptMapper()
 
 
-def generate_llm_prompt(ddl, hints, prompt_map, search_box, sql_examples=None, ner_example=None, model_id=None,
-                        dialect='mysql', environment_dict=None):
-    if environment_dict is None:
-        environment_dict = defaultdict(str)
-    else:
-        environment_dict = copy.deepcopy(environment_dict)
-    prompt_environment_replace = defaultdict(str)
-    for key in environment_dict:
+DIALECT_PROMPTS = {
+    'postgresql': POSTGRES_DIALECT_PROMPT_CLAUDE3,
+    'mysql': MYSQL_DIALECT_PROMPT_CLAUDE3,
+    'redshift': AWS_REDSHIFT_DIALECT_PROMPT_CLAUDE3,
+    'starrocks': STARROCKS_DIALECT_PROMPT_CLAUDE3,
+    'clickhouse': CLICKHOUSE_DIALECT_PROMPT_CLAUDE3,
+    'hive': HIVE_DIALECT_PROMPT_CLAUDE3,
+    'bigquery': BIGQUERY_DIALECT_PROMPT_CLAUDE3,
+    'sqlserver': SQLSERVER_DIALECT_PROMPT_CLAUDE3,
+}
+
+# model id prefixes removed before the prompt of the model is looked up in the prompt map
+MODEL_NAME_PREFIXES = ('sagemaker.', 'bedrock-api.', 'brclient-api.', 'bedrock-anthropic.', 'bedrock-api-model.')
+# the intent and query rewrite prompts remove bedrock-model. instead of bedrock-api-model.
+INTENT_MODEL_NAME_PREFIXES = ('sagemaker.', 'bedrock-api.', 'brclient-api.', 'bedrock-anthropic.', 'bedrock-model.')
+
+# prompt type: (fields filled per request, whether the system prompt is formatted too)
+PROMPT_REQUEST_FIELDS = {
+    'text2sql': (frozenset({'sql_schema', 'examples', 'ner_info', 'question'}), True),
+    'agent': (frozenset({'table_schema_data', 'example_data', 'question'}), True),
+    'intent': (frozenset({'question'}), False),
+    'query_rewrite': (frozenset({'chat_history', 'question'}), False),
+    'knowledge': (frozenset({'question'}), False),
+    'data_visualization': (frozenset({'question', 'data'}), False),
+    'agent_analyse': (frozenset({'question', 'data'}), False),
+    'data_summary': (frozenset({'question', 'data'}), False),
+    'suggestion': (frozenset({'question'}), False),
+}
+
+_formatter = string.Formatter()
+
+
+def normalize_model_name(model_id, prefixes=MODEL_NAME_PREFIXES):
+    """
+    The name of the model in the prompt map, e.g. bedrock-api.my-model -> my-model
+    """
+    name = support_model_ids_map.get(model_id, model_id)
+    for prefix in prefixes:
+        if name.startswith(prefix):
+            return name[len(prefix):]
+    return name
+
+
+def normalize_environment(environment_dict):
+    """
+    The prompt environment of a profile as format values, {key} and key are the same placeholder
+    """
+    environment = defaultdict(str)
+    for key, value in (environment_dict or {}).items():
         if key.startswith("{") and key.endswith("}"):
-            replace_key = key[1:-1]
-            prompt_environment_replace[replace_key] = environment_dict[key]
+            environment[key[1:-1]] = value
         else:
-            prompt_environment_replace[key] = environment_dict[key]
-    environment_dict = prompt_environment_replace
-    long_string = ""
-    for table_name, table_data in ddl.items():
-        ddl_string = table_data["col_a"] if 'col_a' in table_data else table_data["ddl"]
-        long_string += "{}: {}\n".format(table_name, table_data["tbl_a"] if 'tbl_a' in table_data else table_data[
-            "description"])
-        long_string += ddl_string
-        long_string += "\n \n"
+            environment[key] = value
+    return environment
+
+
+def render_table_schema(table_name, table_data):
+    ddl_string = table_data["col_a"] if 'col_a' in table_data else table_data["ddl"]
+    return "{}: {}\n".format(table_name, table_data["tbl_a"] if 'tbl_a' in table_data else table_data[
+        "description"]) + ddl_string
+
+
+def render_schema_block(tables_info, separator="\n \n"):
+    return "".join(render_table_schema(table_name, table_data) + separator
+                   for table_name, table_data in tables_info.items())
+
+
+class CompiledTemplate:
+    """
+    A prompt template with the static fields already substituted, as a list of (is request field, text) pieces.
+    Templates str.format_map can not split (format specs, attribute or index fields) are kept as they are
+    and formatted in full on every render.
+    """
+
+    def __init__(self, template, static_values, request_fields):
+        self.template = template
+        self.static_values = static_values
+        self.pieces = None
+        try:
+            pieces = []
+            for literal, field_name, format_spec, conversion in _formatter.parse(template):
+                if literal:
+                    if pieces and not pieces[-1][0]:
+                        pieces[-1] = (False, pieces[-1][1] + literal)
+                    else:
+                        pieces.append((False, literal))
+                if field_name is None:
+                    continue
+                if format_spec or conversion or not field_name.isidentifier():
+                    return
+                if field_name in request_fields:
+                    pieces.append((True, field_name))
+                else:
+                    value = format(static_values[field_name])
+                    if pieces and not pieces[-1][0]:
+                        pieces[-1] = (False, pieces[-1][1] + value)
+                    else:
+                        pieces.append((False, value))
+            self.pieces = pieces
+        except ValueError:
+            # unbalanced braces, format_map raises the same error on render
+            self.pieces = None
+
+    def render(self, values):
+        if self.pieces is None:
+            environment = defaultdict(str, self.static_values)
+            environment.update(values)
+            return self.template.format_map(environment)
+        return ''.join(format(values.get(text, '')) if is_field else text for is_field, text in self.pieces)
+
+
+class CompiledPrompt:
+    """
+    The system and user prompt of one prompt type and model, compiled for the prompt map and environment
+    of a profile
+    """
+
+    def __init__(self, prompt_type, prompt_map, model_id, environment_dict, dialect):
+        self.prompt_map = prompt_map
+        self.environment_dict = environment_dict
+        prefixes = INTENT_MODEL_NAME_PREFIXES if prompt_type in ('intent', 'query_rewrite') else MODEL_NAME_PREFIXES
+        self.name = normalize_model_name(model_id, prefixes)
+        self.system_prompt = prompt_map.get(prompt_type, {}).get('system_prompt', {}).get(self.name)
+        self.user_prompt = prompt_map.get(prompt_type, {}).get('user_prompt', {}).get(self.name)
+
+        static_values = normalize_environment(environment_dict)
+        if prompt_type == 'text2sql':
+            static_values["dialect_prompt"] = DIALECT_PROMPTS.get(dialect, DEFAULT_DIALECT_PROMPT)
+            static_values["sql_guidance"] = guidance_prompt_mapper.get_variable(self.name)
+            static_values["dialect"] = "Amazon Redshift" if dialect == "redshift" else dialect
+            self.default_schema = table_prompt_mapper.get_variable(self.name)
+        elif prompt_type == 'agent':
+            static_values["sql_guidance"] = ""
+        request_fields, format_system_prompt = PROMPT_REQUEST_FIELDS[prompt_type]
+        self.user_template = CompiledTemplate(self.user_prompt, static_values, request_fields) \
+            if self.user_prompt is not None else None
+        self.system_template = CompiledTemplate(self.system_prompt, static_values, request_fields) \
+            if format_system_prompt and self.system_prompt is not None else None
+
+    def render_user(self, **values):
+        return self.user_template.render(values)
+
+    def render_system(self, **values):
+        if self.system_template is None:
+            return self.system_prompt
+        return self.system_template.render(values)
+
+
+class PromptCompiler:
+    """
+    Compiled prompts per (prompt type, model, dialect) of a profile: the model name, the environment
+    substitutions, the dialect prompt and guidance are resolved once, a request only fills in the question,
+    examples and data.
+
+    The prompt map, environment and table entries of a profile are shared objects of the profile cache, so the
+    compiled prompts and table DDL texts are keyed by object identity. An entry keeps a reference to its objects
+    and is only used for the very same objects. ProfileManagement drops all entries when a profile is written.
+    The DDL text is cached per table, schema linking selects a different subset of the same table entries
+    for every question and the block is joined per request.
+    """
+    prompt_cache = TTLCache('compiled_prompt', ttl=3600, max_size=1024)
+    schema_cache = TTLCache('prompt_schema', ttl=3600, max_size=8192)
+
+    @classmethod
+    def get_prompt(cls, prompt_type, prompt_map, model_id, environment_dict=None, dialect=None):
+        key = (prompt_type, model_id, dialect, id(prompt_map), id(environment_dict))
+        compiled = cls.prompt_cache.get(key)
+        if compiled is None or compiled.prompt_map is not prompt_map or compiled.environment_dict is not environment_dict:
+            compiled = CompiledPrompt(prompt_type, prompt_map, model_id, environment_dict, dialect)
+            cls.prompt_cache.put(key, compiled)
+        return compiled
+
+    @classmethod
+    def get_table_schema(cls, table_name, table_data):
+        key = (table_name, id(table_data))
+        cached = cls.schema_cache.get(key)
+        if cached is None or cached[0] is not table_data:
+            cached = (table_data, render_table_schema(table_name, table_data))
+            cls.schema_cache.put(key, cached)
+        return cached[1]
+
+    @classmethod
+    def get_schema_block(cls, tables_info, separator="\n \n"):
+        return "".join(cls.get_table_schema(table_name, table_data) + separator
+                       for table_name, table_data in tables_info.items())
+
+    @classmethod
+    def invalidate(cls):
+        cls.prompt_cache.invalidate()
+        cls.schema_cache.invalidate()
+
+
+def generate_llm_prompt(ddl, hints, prompt_map, search_box, sql_examples=None, ner_example=None, model_id=None,
+                        dialect='mysql', environment_dict=None):
+    long_string = PromptCompiler.get_schema_block(ddl)
 
     # trying CREATE TABLE ddl
     # long_string = generate_create_table_ddl(long_string)
-    ddl = long_string
 
     logger.info(f'{dialect=}')
-    if dialect == 'postgresql':
-        dialect_prompt = POSTGRES_DIALECT_PROMPT_CLAUDE3
-    elif dialect == 'mysql':
-        dialect_prompt = MYSQL_DIALECT_PROMPT_CLAUDE3
-    elif dialect == 'redshift':
-        dialect_prompt = AWS_REDSHIFT_DIALECT_PROMPT_CLAUDE3
-    elif dialect == 'starrocks':
-        dialect_prompt = STARROCKS_DIALECT_PROMPT_CLAUDE3
-    elif dialect == 'clickhouse':
-        dialect_prompt = CLICKHOUSE_DIALECT_PROMPT_CLAUDE3
-    elif dialect == 'hive':
-        dialect_prompt = HIVE_DIALECT_PROMPT_CLAUDE3
-    elif dialect == 'bigquery':
-        dialect_prompt = BIGQUERY_DIALECT_PROMPT_CLAUDE3
-    elif dialect == 'sqlserver':
-        dialect_prompt = SQLSERVER_DIALECT_PROMPT_CLAUDE3
-    else:
-        dialect_prompt = DEFAULT_DIALECT_PROMPT
+    compiled = PromptCompiler.get_prompt('text2sql', prompt_map, model_id, environment_dict, dialect)
 
     example_sql_prompt = ""
     example_ner_prompt = ""
@@ -2661,72 +2818,24 @@ def generate_llm_prompt(ddl, hints, prompt_map, search_box, sql_examples=None, n
             example_ner_prompt += "ner: " + item['_source']['entity'] + "\n"
             example_ner_prompt += "ner info:" + item['_source']['comment'] + "\n"
 
-    name = support_model_ids_map.get(model_id, model_id)
-    if name.startswith("sagemaker."):
-        name = name[10:]
-    elif name.startswith("bedrock-api."):
-        name = name[12:]
-    elif name.startswith("brclient-api."):
-        name = name[13:]
-    elif name.startswith("bedrock-anthropic."):
-        name = name[18:]
-    elif name.startswith("bedrock-api-model."):
-        name = name[18:]
-    system_prompt = prompt_map.get('text2sql', {}).get('system_prompt', {}).get(name)
-    user_prompt = prompt_map.get('text2sql', {}).get('user_prompt', {}).get(name)
     if long_string == '':
-        table_prompt = table_prompt_mapper.get_variable(name)
+        table_prompt = compiled.default_schema
     else:
         table_prompt = long_string
-    guidance_prompt = guidance_prompt_mapper.get_variable(name)
-
-    environment_dict["dialect_prompt"] = dialect_prompt
-    environment_dict["sql_schema"] = table_prompt
-    environment_dict["sql_guidance"] = guidance_prompt
-    environment_dict["examples"] = example_sql_prompt
-    environment_dict["ner_info"] = example_ner_prompt
-    environment_dict["question"] = search_box
 
-
-    if dialect == "redshift":
-        environment_dict["dialect"] = "Amazon Redshift"
-        system_prompt = system_prompt.format_map(environment_dict)
-    else:
-        environment_dict["dialect"] = dialect
-        system_prompt = system_prompt.format_map(environment_dict)
-
-    user_prompt = user_prompt.format_map(environment_dict)
-
-    # user_prompt = user_prompt.format(dialect_prompt=dialect_prompt, sql_schema=table_prompt,
-    #                                  sql_guidance=guidance_prompt, examples=example_sql_prompt,
-    #                                  ner_info=example_ner_prompt, question=search_box)
+    request_values = {
+        "sql_schema": table_prompt,
+        "examples": example_sql_prompt,
+        "ner_info": example_ner_prompt,
+        "question": search_box,
+    }
+    system_prompt = compiled.render_system(**request_values)
+    user_prompt = compiled.render_user(**request_values)
 
     return user_prompt, system_prompt
 
 def generate_agent_cot_system_prompt(ddl, prompt_map, search_box, model_id, agent_cot_example=None, environment_dict=None):
-    if environment_dict is None:
-        environment_dict = defaultdict(str)
-    else:
-        environment_dict = copy.deepcopy(environment_dict)
-    prompt_environment_replace = defaultdict(str)
-    for key in environment_dict:
-        if key.startswith("{") and key.endswith("}"):
-            replace_key = key[1:-1]
-            prompt_environment_replace[replace_key] = environment_dict[key]
-        else:
-            prompt_environment_replace[key] = environment_dict[key]
-    environment_dict = prompt_environment_replace
-    long_string = ""
-    for table_name, table_data in ddl.items():
-        ddl_string = table_data["col_a"] if 'col_a' in table_data else table_data["ddl"]
-        long_string += "{}: {}\n".format(table_name, table_data["tbl_a"] if 'tbl_a' in table_data else table_data[
-            "description"])
-        long_string += ddl_string
-        long_string += "\n"
-
-    # trying CREATE TABLE ddl
-    # long_string = generate_create_table_ddl(long_string)
-    ddl = long_string
+    ddl = PromptCompiler.get_schema_block(ddl, "\n")
 
     agent_cot_example_str = ""
     if agent_cot_example:
@@ -2735,38 +2844,17 @@ def generate_agent_cot_system_prompt(ddl, prompt_map, search_box, model_id, agen
             agent_cot_example_str += "train of thought:" + item['_source']['comment'] + "\n"
 
     # fetch system/user prompt from DynamoDB prompt map
-    name = support_model_ids_map.get(model_id, model_id)
-    if name.startswith("sagemaker."):
-        name = name[10:]
-    elif name.startswith("bedrock-api."):
-        name = name[12:]
-    elif name.startswith("brclient-api."):
-        name = name[13:]
-    elif name.startswith("bedrock-anthropic."):
-        name = name[18:]
-    elif name.startswith("bedrock-api-model."):
-        name = name[18:]
-
-    system_prompt = prompt_map.get('agent', {}).get('system_prompt', {}).get(name)
-    user_prompt = prompt_map.get('agent', {}).get('user_prompt', {}).get(name)
-
-    environment_dict["table_schema_data"] = ddl
-    environment_dict["sql_guidance"] = ""
-    environment_dict["question"] = search_box
+    compiled = PromptCompiler.get_prompt('agent', prompt_map, model_id, environment_dict)
 
     # reformat prompts
-    if agent_cot_example_str != "":
-        environment_dict["example_data"] = agent_cot_example_str
-        system_prompt = system_prompt.format_map(environment_dict)
-        # system_prompt = system_prompt.format(table_schema_data=ddl, sql_guidance="",
-        #                                      example_data=agent_cot_example_str)
-    else:
-        environment_dict["example_data"] = AGENT_COT_EXAMPLE
-        system_prompt = system_prompt.format_map(environment_dict)
-        # system_prompt = system_prompt.format(table_schema_data=ddl, sql_guidance="",
-        #                                      example_data=AGENT_COT_EXAMPLE)
+    request_values = {
+        "table_schema_data": ddl,
+        "example_data": agent_cot_example_str if agent_cot_example_str != "" else AGENT_COT_EXAMPLE,
+        "question": search_box,
+    }
+    system_prompt = compiled.render_system(**request_values)
 
-    user_prompt = user_prompt.format_map(environment_dict)
+    user_prompt = compiled.render_user(**request_values)
     user_prompt = user_prompt.format(question=search_box)
 
     return user_prompt, system_prompt
@@ -2806,267 +2894,58 @@ def generate_agent_cot_system_prompt(ddl, prompt_map, search_box, model_id, agen
 #     return user_prompt, system_prompt
 
 def generate_intent_prompt(prompt_map, search_box, model_id, environment_dict=None):
-    if environment_dict is None:
-        environment_dict = defaultdict(str)
-    else:
-        environment_dict = copy.deepcopy(environment_dict)
-    prompt_environment_replace = defaultdict(str)
-    for key in environment_dict:
-        if key.startswith("{") and key.endswith("}"):
-            replace_key = key[1:-1]
-            prompt_environment_replace[replace_key] = environment_dict[key]
-        else:
-            prompt_environment_replace[key] = environment_dict[key]
-    environment_dict = prompt_environment_replace
-    name = support_model_ids_map.get(model_id, model_id)
-    if name.startswith("sagemaker."):
-        name = name[10:]
-    elif name.startswith("bedrock-api."):
-        name = name[12:]
-    elif name.startswith("brclient-api."):
-        name = name[13:]
-    elif name.startswith("bedrock-anthropic."):
-        name = name[18:]
-    elif name.startswith("bedrock-model."):
-        name = name[14:]
-
-    # 获取提示模板
-    system_prompt = prompt_map.get('intent', {}).get('system_prompt', {}).get(name)
-    user_prompt = prompt_map.get('intent', {}).get('user_prompt', {}).get(name)
-    
+    compiled = PromptCompiler.get_prompt('intent', prompt_map, model_id, environment_dict)
+    system_prompt = compiled.system_prompt
+
     # 添加检查，确保提示不为None
     if system_prompt is None:
-        logger.warning(f"No system prompt found for model {model_id} (name: {name}), using default")
+        logger.warning(f"No system prompt found for model {model_id} (name: {compiled.name}), using default")
         system_prompt = "You are an intent classifier. Classify the intent of the query."
-        
-    if user_prompt is None:
-        logger.warning(f"No user prompt found for model {model_id} (name: {name}), using default")
-        user_prompt = "Classify the intent of this query: {question}"
-    
-    # 设置环境变量
-    environment_dict["question"] = search_box
-    
-    # 使用format_map格式化提示（添加try-except以防万一）
+
+    if compiled.user_template is None:
+        logger.warning(f"No user prompt found for model {model_id} (name: {compiled.name}), using default")
+        return "Classify the intent of this query: {question}".format(question=search_box), system_prompt
+
+    # 使用预编译的模板格式化提示（添加try-except以防万一）
     try:
-        user_prompt = user_prompt.format_map(environment_dict)
+        user_prompt = compiled.render_user(question=search_box)
     except Exception as e:
         logger.error(f"Error formatting user_prompt: {e}")
         user_prompt = f"Classify the intent of this query: {search_box}"
-    
+
     return user_prompt, system_prompt
 
 def generate_query_rewrite_prompt(prompt_map, search_box, model_id, history_query, environment_dict=None):
-    if environment_dict is None:
-        environment_dict = defaultdict(str)
-    else:
-        environment_dict = copy.deepcopy(environment_dict)
-    prompt_environment_replace = defaultdict(str)
-    for key in environment_dict:
-        if key.startswith("{") and key.endswith("}"):
-            replace_key = key[1:-1]
-            prompt_environment_replace[replace_key] = environment_dict[key]
-        else:
-            prompt_environment_replace[key] = environment_dict[key]
-    environment_dict = prompt_environment_replace
-    name = support_model_ids_map.get(model_id, model_id)
-    if name.startswith("sagemaker."):
-        name = name[10:]
-    elif name.startswith("bedrock-api."):
-        name = name[12:]
-    elif name.startswith("brclient-api."):
-        name = name[13:]
-    elif name.startswith("bedrock-anthropic."):
-        name = name[18:]
-    elif name.startswith("bedrock-model."):
-        name = name[14:]
-
-    system_prompt = prompt_map.get('query_rewrite', {}).get('system_prompt', {}).get(name)
-    user_prompt = prompt_map.get('query_rewrite', {}).get('user_prompt', {}).get(name)
-
-    environment_dict["chat_history"] = history_query
-    environment_dict["question"] = search_box
-
-    user_prompt = user_prompt.format_map(environment_dict)
-
-    # user_prompt = user_prompt.format(chat_history=history_query, question=search_box)
-    return user_prompt, system_prompt
+    compiled = PromptCompiler.get_prompt('query_rewrite', prompt_map, model_id, environment_dict)
+    user_prompt = compiled.render_user(chat_history=history_query, question=search_box)
+    return user_prompt, compiled.system_prompt
 
 
 def generate_knowledge_prompt(prompt_map, search_box, model_id, environment_dict=None):
-    if environment_dict is None:
-        environment_dict = defaultdict(str)
-    else:
-        environment_dict = copy.deepcopy(environment_dict)
-    prompt_environment_replace = defaultdict(str)
-    for key in environment_dict:
-        if key.startswith("{") and key.endswith("}"):
-            replace_key = key[1:-1]
-            prompt_environment_replace[replace_key] = environment_dict[key]
-        else:
-            prompt_environment_replace[key] = environment_dict[key]
-    environment_dict = prompt_environment_replace
-    name = support_model_ids_map.get(model_id, model_id)
-    if name.startswith("sagemaker."):
-        name = name[10:]
-    elif name.startswith("bedrock-api."):
-        name = name[12:]
-    elif name.startswith("brclient-api."):
-        name = name[13:]
-    elif name.startswith("bedrock-anthropic."):
-        name = name[18:]
-    elif name.startswith("bedrock-api-model."):
-        name = name[18:]
-
-    system_prompt = prompt_map.get('knowledge', {}).get('system_prompt', {}).get(name)
-    user_prompt = prompt_map.get('knowledge', {}).get('user_prompt', {}).get(name)
-
-    environment_dict["question"] = search_box
-
-    user_prompt = user_prompt.format_map(environment_dict)
-    # user_prompt = user_prompt.format(question=search_box)
-    return user_prompt, system_prompt
+    compiled = PromptCompiler.get_prompt('knowledge', prompt_map, model_id, environment_dict)
+    user_prompt = compiled.render_user(question=search_box)
+    return user_prompt, compiled.system_prompt
 
 
 def generate_data_visualization_prompt(prompt_map, search_box, search_data, model_id, environment_dict=None):
-    if environment_dict is None:
-        environment_dict = defaultdict(str)
-    else:
-        environment_dict = copy.deepcopy(environment_dict)
-    prompt_environment_replace = defaultdict(str)
-    for key in environment_dict:
-        if key.startswith("{") and key.endswith("}"):
-            replace_key = key[1:-1]
-            prompt_environment_replace[replace_key] = environment_dict[key]
-        else:
-            prompt_environment_replace[key] = environment_dict[key]
-    environment_dict = prompt_environment_replace
-    name = support_model_ids_map.get(model_id, model_id)
-    if name.startswith("sagemaker."):
-        name = name[10:]
-    elif name.startswith("bedrock-api."):
-        name = name[12:]
-    elif name.startswith("brclient-api."):
-        name = name[13:]
-    elif name.startswith("bedrock-anthropic."):
-        name = name[18:]
-    elif name.startswith("bedrock-api-model."):
-        name = name[18:]
-
-    system_prompt = prompt_map.get('data_visualization', {}).get('system_prompt', {}).get(name)
-    user_prompt = prompt_map.get('data_visualization', {}).get('user_prompt', {}).get(name)
-
-    environment_dict["question"] = search_box
-    environment_dict["data"] = search_data
-    user_prompt = user_prompt.format_map(environment_dict)
-
-    # user_prompt = user_prompt.format(question=search_box, data=search_data)
-
-    return user_prompt, system_prompt
+    compiled = PromptCompiler.get_prompt('data_visualization', prompt_map, model_id, environment_dict)
+    user_prompt = compiled.render_user(question=search_box, data=search_data)
+    return user_prompt, compiled.system_prompt
 
 
 def generate_agent_analyse_prompt(prompt_map, search_box, model_id, sql_data, environment_dict=None):
-    if environment_dict is None:
-        environment_dict = defaultdict(str)
-    else:
-        environment_dict = copy.deepcopy(environment_dict)
-    prompt_environment_replace = defaultdict(str)
-    for key in environment_dict:
-        if key.startswith("{") and key.endswith("}"):
-            replace_key = key[1:-1]
-            prompt_environment_replace[replace_key] = environment_dict[key]
-        else:
-            prompt_environment_replace[key] = environment_dict[key]
-    environment_dict = prompt_environment_replace
-    name = support_model_ids_map.get(model_id, model_id)
-    if name.startswith("sagemaker."):
-        name = name[10:]
-    elif name.startswith("bedrock-api."):
-        name = name[12:]
-    elif name.startswith("brclient-api."):
-        name = name[13:]
-    elif name.startswith("bedrock-anthropic."):
-        name = name[18:]
-    elif name.startswith("bedrock-api-model."):
-        name = name[18:]
-
-    system_prompt = prompt_map.get('agent_analyse', {}).get('system_prompt', {}).get(name)
-    user_prompt = prompt_map.get('agent_analyse', {}).get('user_prompt', {}).get(name)
-
-    environment_dict["question"] = search_box
-    environment_dict["data"] = sql_data
-
-    user_prompt = user_prompt.format_map(environment_dict)
-    # user_prompt = user_prompt.format(question=search_box, data=sql_data)
-
-    return user_prompt, system_prompt
+    compiled = PromptCompiler.get_prompt('agent_analyse', prompt_map, model_id, environment_dict)
+    user_prompt = compiled.render_user(question=search_box, data=sql_data)
+    return user_prompt, compiled.system_prompt
 
 
 def generate_data_summary_prompt(prompt_map, search_box, model_id, sql_data, environment_dict=None):
-    if environment_dict is None:
-        environment_dict = defaultdict(str)
-    else:
-        environment_dict = copy.deepcopy(environment_dict)
-    prompt_environment_replace = defaultdict(str)
-    for key in environment_dict:
-        if key.startswith("{") and key.endswith("}"):
-            replace_key = key[1:-1]
-            prompt_environment_replace[replace_key] = environment_dict[key]
-        else:
-            prompt_environment_replace[key] = environment_dict[key]
-    environment_dict = prompt_environment_replace
-    name = support_model_ids_map.get(model_id, model_id)
-    if name.startswith("sagemaker."):
-        name = name[10:]
-    elif name.startswith("bedrock-api."):
-        name = name[12:]
-    elif name.startswith("brclient-api."):
-        name = name[13:]
-    elif name.startswith("bedrock-anthropic."):
-        name = name[18:]
-    elif name.startswith("bedrock-api-model."):
-        name = name[18:]
-
-    system_prompt = prompt_map.get('data_summary', {}).get('system_prompt', {}).get(name)
-    user_prompt = prompt_map.get('data_summary', {}).get('user_prompt', {}).get(name)
-
-    environment_dict["question"] = search_box
-    environment_dict["data"] = sql_data
-    user_prompt = user_prompt.format_map(environment_dict)
-    # user_prompt = user_prompt.format(question=search_box, data=sql_data)
-
-    return user_prompt, system_prompt
+    compiled = PromptCompiler.get_prompt('data_summary', prompt_map, model_id, environment_dict)
+    user_prompt = compiled.render_user(question=search_box, data=sql_data)
+    return user_prompt, compiled.system_prompt
 
 
 def generate_suggest_question_prompt(prompt_map, search_box, model_id, environment_dict=None):
-    if environment_dict is None:
-        environment_dict = defaultdict(str)
-    else:
-        environment_dict = copy.deepcopy(environment_dict)
-    prompt_environment_replace = defaultdict(str)
-    for key in environment_dict:
-        if key.startswith("{") and key.endswith("}"):
-            replace_key = key[1:-1]
-            prompt_environment_replace[replace_key] = environment_dict[key]
-        else:
-            prompt_environment_replace[key] = environment_dict[key]
-    environment_dict = prompt_environment_replace
-    name = support_model_ids_map.get(model_id, model_id)
-    if name.startswith("sagemaker."):
-        name = name[10:]
-    elif name.startswith("bedrock-api."):
-        name = name[12:]
-    elif name.startswith("brclient-api."):
-        name = name[13:]
-    elif name.startswith("bedrock-anthropic."):
-        name = name[18:]
-    elif name.startswith("bedrock-api-model."):
-        name = name[18:]
-
-    system_prompt = prompt_map.get('suggestion', {}).get('system_prompt', {}).get(name)
-    user_prompt = prompt_map.get('suggestion', {}).get('user_prompt', {}).get(name)
-
-    environment_dict["question"] = search_box
-    user_prompt = user_prompt.format_map(environment_dict)
-    # user_prompt = user_prompt.format(question=search_box)
-
-    return user_prompt, system_prompt
+    compiled = PromptCompiler.get_prompt('suggestion', prompt_map, model_id, environment_dict)
+    user_prompt = compiled.render_user(question=search_box)
+    return user_prompt, compiled.system_prompt
@@ -0,0 +1,226 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event, text
+
+from utils.logging import getLogger
+from utils.query_settings import get_profile_query_setting
+
+logger = getLogger()
+
+# 生成的 SQL 的默认执行超时（秒）, 可以通过 PROFILE_QUERY_SETTINGS 的 statement_timeout 按 profile 覆盖, 0 表示不限制
+SQL_STATEMENT_TIMEOUT = int(os.getenv('SQL_STATEMENT_TIMEOUT', '120'))
+# 一个问题从收到到结束的最长时间（秒）, 超过后正在执行的 SQL 会被取消
+REQUEST_DEADLINE_SECONDS = int(os.getenv('REQUEST_DEADLINE_SECONDS', '600'))
+# 数据库自己的超时之后, 再等待这么久才从客户端取消
+SQL_CANCEL_GRACE_SECONDS = float(os.getenv('SQL_CANCEL_GRACE_SECONDS', '5'))
+_WATCHDOG_INTERVAL = 0.5
+
+# error messages of the database side statement timeouts
+_TIMEOUT_ERROR_PATTERNS = (
+    'maximum statement execution time exceeded',
+    'statement timeout',
+    'timeout_exceeded',
+    'timeout exceeded',
+    'query_timeout',
+)
+
+
+class QueryTimeoutError(Exception):
+    """
+    The SQL ran longer than its statement timeout and was cancelled, the message is written for the
+    auto correction prompt
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        super().__init__(
+            f"Query timeout: the SQL was cancelled after running longer than the {int(timeout)} second limit. "
+            f"Rewrite it to read less data, e.g. filter on partition or date columns, avoid cross joins "
+            f"and aggregate before joining large tables.")
+
+
+class QueryCancelledError(Exception):
+    """
+    The SQL was cancelled because the request went away (client disconnected or request deadline expired)
+    """
+
+
+class CancelToken:
+    """
+    Cancellation state of one request, shared by every SQL it runs.
+    A token with a parent, e.g. the token of one sub-task of the request, is also cancelled with its parent.
+    """
+
+    def __init__(self, deadline_seconds=REQUEST_DEADLINE_SECONDS, parent=None):
+        self.deadline = time.time() + deadline_seconds if deadline_seconds > 0 else None
+        self.parent = parent
+        self.reason = ''
+        self._event = threading.Event()
+
+    def cancel(self, reason='cancelled'):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+            logger.info(f"Request cancelled: {reason}")
+
+    def is_cancelled(self):
+        if not self._event.is_set() and self.deadline is not None and time.time() >= self.deadline:
+            self.cancel('request deadline expired')
+        if not self._event.is_set() and self.parent is not None and self.parent.is_cancelled():
+            self.cancel(self.parent.reason)
+        return self._event.is_set()
+
+    def remaining(self):
+        """
+        Seconds left before the request deadline, None when there is no deadline
+        """
+        remaining = [max(0.0, self.deadline - time.time())] if self.deadline is not None else []
+        parent_remaining = self.parent.remaining() if self.parent is not None else None
+        if parent_remaining is not None:
+            remaining.append(parent_remaining)
+        return min(remaining) if remaining else None
+
+
+def get_statement_timeout(profile_name):
+    return int(get_profile_query_setting(profile_name, 'statement_timeout', SQL_STATEMENT_TIMEOUT))
+
+
+def _get_dbapi_connection(connection):
+    fairy = connection.connection
+    return getattr(fairy, 'dbapi_connection', None) or fairy.connection
+
+
+class QueryGovernor:
+    """
+    Applies the statement timeout of the dialect to one SQL and cancels it on the server
+    when it runs past the timeout or the request is cancelled:
+
+    - mysql: SET SESSION max_execution_time, KILL QUERY from another pooled connection
+    - starrocks: SET query_timeout, KILL QUERY from another pooled connection
+    - postgresql / redshift: SET statement_timeout, cancel() of the psycopg2 connection
+    - clickhouse: SETTINGS max_execution_time appended to the SQL
+    - athena (StopQueryExecution), hive, presto: cancel() of the DB-API cursor
+    """
+
+    def __init__(self, db_type, timeout, cancel_token=None):
+        self.db_type = db_type
+        self.timeout = timeout
+        self.cancel_token = cancel_token
+        self.timed_out = False
+        self.cancelled = False
+        self._cursor = None
+        self._effective_timeout = None
+        self._done = threading.Event()
+
+    def effective_timeout(self):
+        timeouts = [each for each in [self.timeout if self.timeout > 0 else None,
+                                      self.cancel_token.remaining() if self.cancel_token is not None else None]
+                    if each is not None]
+        return min(timeouts) if timeouts else None
+
+    def _prepare(self, connection, sql, timeout):
+        if timeout is None:
+            return sql
+        timeout_ms = max(1, int(timeout * 1000))
+        if self.db_type in ('mysql', 'starrocks'):
+            # MariaDB and old MySQL versions do not have the variable, the watchdog still cancels the query
+            try:
+                if self.db_type == 'mysql':
+                    connection.execute(text(f"SET SESSION max_execution_time = {timeout_ms}"))
+                else:
+                    connection.execute(text(f"SET query_timeout = {max(1, int(timeout))}"))
+            except Exception as e:
+                logger.warning(f"Failed to set the {self.db_type} statement timeout: {e}")
+        elif self.db_type in ('postgresql', 'redshift'):
+            # rolled back together with the transaction when the connection goes back to the pool
+            connection.execute(text(f"SET statement_timeout = {timeout_ms}"))
+        elif self.db_type == 'clickhouse' and 'settings' not in sql.lower():
+            sql = f"{sql.strip().rstrip(';')} SETTINGS max_execution_time = {max(1, int(timeout))}"
+        return sql
+
+    def _reset(self, connection):
+        if self.db_type == 'mysql':
+            try:
+                connection.execute(text("SET SESSION max_execution_time = 0"))
+            except Exception as e:
+                logger.warning(f"Failed to reset max_execution_time: {e}")
+
+    def _capture_cursor(self, conn, cursor, statement, parameters, context, executemany):
+        self._cursor = cursor
+
+    def _cancel_on_server(self, connection):
+        try:
+            if self.db_type in ('mysql', 'starrocks'):
+                thread_id = _get_dbapi_connection(connection).thread_id()
+                with connection.engine.connect() as kill_connection:
+                    kill_connection.execute(text(f"KILL QUERY {int(thread_id)}"))
+            elif self.db_type in ('postgresql', 'redshift'):
+                _get_dbapi_connection(connection).cancel()
+            elif self._cursor is not None and hasattr(self._cursor, 'cancel'):
+                self._cursor.cancel()
+            else:
+                logger.warning(f"Can not cancel a running {self.db_type} query on the server")
+        except Exception as e:
+            logger.error(f"Failed to cancel the running query: {e}")
+
+    def _watch(self, connection, timeout):
+        # dialects enforcing the timeout themselves get a grace period before the client cancels
+        grace = SQL_CANCEL_GRACE_SECONDS if self.db_type in ('mysql', 'starrocks', 'postgresql', 'redshift',
+                                                              'clickhouse') else 0
+        timeout_at = time.time() + timeout + grace if timeout is not None and self.timeout > 0 else None
+        while not self._done.wait(_WATCHDOG_INTERVAL):
+            if self.cancel_token is not None and self.cancel_token.is_cancelled():
+                self.cancelled = True
+            elif timeout_at is not None and time.time() >= timeout_at:
+                self.timed_out = True
+            else:
+                continue
+            logger.warning(f"Cancelling the running {self.db_type} query, "
+                           f"{'request cancelled' if self.cancelled else 'statement timeout'}")
+            self._cancel_on_server(connection)
+            return
+
+    def _translate_error(self, error):
+        if self.cancelled:
+            return QueryCancelledError(f"The query was cancelled: {self.cancel_token.reason}")
+        if self.timed_out or any(pattern in str(error).lower() for pattern in _TIMEOUT_ERROR_PATTERNS):
+            return QueryTimeoutError(self._effective_timeout or self.timeout)
+        return None
+
+    @contextmanager
+    def govern(self, connection, sql):
+        """
+        Yield the SQL to execute on the connection, a timed out or cancelled execution inside the block
+        raises QueryTimeoutError / QueryCancelledError
+        """
+        if self.cancel_token is not None and self.cancel_token.is_cancelled():
+            raise QueryCancelledError(f"The query was cancelled: {self.cancel_token.reason}")
+        timeout = self.effective_timeout()
+        self._effective_timeout = timeout
+        self.timed_out = False
+        self._cursor = None
+        self._done = threading.Event()
+        event.listen(connection, 'before_cursor_execute', self._capture_cursor)
+        watchdog = None
+        try:
+            governed_sql = self._prepare(connection, sql, timeout)
+            if timeout is not None or self.cancel_token is not None:
+                watchdog = threading.Thread(target=self._watch, args=(connection, timeout),
+                                            name='query-watchdog', daemon=True)
+                watchdog.start()
+            try:
+                yield governed_sql
+            except Exception as e:
+                translated_error = self._translate_error(e)
+                if translated_error is not None:
+                    raise translated_error from e
+                raise
+        finally:
+            self._done.set()
+            if watchdog is not None:
+                watchdog.join()
+            self._reset(connection)
+            event.remove(connection, 'before_cursor_execute', self._capture_cursor)
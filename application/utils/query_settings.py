@@ -0,0 +1,33 @@
+import json
+import os
+
+from utils.logging import getLogger
+
+logger = getLogger()
+
+# 按 profile 覆盖查询执行相关的配置, 例如 {"my_profile": {"result_cache_ttl": 60}}
+PROFILE_QUERY_SETTINGS = os.getenv('PROFILE_QUERY_SETTINGS', '')
+
+
+def _load_profile_query_settings(raw_settings):
+    if not raw_settings:
+        return {}
+    try:
+        settings = json.loads(raw_settings)
+    except ValueError as e:
+        logger.error(f"Invalid PROFILE_QUERY_SETTINGS, the defaults are used: {e}")
+        return {}
+    if not isinstance(settings, dict):
+        logger.error("PROFILE_QUERY_SETTINGS must be a JSON object keyed by profile name, the defaults are used")
+        return {}
+    return {profile_name: value for profile_name, value in settings.items() if isinstance(value, dict)}
+
+
+_profile_query_settings = _load_profile_query_settings(PROFILE_QUERY_SETTINGS)
+
+
+def get_profile_query_setting(profile_name, key, default):
+    """
+    Return the PROFILE_QUERY_SETTINGS value of the profile, or the default when the profile does not override it
+    """
+    return _profile_query_settings.get(profile_name or '', {}).get(key, default)
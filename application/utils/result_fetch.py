@@ -0,0 +1,90 @@
+import os
+
+import pandas as pd
+from sqlalchemy import text
+
+from utils.logging import getLogger
+from utils.query_settings import get_profile_query_setting
+
+logger = getLogger()
+
+# 单次查询返回的最大行数和内存大小, 可以通过 PROFILE_QUERY_SETTINGS 的 max_rows / max_bytes 按 profile 覆盖
+SQL_RESULT_MAX_ROWS = int(os.getenv('SQL_RESULT_MAX_ROWS', '10000'))
+SQL_RESULT_MAX_BYTES = int(os.getenv('SQL_RESULT_MAX_BYTES', str(64 * 1024 * 1024)))
+SQL_FETCH_CHUNK_SIZE = int(os.getenv('SQL_FETCH_CHUNK_SIZE', '1000'))
+# 结果被截断时是否再执行一次 COUNT(*) 得到总行数, 可以通过 count_total 按 profile 覆盖
+SQL_RESULT_COUNT_TOTAL = os.getenv('SQL_RESULT_COUNT_TOTAL', 'false').lower() == 'true'
+
+# drivers whose streaming cursor reads every remaining row of the result when it is closed
+_DRAIN_ON_CLOSE_DRIVERS = ('pymysql', 'mysqldb', 'mysqlconnector')
+
+
+def get_fetch_limits(profile_name):
+    """
+    Return (max_rows, max_bytes, count_total) of the profile
+    """
+    max_rows = int(get_profile_query_setting(profile_name, 'max_rows', SQL_RESULT_MAX_ROWS))
+    max_bytes = int(get_profile_query_setting(profile_name, 'max_bytes', SQL_RESULT_MAX_BYTES))
+    count_total = bool(get_profile_query_setting(profile_name, 'count_total', SQL_RESULT_COUNT_TOTAL))
+    return max_rows, max_bytes, count_total
+
+
+def fetch_dataframe(connection, sql, max_rows=SQL_RESULT_MAX_ROWS, max_bytes=SQL_RESULT_MAX_BYTES,
+                    chunk_size=SQL_FETCH_CHUNK_SIZE):
+    """
+    Execute the SQL with a server side cursor where the driver supports it and read the rows chunk by chunk,
+    stopping at max_rows rows or max_bytes of DataFrame memory, None for no cap.
+    A truncated result of a MySQL driver drops the connection instead of reading the rest of the result.
+    Returns (DataFrame, truncated).
+    """
+    result = connection.execution_options(stream_results=True).execute(text(sql))
+    try:
+        if not result.returns_rows:
+            return pd.DataFrame(), False
+        columns = list(result.keys())
+        rows = []
+        fetched_bytes = 0
+        truncated = False
+        while True:
+            remaining = chunk_size if max_rows is None else max_rows - len(rows)
+            if remaining <= 0:
+                truncated = result.fetchone() is not None
+                break
+            chunk = result.fetchmany(max(1, min(chunk_size, remaining)))
+            if not chunk:
+                break
+            chunk_bytes = int(pd.DataFrame.from_records(chunk, columns=columns, coerce_float=True)
+                              .memory_usage(deep=True, index=False).sum())
+            if max_bytes is not None and fetched_bytes + chunk_bytes > max_bytes:
+                row_bytes = chunk_bytes / len(chunk)
+                rows.extend(chunk[:int((max_bytes - fetched_bytes) // row_bytes)])
+                truncated = True
+                break
+            fetched_bytes += chunk_bytes
+            rows.extend(chunk)
+    finally:
+        if truncated and connection.dialect.driver in _DRAIN_ON_CLOSE_DRIVERS:
+            # closing the unbuffered cursor would transfer the rest of the result, the connection is closed
+            # instead, the server aborts the query and the pool opens a new connection
+            connection.invalidate()
+            try:
+                result.close()
+            except Exception as e:
+                logger.info(f"Closed the truncated result on an invalidated connection: {e}")
+        else:
+            result.close()
+    if truncated:
+        logger.warning(f"Query result truncated to {len(rows)} rows (max_rows {max_rows}, max_bytes {max_bytes})")
+    return pd.DataFrame.from_records(rows, columns=columns, coerce_float=True), truncated
+
+
+def count_rows(connection, sql):
+    """
+    Total row count of the SQL, None when the database can not count it
+    """
+    try:
+        count_sql = f"SELECT COUNT(*) FROM ({sql.strip().rstrip(';')}) genbi_total_count"
+        return int(connection.execute(text(count_sql)).scalar())
+    except Exception as e:
+        logger.warning(f"Failed to count the total rows of the query: {e}")
+        return None
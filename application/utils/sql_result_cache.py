@@ -0,0 +1,179 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import sqlparse
+
+from utils.logging import getLogger
+from utils.query_settings import get_profile_query_setting
+
+logger = getLogger()
+
+SQL_RESULT_CACHE_ENABLED = os.getenv('SQL_RESULT_CACHE_ENABLED', 'false').lower() == 'true'
+# 默认结果缓存时间（秒）, 可以通过 PROFILE_QUERY_SETTINGS 的 result_cache_ttl 按 profile 覆盖, 0 表示不缓存
+SQL_RESULT_CACHE_TTL = int(os.getenv('SQL_RESULT_CACHE_TTL', '300'))
+SQL_RESULT_CACHE_MAX_BYTES = int(os.getenv('SQL_RESULT_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+# 超过这个大小的结果不缓存, 避免一个大结果挤掉所有其他结果
+SQL_RESULT_CACHE_MAX_ENTRY_BYTES = int(os.getenv('SQL_RESULT_CACHE_MAX_ENTRY_BYTES', str(8 * 1024 * 1024)))
+
+
+def normalize_sql(sql):
+    """
+    Strip the comments and collapse the whitespace outside of the literals, the literals are kept as they are
+    """
+    try:
+        stripped_sql = sqlparse.format(sql, strip_comments=True)
+        tokens = []
+        for token in sqlparse.parse(stripped_sql)[0].flatten():
+            if token.is_whitespace:
+                if tokens and tokens[-1] != ' ':
+                    tokens.append(' ')
+            else:
+                tokens.append(token.value)
+        normalized_sql = ''.join(tokens).strip()
+    except Exception as e:
+        logger.warning(f"Failed to normalize SQL, using the raw text: {e}")
+        normalized_sql = sql.strip()
+    return normalized_sql.rstrip(';').strip()
+
+
+class ColumnarResult:
+    """
+    Compact copy of a query result DataFrame: numeric and datetime columns are kept as numpy arrays,
+    the other columns are dictionary encoded (int32 codes + distinct values).
+    """
+
+    def __init__(self, data):
+        self.columns = list(data.columns)
+        self.row_count = len(data)
+        self.values = []
+        self.nbytes = 0
+        for position in range(len(self.columns)):
+            series = data.iloc[:, position]
+            if series.dtype.kind in 'biufcmM':
+                column = ('array', series.to_numpy(copy=True))
+                self.nbytes += column[1].nbytes
+            else:
+                codes, uniques = pd.factorize(series, use_na_sentinel=False)
+                uniques = np.asarray(uniques, dtype=object)
+                column = ('dictionary', codes.astype(np.int32), uniques, series.dtype)
+                self.nbytes += column[1].nbytes + sum(len(str(each)) + 49 for each in uniques)
+            self.values.append(column)
+
+    def to_dataframe(self):
+        decoded_columns = {}
+        for position, column in enumerate(self.values):
+            if column[0] == 'array':
+                decoded_columns[position] = column[1].copy()
+            else:
+                decoded_columns[position] = pd.Series(column[2].take(column[1]), dtype=column[3])
+        data = pd.DataFrame(decoded_columns, index=range(self.row_count))
+        data.columns = self.columns
+        return data
+
+
+class SQLResultCache:
+    """
+    Cache of successful query results in front of the database, keyed by (connection, normalized SQL, RLS user).
+    Entries expire after the TTL of their profile, the least recently used entries are evicted once the
+    stored results exceed SQL_RESULT_CACHE_MAX_BYTES.
+    """
+    _entries = OrderedDict()
+    _lock = threading.Lock()
+    total_bytes = 0
+    hits = 0
+    misses = 0
+    evictions = 0
+
+    @classmethod
+    def get_ttl(cls, profile_name):
+        return int(get_profile_query_setting(profile_name, 'result_cache_ttl', SQL_RESULT_CACHE_TTL))
+
+    @classmethod
+    def is_enabled(cls, profile_name):
+        return SQL_RESULT_CACHE_ENABLED and cls.get_ttl(profile_name) > 0
+
+    @classmethod
+    def build_key(cls, database_profile, sql, username):
+        connection = database_profile.get('conn_name') or database_profile.get('db_url') or ''
+        # 开启行级权限时结果和用户相关
+        rls_user = username if database_profile.get('row_level_security_config') else ''
+        raw_key = '\x1f'.join([str(connection), normalize_sql(sql), str(rls_user or '')])
+        return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def _remove(cls, key):
+        entry = cls._entries.pop(key)
+        cls.total_bytes -= entry['result'].nbytes
+
+    @classmethod
+    def get(cls, key):
+        """
+        Return (DataFrame rebuilt from the cache, attributes given to put), or None
+        """
+        with cls._lock:
+            entry = cls._entries.get(key)
+            if entry is not None and entry['expire_at'] <= time.time():
+                cls._remove(key)
+                entry = None
+            if entry is None:
+                cls.misses += 1
+                return None
+            cls._entries.move_to_end(key)
+            cls.hits += 1
+            result = entry['result']
+            attributes = dict(entry['attributes'])
+        return result.to_dataframe(), attributes
+
+    @classmethod
+    def put(cls, key, data, ttl, conn_name='', attributes=None):
+        if ttl <= 0 or not isinstance(data, pd.DataFrame):
+            return
+        try:
+            result = ColumnarResult(data)
+        except Exception as e:
+            logger.error(f"Failed to encode query result for the result cache: {e}")
+            return
+        if result.nbytes > min(SQL_RESULT_CACHE_MAX_ENTRY_BYTES, SQL_RESULT_CACHE_MAX_BYTES):
+            return
+        with cls._lock:
+            if key in cls._entries:
+                cls._remove(key)
+            cls._entries[key] = {'result': result, 'expire_at': time.time() + ttl, 'conn_name': conn_name,
+                                 'attributes': dict(attributes or {})}
+            cls.total_bytes += result.nbytes
+            while cls.total_bytes > SQL_RESULT_CACHE_MAX_BYTES:
+                cls._remove(next(iter(cls._entries)))
+                cls.evictions += 1
+
+    @classmethod
+    def invalidate(cls, conn_name=None):
+        """
+        Drop the results of one connection, or everything when no connection is given
+        """
+        with cls._lock:
+            if conn_name is None:
+                cls._entries.clear()
+                cls.total_bytes = 0
+            else:
+                for key in [key for key, entry in cls._entries.items() if entry['conn_name'] == conn_name]:
+                    cls._remove(key)
+
+    @classmethod
+    def get_stats(cls):
+        with cls._lock:
+            total = cls.hits + cls.misses
+            return {
+                'enabled': SQL_RESULT_CACHE_ENABLED,
+                'entries': len(cls._entries),
+                'bytes': cls.total_bytes,
+                'max_bytes': SQL_RESULT_CACHE_MAX_BYTES,
+                'hits': cls.hits,
+                'misses': cls.misses,
+                'evictions': cls.evictions,
+                'hit_ratio': round(cls.hits / total, 4) if total else 0.0,
+            }
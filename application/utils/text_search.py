@@ -1,89 +1,115 @@
 from api.enum import ContentEnum
 from utils.llm import text_to_sql
 from utils.logging import getLogger
-from utils.opensearch import get_retrieve_opensearch
+from utils.opensearch import get_retrieve_opensearch, RetrievalBatcher
 from utils.tool import get_generated_sql
 
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import  WebSocket
 from utils.tool import serialize_timestamp
 
 logger = getLogger()
 
+# 同时生成 SQL 的 agent 子任务数
+AGENT_TASK_CONCURRENCY = int(os.getenv('AGENT_TASK_CONCURRENCY', '4'))
 
-def entity_retrieve_search(entity_slot, opensearch_info, selected_profile):
+
+def merge_entity_retrieve(entity_retrieve_list):
+    """
+    Flatten the per slot entity hits, keeping the first hit of every entity name
+    """
     entity_slot_retrieve = []
     entity_name_set = set()
-    for each_entity in entity_slot:
-        entity_retrieve = get_retrieve_opensearch(opensearch_info, each_entity, "ner",
-                                                  selected_profile, 3, 0.3)
-        if len(entity_retrieve) > 0:
-            for each_entity_retrieve in entity_retrieve:
-                if each_entity_retrieve['_source']['entity'] not in entity_name_set:
-                    entity_name_set.add(each_entity_retrieve['_source']['entity'])
-                    entity_slot_retrieve.append(each_entity_retrieve)
+    for entity_retrieve in entity_retrieve_list:
+        for each_entity_retrieve in entity_retrieve:
+            if each_entity_retrieve['_source']['entity'] not in entity_name_set:
+                entity_name_set.add(each_entity_retrieve['_source']['entity'])
+                entity_slot_retrieve.append(each_entity_retrieve)
     return entity_slot_retrieve
 
 
-def qa_retrieve_search(search_box, opensearch_info, selected_profile):
+def entity_retrieve_search(entity_slot, opensearch_info, selected_profile, embedding_context=None):
+    if len(entity_slot) == 0:
+        return []
+    batcher = RetrievalBatcher(opensearch_info, selected_profile, embedding_context)
+    for each_entity in entity_slot:
+        batcher.add(each_entity, "ner", 3, 0.3)
+    return merge_entity_retrieve(batcher.execute())
+
+
+def qa_retrieve_search(search_box, opensearch_info, selected_profile, embedding_context=None):
     qa_retrieve = []
     qa_retrieve = get_retrieve_opensearch(opensearch_info, search_box, "query",
-                                          selected_profile, 3, 0.3)
+                                          selected_profile, 3, 0.3, embedding_context)
     return qa_retrieve
 
-def agent_text_search(search_box, model_type, database_profile, entity_slot, opensearch_info, selected_profile, use_rag,
-                      agent_cot_task_result):
-    agent_search_results = []
-    default_agent_search_results = []
-    default_each_res_dict = {}
-    default_each_res_dict["query"] = search_box
-    default_each_res_dict["response"] = ""
-    default_each_res_dict["sql"] = "-1"
-    token_info = {}
-    token_info["input_tokens"] = 0
-    token_info["output_tokens"] = 0
+
+def entity_qa_retrieve_search(entity_slot, search_box, opensearch_info, selected_profile, embedding_context=None):
+    """
+    Entity and QA retrieval in one msearch, returns (entity_slot_retrieve, qa_retrieve)
+    """
+    batcher = RetrievalBatcher(opensearch_info, selected_profile, embedding_context)
+    for each_entity in entity_slot:
+        batcher.add(each_entity, "ner", 3, 0.3)
+    qa_position = batcher.add(search_box, "query", 3, 0.3)
+    results = batcher.execute()
+    return merge_entity_retrieve(results[:qa_position]), results[qa_position]
+
+
+def agent_task_retrieve_search(agent_cot_task_result, opensearch_info, selected_profile, embedding_context=None):
+    """
+    Entity and QA retrieval of every agent sub-task in one msearch,
+    returns {task: (entity_slot_retrieve, retrieve_result)}
+    """
+    batcher = RetrievalBatcher(opensearch_info, selected_profile, embedding_context)
+    for each_task in agent_cot_task_result:
+        batcher.add(agent_cot_task_result[each_task], "ner", 3, 0.5)
+        batcher.add(agent_cot_task_result[each_task], "query", 3, 0.5)
+    results = batcher.execute()
+    task_retrieve = {}
+    for index, each_task in enumerate(agent_cot_task_result):
+        task_retrieve[each_task] = (results[2 * index], results[2 * index + 1])
+    return task_retrieve
+
+
+def agent_task_text_to_sql(each_task_query, model_type, database_profile, entity_slot_retrieve, retrieve_result,
+                           task_state, progress_callback=None, embedding_context=None):
+    """
+    Generate the SQL of one agent sub-task, returns (each_res_dict, token_info)
+    """
+    if progress_callback is not None:
+        progress_callback(task_state, "start")
     try:
-        for each_task in agent_cot_task_result:
-            each_res_dict = {}
-            each_task_query = agent_cot_task_result[each_task]
-            each_res_dict["query"] = each_task_query
-            entity_slot_retrieve = []
-            retrieve_result = []
-            if use_rag:
-                entity_slot_retrieve = get_retrieve_opensearch(opensearch_info, each_task_query, "ner",
-                                                               selected_profile, 3, 0.5)
-
-                retrieve_result = get_retrieve_opensearch(opensearch_info, each_task_query, "query",
-                                                          selected_profile, 3, 0.5)
-            each_task_response, model_response = text_to_sql(database_profile['tables_info'],
-                                                             database_profile['hints'],
-                                                             database_profile['prompt_map'],
-                                                             each_task_query,
-                                                             model_id=model_type,
-                                                             sql_examples=retrieve_result,
-                                                             ner_example=entity_slot_retrieve,
-                                                             dialect=database_profile['db_type'],
-                                                             model_provider=None)
-            if model_response.token_info is not None and len(model_response.token_info) > 0:
-                sub_token_info = model_response.token_info
-                if "input_tokens" in sub_token_info:
-                    token_info["input_tokens"] = token_info["input_tokens"] + sub_token_info["input_tokens"]
-                if "output_tokens" in sub_token_info:
-                    token_info["output_tokens"] = token_info["output_tokens"] + sub_token_info["output_tokens"]
-            each_task_sql = get_generated_sql(each_task_response)
-            each_res_dict["response"] = each_task_response
-            each_res_dict["sql"] = each_task_sql
-            if each_res_dict["sql"] != "":
-                agent_search_results.append(each_res_dict)
-        return agent_search_results, token_info
-    except Exception as e:
-        logger.error(e)
-    return default_agent_search_results, token_info
+        each_task_response, model_response = text_to_sql(database_profile['tables_info'],
+                                                         database_profile['hints'],
+                                                         database_profile['prompt_map'],
+                                                         each_task_query,
+                                                         model_id=model_type,
+                                                         sql_examples=retrieve_result,
+                                                         ner_example=entity_slot_retrieve,
+                                                         dialect=database_profile['db_type'],
+                                                         model_provider=None,
+                                                         embedding_context=embedding_context)
+    finally:
+        if progress_callback is not None:
+            progress_callback(task_state, "end")
+    each_res_dict = {}
+    each_res_dict["query"] = each_task_query
+    each_res_dict["response"] = each_task_response
+    each_res_dict["sql"] = get_generated_sql(each_task_response)
+    return each_res_dict, model_response.token_info
 
 
-async def agent_text_search_websocket(websocket, session_id, user_id, search_box, model_type, database_profile,
-                                      entity_slot, opensearch_info, selected_profile, use_rag,
-                                      agent_cot_task_result):
+def agent_text_search(search_box, model_type, database_profile, entity_slot, opensearch_info, selected_profile, use_rag,
+                      agent_cot_task_result, embedding_context=None, progress_callback=None):
+    """
+    Generate the SQL of every agent sub-task, at most AGENT_TASK_CONCURRENCY sub-tasks run at the same time.
+    Results keep the task order, a failed sub-task is logged and left out without aborting the others.
+
+    :param progress_callback: optional callable(text, status), called with "start" / "end" for every sub-task
+    """
     agent_search_results = []
     default_agent_search_results = []
     default_each_res_dict = {}
@@ -93,43 +119,34 @@ async def agent_text_search_websocket(websocket, session_id, user_id, search_box
     token_info = {}
     token_info["input_tokens"] = 0
     token_info["output_tokens"] = 0
-    index = 1
     try:
-        for each_task in agent_cot_task_result:
-            await response_websocket(websocket, session_id, "Agent SQL Task_{index} Generating".format(index=str(index)),
-                                     ContentEnum.STATE,"start", user_id)
-            each_res_dict = {}
-            each_task_query = agent_cot_task_result[each_task]
-            each_res_dict["query"] = each_task_query
-            entity_slot_retrieve = []
-            retrieve_result = []
-            if use_rag:
-                entity_slot_retrieve = get_retrieve_opensearch(opensearch_info, each_task_query, "ner",
-                                                               selected_profile, 3, 0.5)
-
-                retrieve_result = get_retrieve_opensearch(opensearch_info, each_task_query, "query",
-                                                          selected_profile, 3, 0.5)
-            each_task_response, model_response = text_to_sql(database_profile['tables_info'],
-                                                             database_profile['hints'],
-                                                             database_profile['prompt_map'],
-                                                             each_task_query,
-                                                             model_id=model_type,
-                                                             sql_examples=retrieve_result,
-                                                             ner_example=entity_slot_retrieve,
-                                                             dialect=database_profile['db_type'],
-                                                             model_provider=None)
-            await response_websocket(websocket, session_id, "Agent SQL Task_{index} Generating".format(index=str(index)),  ContentEnum.STATE,
-                                     "end", user_id)
-            index = index + 1
-            if model_response.token_info is not None and len(model_response.token_info) > 0:
-                sub_token_info = model_response.token_info
+        task_retrieve = {}
+        if use_rag:
+            # 所有子任务的 ner 和 query 检索合并为一次 msearch
+            task_retrieve = agent_task_retrieve_search(agent_cot_task_result, opensearch_info, selected_profile,
+                                                       embedding_context)
+        if len(agent_cot_task_result) == 0:
+            return agent_search_results, token_info
+        futures = []
+        with ThreadPoolExecutor(max_workers=max(1, min(AGENT_TASK_CONCURRENCY, len(agent_cot_task_result)))) as executor:
+            for index, each_task in enumerate(agent_cot_task_result, start=1):
+                entity_slot_retrieve, retrieve_result = task_retrieve.get(each_task, ([], []))
+                task_state = "Agent SQL Task_{index} Generating".format(index=str(index))
+                futures.append((each_task, executor.submit(agent_task_text_to_sql, agent_cot_task_result[each_task],
+                                                           model_type, database_profile, entity_slot_retrieve,
+                                                           retrieve_result, task_state, progress_callback,
+                                                           embedding_context)))
+        for each_task, future in futures:
+            try:
+                each_res_dict, sub_token_info = future.result()
+            except Exception as e:
+                logger.error(f"Agent sub-task {each_task} failed to generate SQL: {e}")
+                continue
+            if sub_token_info is not None and len(sub_token_info) > 0:
                 if "input_tokens" in sub_token_info:
                     token_info["input_tokens"] = token_info["input_tokens"] + sub_token_info["input_tokens"]
                 if "output_tokens" in sub_token_info:
                     token_info["output_tokens"] = token_info["output_tokens"] + sub_token_info["output_tokens"]
-            each_task_sql = get_generated_sql(each_task_response)
-            each_res_dict["response"] = each_task_response
-            each_res_dict["sql"] = each_task_sql
             if each_res_dict["sql"] != "":
                 agent_search_results.append(each_res_dict)
         return agent_search_results, token_info